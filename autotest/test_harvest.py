@@ -0,0 +1,274 @@
+import copy
+import itertools
+import logging
+import pathlib as pl
+import sys
+
+import numpy as np
+
+try:
+    import mf6adj
+except ImportError:
+    sys.path.insert(0, str(pl.Path("../").resolve()))
+    import mf6adj
+
+from mf6adj.harvest import Harvester
+
+gwf_package_dict = {"wel6": ["wel_0"], "ghb6": ["ghb_0"], "rch6": ["rch_0"]}
+gwf_package_types = ["wel6", "ghb6", "rch6"]
+gwf_boundary_attr_dict = {
+    "wel6": ["q"],
+    "ghb6": ["bhead", "cond"],
+    "rch6": ["recharge"],
+}
+
+
+class ApiDouble(object):
+    """A scripted stand-in for the MODFLOW6 API: every time step fills the arrays
+    with new values in place (like MODFLOW6 does) and the boundary package
+    arrays are reallocated (new arrays) at the start of every stress period, as
+    MODFLOW6 does when new boundary data grow a package"""
+
+    def __init__(self, seed=0, nper=3, nstp=2, nnode=20):
+        self.rng = np.random.default_rng(seed)
+        self.nper, self.nstp, self.nnode = nper, nstp, nnode
+        self.step = 0
+        self.mem = {}
+        m = self.mem
+        m["TDIS/KPER"] = np.array([0])
+        m["TDIS/KSTP"] = np.array([0])
+        m["SLN_1/MXITER"] = np.array([5])
+        m["GWF/DIS/NODES"] = np.array([nnode])
+        m["GWF/INEWTON"] = np.array([0])
+        m["SLN_1/AMAT"] = np.zeros(nnode * 5)
+        # the model arrays are longer than the number of nodes
+        m["GWF/X"] = np.zeros(nnode + 3)
+        m["GWF/XOLD"] = np.zeros(nnode + 3)
+        for name in ["K11", "K33", "SAT"]:
+            m[f"GWF/NPF/{name}"] = np.zeros(nnode)
+        m["GWF/NPF/CONDSAT"] = np.zeros(nnode * 2)
+        m["GWF/ISS"] = np.array([0])
+        m["GWF/DIS/TOP"] = self.rng.uniform(1.0, 2.0, nnode)
+        m["GWF/DIS/BOT"] = self.rng.uniform(-4.0, -3.0, nnode)
+        m["GWF/DIS/AREA"] = self.rng.uniform(1.0, 2.0, nnode)
+        m["GWF/STO/ICONVERT"] = self.rng.integers(0, 2, nnode)
+        m["GWF/STO/SS"] = self.rng.uniform(1.0e-5, 1.0e-4, nnode)
+        # the recharge package keeps its values in the attribute array only
+        self.packages = {
+            "WEL_0": (["Q"], 1),
+            "GHB_0": (["BHEAD", "COND"], 2),
+            "RCH_0": (["RECHARGE"], 0),
+        }
+        self.allocate(8)
+
+    def allocate(self, maxbound):
+        m = self.mem
+        for pname, (attrs, ncol) in self.packages.items():
+            m[f"GWF/{pname}/NBOUND"] = np.array([0])
+            m[f"GWF/{pname}/NODELIST"] = np.zeros(maxbound, dtype=np.int32)
+            m[f"GWF/{pname}/BOUND"] = np.zeros((maxbound, ncol))
+            for name in ["HCOF", "RHS", "SIMVALS", *attrs]:
+                m[f"GWF/{pname}/{name}"] = np.zeros(maxbound)
+
+    def get_var_address(self, var, comp, subcomp=""):
+        return "/".join([x.upper() for x in [comp, subcomp, var] if x])
+
+    def get_value(self, addr):
+        return self.mem[addr].copy()
+
+    def get_value_ptr(self, addr):
+        return self.mem[addr]
+
+    def get_input_var_names(self):
+        return ["GWF/STO/ICONVERT"]
+
+    def get_current_time(self):
+        return float(self.step)
+
+    def get_end_time(self):
+        return float(self.nper * self.nstp)
+
+    def get_time_step(self):
+        return 1.0
+
+    def prepare_time_step(self, dt):
+        m = self.mem
+        kper, kstp = divmod(self.step, self.nstp)
+        m["TDIS/KPER"][0] = kper + 1
+        m["TDIS/KSTP"][0] = kstp + 1
+        if kstp == 0:
+            if kper > 0:
+                self.allocate(8 + 2 * kper)
+            for pname in self.packages:
+                # no wells in the last stress period
+                nbound = 0 if pname == "WEL_0" and kper == self.nper - 1 else 5
+                m[f"GWF/{pname}/NBOUND"][0] = nbound
+                m[f"GWF/{pname}/NODELIST"][:nbound] = self.rng.choice(
+                    np.arange(1, self.nnode + 1), nbound, replace=False
+                )
+
+    def prepare_solve(self, isol):
+        self.mem["GWF/NPF/SAT"][:] = self.rng.uniform(0.5, 1.0, self.nnode)
+
+    def solve(self, isol):
+        m = self.mem
+        for name in [
+            "SLN_1/AMAT",
+            "GWF/X",
+            "GWF/XOLD",
+            "GWF/NPF/K11",
+            "GWF/NPF/K33",
+            "GWF/NPF/CONDSAT",
+            "GWF/NPF/SAT",
+        ]:
+            m[name][:] = self.rng.normal(size=m[name].shape)
+        for pname, (attrs, _) in self.packages.items():
+            for name in ["BOUND", "HCOF", "RHS", "SIMVALS", *attrs]:
+                arr = m[f"GWF/{pname}/{name}"]
+                arr[...] = self.rng.normal(size=arr.shape)
+        return True
+
+    def finalize_solve(self, isol):
+        pass
+
+    def finalize_time_step(self):
+        self.step += 1
+
+
+def read_step(api, sat_old):
+    """the solution components of a time step through get_value(), the way
+    solve_gwf() read them before the Harvester"""
+    nnode = api.get_value(api.get_var_address("NODES", "GWF", "DIS"))[0]
+    data = {
+        "amat": api.get_value(api.get_var_address("AMAT", "SLN_1")),
+        "head": api.get_value(api.get_var_address("X", "GWF"))[:nnode],
+        "head_old": api.get_value(api.get_var_address("XOLD", "GWF"))[:nnode],
+        "k11": api.get_value(api.get_var_address("K11", "GWF", "NPF")),
+        "k33": api.get_value(api.get_var_address("K33", "GWF", "NPF")),
+        "condsat": api.get_value(api.get_var_address("CONDSAT", "GWF", "NPF")),
+        "iss": api.get_value(api.get_var_address("ISS", "GWF")),
+        "sat": api.get_value(api.get_var_address("SAT", "GWF", "NPF")),
+        "sat_old": sat_old,
+    }
+    packages = []
+    for ptype in gwf_package_types:
+        for tag in gwf_package_dict[ptype]:
+            nbound = api.get_value(api.get_var_address("NBOUND", "GWF", tag.upper()))[0]
+            if nbound <= 0:
+                continue
+            pdata = {"ptype": ptype}
+            for name in Harvester._package_vars:
+                pdata[name] = api.get_value(
+                    api.get_var_address(name.upper(), "GWF", tag.upper())
+                )
+            attrs = gwf_boundary_attr_dict[ptype]
+            if pdata["bound"].size == 0:
+                pdata["bound"] = np.zeros((len(pdata["nodelist"]), len(attrs)))
+                for i, attr in enumerate(attrs):
+                    pdata["bound"][:, i] = api.get_value(
+                        api.get_var_address(attr.upper(), "GWF", tag.upper())
+                    )
+            for attr in attrs:
+                pdata[attr] = api.get_value(
+                    api.get_var_address(attr.upper(), "GWF", tag.upper())
+                )
+            packages.append((ptype, tag, int(nbound), pdata))
+    return data, packages
+
+
+def assert_same(a, b):
+    assert list(a.keys()) == list(b.keys()), (list(a.keys()), list(b.keys()))
+    for name in a:
+        if isinstance(a[name], str):
+            assert a[name] == b[name], name
+        else:
+            assert np.array_equal(a[name], b[name]), name
+
+
+def test_harvester():
+    api = ApiDouble()
+    harvester = Harvester(
+        api,
+        "gwf",
+        gwf_package_dict,
+        gwf_package_types,
+        gwf_boundary_attr_dict,
+        has_sto=True,
+    )
+    assert sorted(harvester.grid.keys()) == ["area", "bot", "iconvert", "ss", "top"]
+    sat_old, prev, prev_sat = None, None, None
+    nsteps = api.nper * api.nstp
+    for _ in range(nsteps):
+        api.prepare_time_step(1.0)
+        api.prepare_solve(1)
+        harvester.init_sat_old()
+        if sat_old is None:
+            sat_old = api.get_value(api.get_var_address("SAT", "GWF", "NPF"))
+        api.solve(1)
+        api.finalize_solve(1)
+
+        data = harvester.harvest()
+        ref, ref_packages = read_step(api, sat_old)
+        assert_same(data, ref)
+        packages = harvester.harvest_packages()
+        assert [p[:3] for p in packages] == [p[:3] for p in ref_packages]
+        for (_, _, _, pdata), (_, _, _, ref_pdata) in zip(packages, ref_packages):
+            assert_same(pdata, ref_pdata)
+
+        if prev is not None:
+            # the buffers are reused: last time step's arrays now hold this one
+            for name in Harvester._solution_vars:
+                if name != "sat":
+                    assert data[name] is prev[name], name
+            # and last time step's saturation buffer is this one's 'sat_old'
+            assert data["sat_old"] is prev_sat
+            assert data["sat"] is not data["sat_old"]
+        prev = data
+        prev_sat = data["sat"]
+        sat_old = ref["sat"].copy()
+        api.finalize_time_step()
+    # the wells of the last stress period are skipped
+    assert "wel6" not in [p[0] for p in packages]
+
+
+def test_harvest_func_ptr():
+    adj = object.__new__(mf6adj.Mf6Adj)
+    adj._gwf = ApiDouble(seed=1)
+    adj._gwf_name = "gwf"
+    adj._gwf_package_dict = gwf_package_dict
+    adj._gwf_boundary_attr_dict = gwf_boundary_attr_dict
+    adj._gwf_package_types = gwf_package_types
+    adj._hdf5_name = None
+    adj._writer = None
+    adj.logger = logging.getLogger(logging.__name__ + ".test_harvest")
+
+    passed, copies = [], []
+    state = {"sat_old": None}
+
+    def harvest_func_ptr(kperkstp, data_dict, attr_dict):
+        api = adj._gwf
+        if state["sat_old"] is None:
+            state["sat_old"] = data_dict["sat_old"].copy()
+        ref, ref_packages = read_step(api, state["sat_old"])
+        for name, arr in ref.items():
+            assert np.array_equal(data_dict[name], arr), (kperkstp, name)
+        for _, tag, _, ref_pdata in ref_packages:
+            assert_same(data_dict[tag], ref_pdata)
+        state["sat_old"] = ref["sat"].copy()
+        passed.append(data_dict)
+        copies.append(copy.deepcopy(data_dict))
+
+    adj.solve_gwf(verbose=False, write_hdf5=False, harvest_func_ptr=harvest_func_ptr)
+    assert len(copies) == adj._gwf.nper * adj._gwf.nstp
+    # the arrays passed to the function are buffers reused by the next time step
+    for data in passed[1:]:
+        assert data["head"] is passed[0]["head"]
+    assert np.array_equal(passed[0]["head"], copies[-1]["head"])
+    assert not np.array_equal(copies[0]["head"], copies[-1]["head"])
+    for prev, data in itertools.pairwise(copies):
+        assert np.array_equal(data["sat_old"], prev["sat"])
+
+
+if __name__ == "__main__":
+    test_harvester()
+    test_harvest_func_ptr()
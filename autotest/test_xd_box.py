@@ -1,3 +1,4 @@
+import asyncio
 import os
 import pathlib as pl
 import platform
@@ -5,6 +6,7 @@ import shutil
 import sys
 
 import flopy
+import h5py
 import matplotlib.pyplot as plt
 import modflowapi
 import numpy as np
@@ -1995,6 +1997,1017 @@ def nested_test():
 
 
 
+def setup_xd_box_adj(new_d, nper=3, nlay=3, nrow=5, ncol=5):
+    """setup a transient xd box model and a test.adj file with a direct head,
+    a residual head and a ghb flux performance measure
+    """
+    sim = setup_xd_box_model(
+        new_d,
+        nper=nper,
+        nrow=nrow,
+        ncol=ncol,
+        nlay=nlay,
+        q=-3,
+        icelltype=1,
+        iconvert=1,
+        newton=True,
+        delr=10.0,
+        delc=10.0,
+        full_sat_bnd=False,
+        botm=[-10 * (10**k) for k in range(nlay)],
+        alt_bnd="riv",
+        sp_len=10,
+    )
+    gwf = sim.get_model()
+    with open(os.path.join(new_d, "test.adj"), "w") as f:
+        f.write("\nbegin options\nhdf5_name out.h5\nend options\n\n")
+        f.write("begin performance_measure direct\n")
+        for kper in range(nper):
+            f.write(f"{kper + 1} 1 {nlay} 2 2 head direct 1.0 -1e+30\n")
+        f.write("end performance_measure\n\n")
+        f.write("begin performance_measure phi\n")
+        for kper in range(nper):
+            f.write(f"{kper + 1} 1 1 3 3 head residual 2.0 1.0\n")
+            f.write(f"{kper + 1} 1 {nlay} 4 2 head residual 1.0 -1.0\n")
+        f.write("end performance_measure\n\n")
+        f.write("begin performance_measure ghb_flux\n")
+        for kper in range(nper):
+            ghb = gwf.get_package("ghb_0").stress_period_data.array[kper]
+            for k, i, j in ghb["cellid"]:
+                f.write(
+                    f"{kper + 1} 1 {k + 1} {i + 1} {j + 1} ghb_0 direct 1.0 -1e+30\n"
+                )
+        f.write("end performance_measure\n\n")
+    return sim
+
+
+def test_xd_box_max_memory():
+    new_d = "xd_box_max_memory_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+
+    with h5py.File("out.h5", "r") as hdf:
+        nnodes = hdf["gwf_info"]["nnodes"][0]
+        nnz = hdf["gwf_info"]["ja"].shape[0]
+    ncomp = dfs["direct"].shape[1]
+    # a budget that only fits with the composites spilled to disk
+    spill_est = mf6adj.PerfMeas.estimate_adjoint_memory(nnodes, nnz, ncomp, spill=True)
+    budget = sum(spill_est.values()) + 1
+    dfs_budget = adj.solve_adjoint(max_memory=budget)
+    for name, df in dfs.items():
+        assert np.allclose(df.values, dfs_budget[name].loc[:, df.columns].values)
+
+    # a budget that can't fit should fail before solving
+    try:
+        adj.solve_adjoint(max_memory="1KB")
+    except Exception as e:
+        assert "exceeds the max_memory budget" in str(e)
+    else:
+        raise Exception("should have failed")
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_resume():
+    new_d = "xd_box_resume_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+
+    # interrupt the sweep right after the first checkpoint is written
+    orig = mf6adj.PerfMeas._write_checkpoint
+
+    def interrupt(*args, **kwargs):
+        orig(*args, **kwargs)
+        raise KeyboardInterrupt()
+
+    mf6adj.PerfMeas._write_checkpoint = staticmethod(interrupt)
+    try:
+        adj.solve_adjoint(checkpoint_interval=1)
+    except KeyboardInterrupt:
+        pass
+    else:
+        raise Exception("should have been interrupted")
+    finally:
+        mf6adj.PerfMeas._write_checkpoint = staticmethod(orig)
+    fname = "adjoint_solution_direct_out.h5"
+    with h5py.File(fname, "r") as adf:
+        assert "checkpoint_0" in adf or "checkpoint_1" in adf
+        assert "composite" not in adf
+
+    dfs_resume = adj.solve_adjoint(checkpoint_interval=1, resume=True)
+    for name, df in dfs.items():
+        assert np.allclose(df.values, dfs_resume[name].loc[:, df.columns].values)
+    with h5py.File(fname, "r") as adf:
+        assert "checkpoint_0" not in adf and "checkpoint_1" not in adf
+        assert "composite" in adf
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_cache():
+    new_d = "xd_box_cache_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint(cache_dir="cache")
+    cache = mf6adj.AdjointCache("cache")
+    assert len(cache) == len(dfs)
+
+    # nothing changed, so everything should come from the cache
+    os.remove("adjoint_summary_direct.csv")
+    dfs_cached = adj.solve_adjoint(cache_dir="cache")
+    assert os.path.exists("adjoint_summary_direct.csv")
+    for name, df in dfs.items():
+        assert np.allclose(df.values, dfs_cached[name].loc[:, df.columns].values)
+    assert len(mf6adj.AdjointCache("cache")) == len(dfs)
+
+    # a modified pm is solved again and added to the cache
+    adj._performance_measures[0]._entries[0].weight = 2.0
+    adj.solve_adjoint(cache_dir="cache")
+    cache = mf6adj.AdjointCache("cache")
+    assert len(cache) == len(dfs) + 1
+
+    # the adjoint solution file options are part of the key
+    adj.solve_adjoint(cache_dir="cache", write_nodes=False)
+    cache = mf6adj.AdjointCache("cache")
+    assert len(cache) == 2 * len(dfs) + 1
+
+    # the solver kwargs are left alone, so a repeated solve hits the cache
+    kwargs = {"rtol": 1.0e-10, "atol": 1.0e-10, "maxiter": 500}
+    for _ in range(2):
+        adj.solve_adjoint(cache_dir="cache", linear_solver="bicgstab",
+                          linear_solver_kwargs=kwargs)
+        assert "M" not in kwargs
+        cache = mf6adj.AdjointCache("cache")
+        assert len(cache) == 3 * len(dfs) + 1
+
+    # properties that leave the heads alone still change the forward fingerprint
+    shutil.copy("out.h5", "fingerprint.h5")
+    with h5py.File("fingerprint.h5", "a") as hdf:
+        sol_key = next(name for name in hdf.keys() if name.startswith("solution"))
+        hdf[sol_key]["k33"][:] *= 2.0
+    assert mf6adj.PerfMeas.forward_fingerprint(
+        "fingerprint.h5") != mf6adj.PerfMeas.forward_fingerprint("out.h5")
+
+    # the size limit evicts the least recently used results
+    cache = mf6adj.AdjointCache("cache", max_size=cache.size // 2)
+    cache.evict()
+    assert len(cache) < len(dfs) + 1
+    assert cache.size <= cache.max_size
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_basis():
+    new_d = "xd_box_basis_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+    dfs_basis = adj.solve_adjoint(use_basis=True)
+    for name, df in dfs.items():
+        assert np.allclose(df.values, dfs_basis[name].loc[:, df.columns].values)
+    with h5py.File("adjoint_basis_out.h5", "r") as bdf:
+        nbasis = bdf["locations"].shape[0]
+    assert nbasis == 9
+
+    # new weights and obsvals are assembled from the same basis
+    for entry in adj._performance_measures[1]._entries:
+        entry.weight *= 3.0
+        entry.obsval += 1.0
+    dfs = adj.solve_adjoint()
+    dfs_basis = adj.solve_adjoint(use_basis=True)
+    for name, df in dfs.items():
+        assert np.allclose(df.values, dfs_basis[name].loc[:, df.columns].values)
+    with h5py.File("adjoint_basis_out.h5", "r") as bdf:
+        assert bdf["locations"].shape[0] == nbasis
+
+    # basis results are cached apart from full sweeps, which have the time steps
+    adj.solve_adjoint(use_basis=True, cache_dir="cache")
+    adj.solve_adjoint(cache_dir="cache")
+    nhead = sum(not pm._entries.has_flux for pm in adj._performance_measures)
+    assert nhead > 0
+    assert len(mf6adj.AdjointCache("cache")) == len(dfs) + nhead
+    for pm in adj._performance_measures:
+        with h5py.File(pm.adjoint_solution_fname("out.h5"), "r") as adf:
+            assert any(name.startswith("solution") for name in adf.keys())
+    try:
+        adj.solve_adjoint(use_basis=True, checkpoint_interval=2)
+        raise AssertionError("should have failed")
+    except Exception as e:
+        assert "use_basis" in str(e)
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_jacobian():
+    new_d = "xd_box_jacobian_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+    jco = pyemu.Jco.from_binary(adj.solve_jacobian())
+    nrow = sum(len(pm._entries) for pm in adj._performance_measures)
+    assert jco.shape[0] == nrow
+
+    # head pms are linear in their entries, so the rows sum to the pm composites
+    for name in ["direct", "phi"]:
+        df = dfs[name]
+        rows = [r for r in jco.row_names if r.startswith(name + "_")]
+        for comp in df.columns:
+            cols = [f"{comp}_{node}" for node in df.index]
+            assert np.allclose(jco.get(row_names=rows, col_names=cols).x.sum(axis=0),
+                               df.loc[:, comp].values)
+
+    # zone aggregation sums the node columns
+    zones = np.ones((3, 5, 5), dtype=int)
+    zones[0] = 2
+    jco_z = pyemu.Jco.from_binary(
+        adj.solve_jacobian("zone.jcb", composites=["k11"], zones={"k11": zones})
+    )
+    assert jco_z.col_names == ["k11_z1", "k11_z2"]
+    k11_cols = [c for c in jco.col_names if c.startswith("k11_")]
+    assert np.allclose(jco_z.x.sum(axis=1), jco.get(col_names=k11_cols).x.sum(axis=1))
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_sketch():
+    new_d = "xd_box_sketch_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    # flux entries can't be combined
+    try:
+        adj.sketch_jacobian(2)
+    except Exception as e:
+        assert "flux entry" in str(e)
+    else:
+        raise Exception("should have failed")
+
+    adj._performance_measures = [
+        pm for pm in adj._performance_measures if pm.name != "ghb_flux"
+    ]
+    jco = pyemu.Jco.from_binary(adj.solve_jacobian())
+    sketch = adj.sketch_jacobian(4, seed=111)
+    # the sketch is J^T Omega
+    y = jco.x.T @ sketch["omega"].loc[jco.row_names, :].values
+    assert np.allclose(y, sketch["y"].loc[jco.col_names, :].values)
+    assert sketch["u"].shape == (jco.shape[1], 4)
+    assert np.all(np.diff(sketch["s"]) <= 0.0)
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_projection():
+    import scipy.sparse as sparse
+
+    new_d = "xd_box_projection_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+
+    zones = np.ones((3, 5, 5), dtype=int)
+    zones[1:] = 2
+    nnodes = dfs["direct"].shape[0]
+    factors = sparse.random(4, nnodes, density=0.5, random_state=1, format="csr")
+    proj_dfs = adj.solve_adjoint(
+        projection={"k11": zones, "ss": factors}, write_nodes=False
+    )
+    for name, df in dfs.items():
+        node_df, pdf = proj_dfs[name]
+        assert "k11" not in node_df.columns and "ss" not in node_df.columns
+        assert np.allclose(node_df.values, df.loc[:, node_df.columns].values)
+        k11 = pdf.loc[pdf.composite == "k11", "sensitivity"]
+        assert list(k11.index) == ["k11_z1", "k11_z2"]
+        assert np.isclose(k11.iloc[0], df.k11.values[:25].sum())
+        assert np.isclose(k11.iloc[1], df.k11.values[25:].sum())
+        ss = pdf.loc[pdf.composite == "ss", "sensitivity"]
+        assert np.allclose(ss.values, factors @ df.ss.values)
+        with h5py.File(f"adjoint_solution_{name}_out.h5", "r") as adf:
+            assert "composite" not in adf
+            assert "projected" in adf
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_tangent():
+    new_d = "xd_box_tangent_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+
+    nnodes = dfs["direct"].shape[0]
+    rng = np.random.default_rng(111)
+    zones = np.zeros(nnodes)
+    zones[:25] = 1.0
+    directions = {
+        "k11_zone": {"k11": zones},
+        "ss": {"ss": rng.normal(size=nnodes)},
+        "ghb": {"ghb_0_bhead": 1.0, "ghb_0_cond": rng.normal(size=nnodes)},
+    }
+    results = adj.solve_tangent(directions)
+
+    # the tangent-linear derivatives are the dual of the adjoint sensitivities
+    with h5py.File("out.h5", "r") as hdf:
+        kperkstp = [(kper, kstp) for kper, kstp in zip(hdf["aux"]["kper"],
+                                                       hdf["aux"]["kstp"])]
+        heads = [hdf[f"solution_kper:{kper:05d}_kstp:{kstp:05d}"]["head"][:]
+                 for kper, kstp in kperkstp]
+    for pm in adj._performance_measures:
+        if pm.name == "ghb_flux":
+            continue
+        for name, direction in directions.items():
+            adj_deriv = sum((dfs[pm.name][comp].values * dp).sum()
+                            for comp, dp in direction.items())
+            tl_deriv = 0.0
+            for entry in pm._entries:
+                itime = kperkstp.index(entry.kperkstp)
+                tl_deriv += (entry.dfdh(heads[itime])
+                             * results[name]["head"][itime, entry.inode])
+            assert np.isclose(adj_deriv, tl_deriv), (pm.name, name)
+    assert results["ghb"]["ghb_0"].shape[0] == len(kperkstp)
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_gauss_newton():
+    new_d = "xd_box_gauss_newton_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    adj.solve_adjoint()
+
+    pm_names = ["direct", "phi"]
+    zones = {"k11": np.arange(75).reshape((3, 5, 5)) % 4}
+    op = adj.gauss_newton_operator(pm_names=pm_names, zones=zones)
+
+    # form J^T W J explicitly from the jacobian of the same entries
+    jco_fname = adj.solve_jacobian(zones=zones)
+    jco = pyemu.Jco.from_binary(jco_fname)
+    assert op.par_names == jco.col_names
+    rows, heads, _, _, _, _, _ = adj._jacobian_setup(None, zones)
+    rows = [row for row in rows if row[1].name in pm_names]
+    jac = jco.x[[jco.row_names.index(row[0]) for row in rows], :]
+    coefs = np.array([e.dfdh(heads.get(e.kperkstp, None)) for _, _, e in rows])
+    weights = np.array([e.weight for _, _, e in rows])
+    jh = jac / coefs[:, None]
+    jtwj = jh.T @ (weights[:, None] * jh)
+
+    rng = np.random.default_rng(222)
+    v = rng.normal(size=(op.shape[0], 2))
+    assert np.allclose(op @ v[:, 0], jtwj @ v[:, 0])
+    assert np.allclose(op.matmat(v), jtwj @ v)
+    op.close()
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_value_and_grad():
+    new_d = "xd_box_value_and_grad_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    hdf5_name = adj._hdf5_name
+    dfs = adj.solve_adjoint()
+
+    zones = np.ones((3, 5, 5), dtype=int)
+    zones[0] = 2
+    svc = adj.gradient_service(["k11", "ghb_0_cond"], zones={"k11": zones},
+                               pm_names=["direct", "phi"])
+    assert len(svc.x0) == len(svc.par_names)
+    value, grad = svc.value_and_grad(svc.x0)
+    assert svc.nfwd == 1 and svc.nadj == 2
+
+    # repeated evaluations come from the cache
+    value2, grad2 = svc.value_and_grad(svc.x0.copy())
+    assert value2 == value
+    assert np.allclose(grad2, grad)
+    assert svc.nfwd == 1 and svc.nadj == 2
+
+    # the gradient agrees with a finite difference of the zone 1 k11 value
+    x = svc.x0.copy()
+    dx = x[0] * 1.0e-4
+    x[0] += dx
+    fd = (svc.value(x) - value) / dx
+    assert svc.nfwd == 2 and svc.nadj == 2
+    assert np.isclose(fd, grad[0], rtol=1.0e-2), (fd, grad[0])
+
+    # the trial points leave the forward solution of the instance alone
+    assert adj._hdf5_name == hdf5_name
+    adj_dfs = adj.solve_adjoint()
+    for name, df in dfs.items():
+        assert np.allclose(df.values, adj_dfs[name].values)
+    svc.close()
+    assert os.path.exists(hdf5_name)
+    adj_dfs = adj.solve_adjoint()
+    for name, df in dfs.items():
+        assert np.allclose(df.values, adj_dfs[name].values)
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_server():
+    new_d = "xd_box_server_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+
+    async def run():
+        server = mf6adj.AdjointServer(adj)
+        await server.start()
+        serving = asyncio.create_task(server.wait_closed())
+        async with mf6adj.AdjointClient(port=server.port) as client:
+            assert await client.request("ping") == "pong"
+            # two forward runs through the same resident instance
+            for _ in range(2):
+                result = await client.request("solve_gwf", hdf5_name="out.h5")
+                assert result["hdf5_name"] == "out.h5"
+                result = await client.request("solve_adjoint", return_data=True)
+            for pm in adj._performance_measures:
+                df = pd.read_csv(result[pm.name]["summary"], index_col=0)
+                assert np.allclose(df["k11"].values, result[pm.name]["data"]["k11"])
+            base = result
+            tangent = await client.request(
+                "solve_tangent", directions={"k11": {"k11": 1.0}}
+            )
+            assert len(tangent["k11"]) == 3
+            info = await client.request("set_parameters", composites=["k11"],
+                                        zones={"k11": np.ones(75, dtype=int)})
+            assert info["par_names"] == ["k11_z1"]
+            result = await client.request("value_and_grad", x=info["x0"])
+            assert len(result["grad"]) == 1
+            # the trial points of the first service leave the forward run alone
+            info = await client.request("set_parameters", composites=["k11"],
+                                        zones={"k11": np.ones(75, dtype=int)})
+            result = await client.request("value_and_grad", x=info["x0"])
+            assert len(result["grad"]) == 1
+            result = await client.request("solve_adjoint", return_data=True)
+            for pm in adj._performance_measures:
+                assert result[pm.name]["adjoint_solution"] == (
+                    pm.adjoint_solution_fname("out.h5"))
+                assert np.allclose(result[pm.name]["data"]["k11"],
+                                   base[pm.name]["data"]["k11"])
+            try:
+                await client.request("not_a_method")
+                raise AssertionError("should have failed")
+            except Exception as e:
+                assert "not_a_method" in str(e)
+            await client.request("shutdown")
+        await serving
+
+    asyncio.run(run())
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_from_forward_store():
+    new_d = "xd_box_from_forward_store_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+    adj.finalize()
+
+    # no MODFLOW6 from here on
+    offline = mf6adj.Mf6Adj.from_forward_store("out.h5", "test.adj")
+    assert offline._gwf is None
+    assert offline._shape == adj._shape
+    assert [pm.name for pm in offline._performance_measures] == [
+        pm.name for pm in adj._performance_measures]
+    try:
+        offline.solve_gwf()
+        raise AssertionError("should have failed")
+    except Exception as e:
+        assert "gwf is None" in str(e)
+    offline_dfs = offline.solve_adjoint()
+    for name, df in dfs.items():
+        assert np.allclose(df.values, offline_dfs[name].values)
+    offline.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_fused():
+    new_d = "xd_box_fused_test"
+    setup_xd_box_adj(new_d, nper=1)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    fused_dfs = adj.solve_fused()
+    assert not os.path.exists("out.h5")
+
+    # the same as the forward store based solve
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf()
+    dfs = adj.solve_adjoint()
+    for name, df in dfs.items():
+        assert np.allclose(df.values, fused_dfs[name].loc[:, df.columns].values)
+    adj.finalize()
+    os.chdir(bd)
+
+    new_d = "xd_box_fused_transient_test"
+    setup_xd_box_adj(new_d)
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    try:
+        adj.solve_fused()
+        raise AssertionError("should have failed")
+    except Exception as e:
+        assert "single time step" in str(e)
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_evaluate():
+    new_d = "xd_box_evaluate_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    head_dict, sp_package_data = adj.solve_gwf(pert_save=True)
+    # weights other than one tell w * (sim - obs)^2 from (w * (sim - obs))^2
+    for pm in adj._performance_measures:
+        for entry in pm._entries:
+            entry.weight = 2.5
+    values = adj.evaluate(return_entries=True)
+
+    for pm in adj._performance_measures:
+        value, entries = values[pm.name]
+        assert entries.shape[0] == len(pm._entries)
+        assert not entries["simulated"].isna().any()
+        # one objective for evaluate(), the perturbation testing and the adjoint
+        expected = pm.solve_forward(head_dict, sp_package_data)
+        assert np.isclose(value, expected), (pm.name, value, expected)
+        if pm.name == "phi":
+            # residual entries are weight * (sim - obs)^2
+            expected = sum(e.weight * (head_dict[e.kperkstp][e.inode] - e.obsval) ** 2
+                           for e in pm._entries)
+            assert np.isclose(value, expected), (pm.name, value, expected)
+    adj.finalize()
+    os.chdir(bd)
+
+
+def test_xd_box_adj_parse():
+    new_d = "xd_box_adj_parse_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    adj.finalize()
+
+    # comments and blank lines inside a block are skipped
+    with open("comment.adj", "w") as f:
+        f.write("begin performance_measure pm\n# a comment\n\n")
+        f.write("1 1 1 2 2 head direct 1.0 -1e+30\n")
+        f.write("3 1 3 5 5 head direct 2.0 -1e+30\n")
+        f.write("end performance_measure\n")
+    offline = mf6adj.Mf6Adj.from_forward_store("out.h5", "comment.adj")
+    entries = offline._performance_measures[0]._entries
+    assert len(entries) == 2
+    assert entries[0].inode == 6 and entries[1].inode == 74
+    assert entries[1].kperkstp == (2, 0)
+
+    # errors point to the adj file line
+    bad_lines = {
+        "kper": "4 1 1 2 2 head direct 1.0 -1e+30\n",
+        "kstp": "1 2 1 2 2 head direct 1.0 -1e+30\n",
+        "grid": "1 1 1 6 2 head direct 1.0 -1e+30\n",
+        "items": "1 1 1 2 head direct 1.0 -1e+30\n",
+        "casting": "1 1 1 x 2 head direct 1.0 -1e+30\n",
+        "package": "1 1 1 2 2 not_a_package direct 1.0 -1e+30\n",
+    }
+    for tag, bad_line in bad_lines.items():
+        with open("bad.adj", "w") as f:
+            f.write("begin performance_measure pm\n")
+            f.write("1 1 1 2 2 head direct 1.0 -1e+30\n")
+            f.write(bad_line)
+            f.write("end performance_measure\n")
+        try:
+            mf6adj.Mf6Adj.from_forward_store("out.h5", "bad.adj")
+            raise AssertionError(f"should have failed for {tag}")
+        except Exception as e:
+            assert "line 3" in str(e) or "line number 3" in str(e), (tag, str(e))
+    os.chdir(bd)
+
+
+def test_xd_box_adj_open():
+    new_d = "xd_box_adj_open_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    adj.finalize()
+
+    rng = np.random.default_rng(1)
+    n = 500
+    table = {
+        "kper": rng.integers(1, 4, n),
+        "kstp": np.ones(n, dtype=int),
+        "k": rng.integers(1, 4, n),
+        "i": rng.integers(1, 6, n),
+        "j": rng.integers(1, 6, n),
+        "pm_type": np.array(["head"] * n),
+        "pm_form": np.array(["residual"] * n),
+        "weight": rng.uniform(0.5, 2.0, n),
+        "obsval": rng.normal(size=n),
+    }
+    lines = [
+        " ".join([str(table[name][irow]) for name in table.keys()])
+        for irow in range(n)
+    ]
+    with open("inline.adj", "w") as f:
+        f.write("begin performance_measure pm\n")
+        f.write("\n".join(lines) + "\n")
+        f.write("end performance_measure\n")
+    inline = mf6adj.Mf6Adj.from_forward_store("out.h5", "inline.adj")
+    fingerprint = inline._performance_measures[0].fingerprint()
+
+    with open("entries.txt", "w") as f:
+        f.write("# kper kstp k i j pm_type pm_form weight obsval\n")
+        f.write("\n".join(lines[1:]) + "\n")
+    np.savez("entries.npz", **{name: vals[1:] for name, vals in table.items()})
+    with h5py.File("entries.h5", "w") as hdf:
+        for name, vals in table.items():
+            if vals.dtype.kind == "U":
+                vals = vals.astype("S")
+            hdf.create_dataset(name, data=vals[1:])
+    for fname in ["entries.txt", "entries.npz", "entries.h5"]:
+        with open("open.adj", "w") as f:
+            f.write("begin performance_measure pm\n")
+            f.write(lines[0] + "\n")
+            f.write(f"open {fname}\n")
+            f.write("end performance_measure\n")
+        opened = mf6adj.Mf6Adj.from_forward_store("out.h5", "open.adj")
+        assert opened._performance_measures[0].fingerprint() == fingerprint, fname
+
+    # errors point to the external file entry
+    with open("bad.txt", "w") as f:
+        f.write(lines[0] + "\n")
+        f.write("1 1 1 6 2 head residual 1.0 1.0\n")
+    with open("open.adj", "w") as f:
+        f.write("begin performance_measure pm\nopen bad.txt\nend performance_measure\n")
+    try:
+        mf6adj.Mf6Adj.from_forward_store("out.h5", "open.adj")
+        raise AssertionError("should have failed")
+    except Exception as e:
+        assert "entry 2 of external file 'bad.txt'" in str(e), str(e)
+    os.chdir(bd)
+
+
+def test_xd_box_columnar_entries():
+    new_d = "xd_box_columnar_entries_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf()
+    adj.finalize()
+
+    for pm in adj._performance_measures:
+        entries = pm._entries
+        assert isinstance(entries, mf6adj.PerfMeasEntries)
+        records = list(entries)
+        assert len(records) == len(entries)
+        for n, rec in enumerate(records):
+            assert rec.kperkstp == (entries.kper[n], entries.kstp[n])
+            assert rec.inode == entries.inode[n]
+            assert rec.pm_type == entries.pm_type[n]
+            assert rec.pm_form == entries.pm_form[n]
+        for kk in entries.kperkstps:
+            rows = entries.rows(kk)
+            assert [n for n, rec in enumerate(records) if rec.kperkstp == kk] == list(
+                rows
+            )
+
+        # a performance measure from the records is the same as the columnar one
+        from_records = mf6adj.PerfMeas(pm.name, records)
+        assert from_records.fingerprint() == pm.fingerprint()
+        df = pm.solve_adjoint(adj._hdf5_name, write_results=False)
+        df_records = from_records.solve_adjoint(adj._hdf5_name, write_results=False)
+        assert np.allclose(df.values, df_records.values)
+    os.chdir(bd)
+
+
+def test_xd_box_async_writer():
+    new_d = "xd_box_async_writer_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf(hdf5_name="async.h5")
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="sync.h5", write_queue=0)
+    adj.finalize()
+
+    datasets = {}
+    for fname in ["async.h5", "sync.h5"]:
+        items = {}
+        with h5py.File(fname, "r") as hdf:
+            hdf.visititems(
+                lambda name, obj, items=items: items.update({name: obj[()]})
+                if isinstance(obj, h5py.Dataset)
+                else None
+            )
+        datasets[fname] = items
+    assert datasets["async.h5"].keys() == datasets["sync.h5"].keys()
+    for name, arr in datasets["sync.h5"].items():
+        assert np.array_equal(arr, datasets["async.h5"][name]), name
+    os.chdir(bd)
+
+
+def test_xd_box_dedup():
+    new_d = "xd_box_dedup_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf(hdf5_name="dedup.h5")
+    dfs = {
+        pm.name: pm.solve_adjoint("dedup.h5", write_results=False)
+        for pm in adj._performance_measures
+    }
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="full.h5", dedup=False)
+    adj.finalize()
+
+    def read_group(grp, items, prefix=""):
+        for name in grp.keys():
+            obj = grp[name]
+            if isinstance(obj, h5py.Dataset):
+                items[prefix + name] = obj[()]
+            else:
+                read_group(obj, items, prefix + name + "/")
+        return items
+
+    with h5py.File("dedup.h5", "r") as hdf, h5py.File("full.h5", "r") as fdf:
+        dedup, full = read_group(hdf, {}), read_group(fdf, {})
+        assert dedup.keys() == full.keys()
+        for name, arr in full.items():
+            assert np.array_equal(arr, dedup[name]), name
+        sol_keys, _, _ = mf6adj.PerfMeas._get_solution_keys(hdf)
+        # k11 is written once and linked from the later time steps
+        assert len(sol_keys) > 1
+        for sol_key in sol_keys[1:]:
+            assert hdf[sol_key]["k11"] == hdf[sol_keys[0]]["k11"]
+            assert fdf[sol_key]["k11"] != fdf[sol_keys[0]]["k11"]
+    assert os.path.getsize("dedup.h5") < os.path.getsize("full.h5")
+
+    for pm in adj._performance_measures:
+        df = pm.solve_adjoint("full.h5", write_results=False)
+        assert np.allclose(df.values, dfs[pm.name].values), pm.name
+    os.chdir(bd)
+
+
+def test_xd_box_lean():
+    new_d = "xd_box_lean_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf(hdf5_name="full.h5")
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="lean.h5", lean=True)
+    adj.finalize()
+
+    derived = ["head_old", "sat_old", "dresdss_h", "drhsdh"]
+    with h5py.File("lean.h5", "r") as hdf:
+        sol_keys, _, _ = mf6adj.PerfMeas._get_solution_keys(hdf)
+        for sol_key in sol_keys:
+            for name in ["dresdss_h", "drhsdh"]:
+                assert name not in hdf[sol_key], name
+    with (
+        mf6adj.ForwardStore("full.h5") as full,
+        mf6adj.ForwardStore("lean.h5") as lean,
+    ):
+        for sol_key in sol_keys:
+            assert sorted(full[sol_key].keys()) == sorted(lean[sol_key].keys())
+            for name in derived:
+                if name not in full[sol_key]:
+                    continue
+                # derived exactly as solve_gwf() computed them
+                assert np.array_equal(
+                    full[sol_key][name][:], lean[sol_key][name][:]
+                ), name
+
+    for pm in adj._performance_measures:
+        df = pm.solve_adjoint("full.h5", write_results=False)
+        df_lean = pm.solve_adjoint("lean.h5", write_results=False)
+        assert np.allclose(df.values, df_lean.values), pm.name
+    os.chdir(bd)
+
+
+def test_xd_box_amat_keyframe():
+    new_d = "xd_box_amat_keyframe_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf(hdf5_name="full.h5")
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="delta.h5", amat_keyframe=2)
+    adj.finalize()
+
+    with (
+        mf6adj.ForwardStore("full.h5") as full,
+        mf6adj.ForwardStore("delta.h5") as delta,
+    ):
+        sol_keys, _, _ = mf6adj.PerfMeas._get_solution_keys(full)
+        assert "amat" in delta._hdf[sol_keys[0]]
+        # read in reverse, as the adjoint does
+        for sol_key in sol_keys[::-1]:
+            assert sorted(full[sol_key].keys()) == sorted(delta[sol_key].keys())
+            amat = delta[sol_key]["amat"][:]
+            assert np.array_equal(
+                full[sol_key]["amat"][:].view(np.uint64), amat.view(np.uint64)
+            ), sol_key
+
+    for pm in adj._performance_measures:
+        df = pm.solve_adjoint("full.h5", write_results=False)
+        df_delta = pm.solve_adjoint("delta.h5", write_results=False)
+        assert np.allclose(df.values, df_delta.values), pm.name
+    os.chdir(bd)
+
+
+def test_xd_box_stacked():
+    new_d = "xd_box_stacked_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf(hdf5_name="groups.h5")
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="stacked.h5", layout="stacked", amat_keyframe=2)
+    adj.finalize()
+
+    with h5py.File("stacked.h5", "r") as hdf:
+        assert hdf.attrs["layout"] == "stacked"
+        assert not any(name.startswith("solution") for name in hdf.keys())
+        # one row per time step
+        assert hdf["stacked"]["data"]["head"].shape[0] == len(hdf["aux"]["kper"])
+
+    with (
+        mf6adj.ForwardStore("groups.h5") as groups,
+        mf6adj.ForwardStore("stacked.h5") as stacked,
+    ):
+        sol_keys, kperkstp, _ = mf6adj.PerfMeas._get_solution_keys(groups)
+        assert mf6adj.PerfMeas._get_solution_keys(stacked)[:2] == (
+            sol_keys,
+            kperkstp,
+        )
+        for sol_key in sol_keys[::-1]:
+            grp, sgrp = groups[sol_key], stacked[sol_key]
+            assert sorted(grp.keys()) == sorted(sgrp.keys())
+            for name in ["kper", "kstp", "dt", "has_sto"]:
+                assert grp.attrs[name] == sgrp.attrs[name]
+            for name in grp.keys():
+                if isinstance(grp[name], h5py.Group):
+                    assert grp[name].attrs["ptype"] == sgrp[name].attrs["ptype"]
+                    for item in grp[name].keys():
+                        assert np.array_equal(grp[name][item][:], sgrp[name][item][:])
+                else:
+                    assert np.array_equal(grp[name][:], sgrp[name][:]), name
+        assert mf6adj.PerfMeas.forward_fingerprint(
+            groups
+        ) == mf6adj.PerfMeas.forward_fingerprint(stacked)
+
+    for pm in adj._performance_measures:
+        df = pm.solve_adjoint("groups.h5", write_results=False)
+        df_stacked = pm.solve_adjoint("stacked.h5", write_results=False)
+        assert np.allclose(df.values, df_stacked.values), pm.name
+    os.chdir(bd)
+
+
+def test_xd_box_hdf5_filter():
+    new_d = "xd_box_hdf5_filter_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    with open("test.adj", "r") as f:
+        lines = f.read()
+    with open("test.adj", "w") as f:
+        f.write(
+            lines.replace(
+                "end options",
+                "hdf5_filter shuffle+gzip 6\nhdf5_chunks amat 64\nend options",
+                1,
+            )
+        )
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    assert str(adj._hdf5_filter) == "shuffle+gzip 6, amat chunks 64"
+    adj.solve_gwf(hdf5_name="filtered.h5")
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="plain.h5", hdf5_filter="none")
+    adj.finalize()
+
+    with h5py.File("filtered.h5", "r") as hdf, h5py.File("plain.h5", "r") as plain:
+        sol_keys = [name for name in hdf.keys() if name.startswith("solution")]
+        for sol_key in sol_keys:
+            amat = hdf[sol_key]["amat"]
+            assert amat.compression == "gzip" and amat.shuffle
+            assert amat.chunks == (min(64, amat.shape[0]),)
+            assert plain[sol_key]["amat"].compression is None
+            for name in hdf[sol_key].keys():
+                if isinstance(hdf[sol_key][name], h5py.Dataset):
+                    assert np.array_equal(
+                        hdf[sol_key][name][:], plain[sol_key][name][:]
+                    ), name
+
+    df = adj.benchmark_hdf5_filter()
+    assert "shuffle+gzip 6, amat chunks 64" in df.index
+    assert np.all(df["file_bytes"] > 0)
+    assert np.all(df["write_mb_per_sec"] > 0) and np.all(df["read_mb_per_sec"] > 0)
+
+    for pm in adj._performance_measures:
+        df = pm.solve_adjoint("plain.h5", write_results=False)
+        df_filtered = pm.solve_adjoint(
+            "filtered.h5",
+            hdf5_adjoint_solution_fname="adjoint_filtered.h5",
+            hdf5_filter="lzf",
+        )
+        assert np.allclose(df.values, df_filtered.values), pm.name
+        with h5py.File("adjoint_filtered.h5", "r") as adf:
+            assert adf["composite"]["k11"].compression == "lzf"
+    os.chdir(bd)
+
+
+def test_xd_box_lossy():
+    new_d = "xd_box_lossy_test"
+    setup_xd_box_adj(new_d)
+    bd = os.getcwd()
+    os.chdir(new_d)
+    lossy = {"amat": ("rel", 1.0e-6), "head": ("abs", 1.0e-4), "sat": ("abs", 1.0e-5)}
+    adj = mf6adj.Mf6Adj("test.adj", lib_name)
+    adj.solve_gwf(hdf5_name="exact.h5")
+    adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+    adj.solve_gwf(hdf5_name="lossy.h5", lossy=lossy, hdf5_filter="gzip")
+    adj.finalize()
+
+    with h5py.File("lossy.h5", "r") as hdf:
+        assert hdf.attrs["lossy"] == "amat rel 1e-06, head abs 0.0001, sat abs 1e-05"
+        sol_key = next(name for name in hdf.keys() if name.startswith("solution"))
+        assert "head" not in hdf[sol_key] and "head_q" in hdf[sol_key]
+        assert hdf[sol_key]["head_q"].dtype == np.uint8
+
+    with (
+        mf6adj.ForwardStore("exact.h5") as exact,
+        mf6adj.ForwardStore("lossy.h5") as store,
+    ):
+        for sol_key in exact.solution_keys():
+            grp, lgrp = exact[sol_key], store[sol_key]
+            assert sorted(grp.keys()) == sorted(lgrp.keys())
+            for name in ["head", "head_old", "sat", "sat_old"]:
+                bound = lossy[name.split("_")[0]][1]
+                assert np.all(np.abs(lgrp[name][:] - grp[name][:]) <= bound), name
+            amat = grp["amat"][:]
+            assert np.all(np.abs(lgrp["amat"][:] - amat) <= 1.0e-6 * np.abs(amat))
+            for name in ["k11", "k33", "condsat", "drhsdh"]:
+                assert np.array_equal(grp[name][:], lgrp[name][:]), name
+
+    for pm in adj._performance_measures:
+        df = pm.solve_adjoint("exact.h5", write_results=False)
+        df_lossy = pm.solve_adjoint("lossy.h5", write_results=False)
+        err = np.abs(df.values - df_lossy.values).max()
+        assert err <= 1.0e-3 * np.abs(df.values).max(), pm.name
+
+    adj._hdf5_name = "exact.h5"
+    df = adj.verify_lossy(adj._performance_measures[0].name, {"head": ("abs", 1.0e-2)})
+    assert os.path.exists("lossy_exact.h5")
+    assert list(df.index) == list(df_lossy.columns)
+    assert np.all(df["max_abs_error"] <= df["max_abs_sens"])
+    os.chdir(bd)
+
+
 if __name__ == "__main__":
     #test_xd_box_chd_ana()
     nested_test()
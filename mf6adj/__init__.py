@@ -1,10 +1,25 @@
 from .version import __version__  # isort:skip
 from .adj import Mf6Adj
-from .pm import PerfMeas, PerfMeasRecord
+from .cache import AdjointCache
+from .gradient import GradientService
+from .pm import PerfMeas, PerfMeasEntries, PerfMeasRecord
+from .server import AdjointClient, AdjointServer
+from .store import ForwardStore, Hdf5Filter, Quantizer
+from .tangent import GaussNewtonOperator, TangentLinear
 
 __all__ = [
+    "AdjointCache",
+    "AdjointClient",
+    "AdjointServer",
+    "ForwardStore",
+    "GaussNewtonOperator",
+    "GradientService",
+    "Hdf5Filter",
     "Mf6Adj",
     "PerfMeas",
+    "PerfMeasEntries",
     "PerfMeasRecord",
+    "Quantizer",
+    "TangentLinear",
     "__version__",
 ]
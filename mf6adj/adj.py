@@ -9,8 +9,15 @@ import h5py
 import modflowapi
 import numpy as np
 import pandas as pd
+import pyemu
 
+from .cache import AdjointCache
+from .gradient import GradientService
+from .harvest import Harvester
 from .pm import PerfMeas, PerfMeasRecord
+from .server import AdjointServer
+from .store import AsyncGroupWriter, ForwardStore, GroupWriter, Hdf5Filter
+from .tangent import GaussNewtonOperator, TangentLinear
 
 DT_FMT = "%Y-%m-%d %H:%M:%S"
 
@@ -28,6 +35,26 @@ class Mf6Adj(object):
 
     """
 
+    _gwf_package_types = [
+        "chd6",
+        "wel6",
+        "ghb6",
+        "riv6",
+        "drn6",
+        "sfr6",
+        "rch6",
+        "recha6",
+        "evt6",
+    ]
+    _gwf_boundary_attr_dict = {
+        "chd6": ["head"],
+        "ghb6": ["bhead", "cond"],
+        "riv6": ["stage", "cond"],
+        "drn6": ["elev", "cond"],
+        "wel6": ["q"],
+        "rch6": ["recharge"],
+    }
+
     def __init__(self, adj_filename: str, lib_name: str, verbose_level: int = 1):
         """ """
         self.verbose_level = int(verbose_level)
@@ -62,6 +89,7 @@ class Mf6Adj(object):
             self.logger.info("...unstructured grid found")
             is_structured = False
         self._gwf = None
+        self._writer = None
         self._lib_name = lib_name
         self._flow_dir = "."
         self._gwf = self._initialize_gwf(lib_name, self._flow_dir)
@@ -86,29 +114,105 @@ class Mf6Adj(object):
             self._shape = (nlay, nrow, ncol)
         self._performance_measures = []
         self._read_adj_file()
-        self._gwf_package_types = [
-            "chd6",
-            "wel6",
-            "ghb6",
-            "riv6",
-            "drn6",
-            "sfr6",
-            "rch6",
-            "recha6",
-            "evt6",
-        ]
-        self._gwf_boundary_attr_dict = {
-            "chd6": ["head"],
-            "ghb6": ["bhead", "cond"],
-            "riv6": ["stage", "cond"],
-            "drn6": ["elev", "cond"],
-            "wel6": ["q"],
-            "rch6": ["recharge"],
-        }
 
-    def _read_adj_file(self):
+    @classmethod
+    def from_forward_store(
+        cls, hdf5_forward_solution_fname: str, adj_filename: str, verbose_level=1
+    ):
+        """Create an instance from an existing forward solution HDF5 file, without
+        MODFLOW6 or the simulation files.  The performance measures in
+        `adj_filename` are parsed with the grid and package information stored in
+        the file ('gwf_info' and 'aux' groups), so `solve_adjoint()`,
+        `solve_jacobian()` and the other methods that only read the forward
+        solution work, while `solve_gwf()` does not
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the forward solution HDF5 file written
+            by `solve_gwf()`
+        adj_filename (str): the adjoint input filename.  A 'hdf5_name' option in
+            the file is ignored
+        verbose_level (int): flag to control output.  Default is 1
+
+        Returns
+        -------
+        adj (Mf6Adj) : the instance
+
+        """
+        if not os.path.exists(hdf5_forward_solution_fname):
+            raise Exception(
+                f"hdf5_forward_solution_fname '{hdf5_forward_solution_fname}' "
+                + "not found"
+            )
+        if not os.path.exists(adj_filename):
+            raise Exception(f"adj_filename '{adj_filename}' not found")
+        adj = cls.__new__(cls)
+        adj.verbose_level = int(verbose_level)
+        adj.adj_filename = adj_filename
+        adj.logger = logging.getLogger(logging.__name__ + ".Mf6Adj")
+        logging.basicConfig(
+            filename=adj_filename + ".log", format="%(asctime)s %(message)s"
+        )
+        adj._gwf = None
+        adj._lib_name = None
+        adj._flow_dir = "."
+        adj._gwf_model_dict = {}
+        adj._gwf_namfile = None
+        adj._structured_mg = None
+        adj._shape = None
+        adj._performance_measures = []
+
+        with ForwardStore(hdf5_forward_solution_fname) as hdf:
+            if "gwf_info" not in hdf or "aux" not in hdf:
+                raise Exception(
+                    f"'{hdf5_forward_solution_fname}' is not a forward solution file"
+                )
+            info = hdf["gwf_info"]
+            gwf_name = hdf.attrs.get("gwf_name", None)
+            adj._gwf_name = None if gwf_name is None else str(gwf_name)
+            adj._gwf_package_dict = {
+                ptype: [str(pname) for pname in pnames]
+                for ptype, pnames in info.attrs.items()
+            }
+            adj.is_structured = "nlay" in info
+            nuser = info["nodeuser"][:]
+            ncpl = None
+            if adj.is_structured:
+                adj._shape = (
+                    int(info["nlay"][0]),
+                    int(info["nrow"][0]),
+                    int(info["ncol"][0]),
+                )
+                adj._structured_mg = flopy.discretization.StructuredGrid(
+                    nlay=adj._shape[0], nrow=adj._shape[1], ncol=adj._shape[2]
+                )
+            elif "ncpl" in info:
+                ncpl = info["ncpl"][:]
+            else:
+                raise Exception(
+                    "the forward solution file has no 'ncpl' information, needed "
+                    + "for unstructured grids"
+                )
+            kper = hdf["aux"]["kper"][:].astype(int)
+            kstp = hdf["aux"]["kstp"][:].astype(int)
+        nstp = np.zeros(kper.max() + 1, dtype=int)
+        np.maximum.at(nstp, kper, kstp + 1)
+
+        adj._read_adj_file(nuser=nuser, nstp=nstp, ncpl=ncpl)
+        # the given store wins over a 'hdf5_name' option
+        adj._hdf5_name = hdf5_forward_solution_fname
+        return adj
+
+    def _read_adj_file(self, nuser=None, nstp=None, ncpl=None):
         """private method to read the adj input file
 
+        Parameters
+        ----------
+        nuser (ndarray) : the zero-based user node number of each model node.  If
+            None, taken from MODFLOW6 (as are `nstp` and `ncpl`)
+        nstp (ndarray) : the number of time steps of each stress period
+        ncpl (int) : the number of cells per layer, for unstructured grids
+
         Note
         ----
         The input file structure is very similar to other MODFLOW6 input files.
@@ -139,6 +243,25 @@ class Mf6Adj(object):
         The resulting adjoint sensitivities will be with respect to the ghb flux in
         model cell (10,2,3) for both stress periods 1 and 2
 
+        Large sets of entries can be kept in external files, loaded in bulk with an
+        'open' line in the performance measure block:
+           open heads_obs.txt
+        The external file is either a whitespace-delimited text file with the same
+        entries as above (one per line) or a binary table (a numpy .npz file or an
+        HDF5 file) with one-based column arrays named 'kper', 'kstp', 'k', 'i', 'j'
+        ('node' instead of 'i' and 'j' for unstructured grids), 'pm_type',
+        'pm_form', 'weight' and 'obsval'.  'open' lines and entries can be mixed in
+        a block.
+
+        The optional 'options' block sets the forward solution HDF5 filename and
+        the compression filter and chunks of the forward and adjoint solution
+        HDF5 datasets (see `Hdf5Filter`), for example:
+           begin options
+             hdf5_name fwd.hd5
+             hdf5_filter shuffle+gzip 4
+             hdf5_chunks amat 65536
+           end options
+
         As presently coded, performance measure forms (i.e. 'direct' or 'residual')
         cannot be mixed for a given performance measure and performance type
         (i.e. 'head' or flux) cannot be mixed for a given performance measure.
@@ -147,21 +270,21 @@ class Mf6Adj(object):
         """
         # clear any existing PMs
         self._performance_measures = []
+        self._hdf5_filter = Hdf5Filter()
         self.logger.info("processing adjoint file: " + str(self.adj_filename))
-        addr = ["NODEUSER", self._gwf_name.upper(), "DIS"]
-        wbaddr = self._gwf.get_var_address(*addr)
-        nuser = self._gwf.get_value(wbaddr) - 1
+        if nuser is None:
+            addr = ["NODEUSER", self._gwf_name.upper(), "DIS"]
+            wbaddr = self._gwf.get_var_address(*addr)
+            nuser = self._gwf.get_value(wbaddr) - 1
 
-        nstp = self._gwf.get_value(self._gwf.get_var_address("NSTP", "TDIS"))
-        nper = nstp.shape[0]
+            nstp = self._gwf.get_value(self._gwf.get_var_address("NSTP", "TDIS"))
 
-        ncpl = None
-        if not self.is_structured:
-            addr = ["NCPL", self._gwf_name.upper(), "DIS"]
-            wbaddr = self._gwf.get_var_address(*addr)
-            ncpl = self._gwf.get_value(wbaddr)
-            addr = ["NLAY", self._gwf_name.upper(), "DIS"]
-            wbaddr = self._gwf.get_var_address(*addr)
+            ncpl = None
+            if not self.is_structured:
+                addr = ["NCPL", self._gwf_name.upper(), "DIS"]
+                wbaddr = self._gwf.get_var_address(*addr)
+                ncpl = self._gwf.get_value(wbaddr)
+        node_lookup = Mf6Adj._node_lookup(nuser)
 
         with open(self.adj_filename, "r") as f:
             count = 0
@@ -194,6 +317,11 @@ class Mf6Adj(object):
                             break
                         elif line2.lower().strip().split()[0] == "hdf5_name":
                             self._hdf5_name = line2.strip().split()[1]
+                        elif line2.lower().strip().split()[0] in [
+                            "hdf5_filter",
+                            "hdf5_chunks",
+                        ]:
+                            self._hdf5_filter.parse_option(line2)
                         else:
                             raise Exception("unrecognized option line:" + line2.strip())
 
@@ -212,17 +340,17 @@ class Mf6Adj(object):
 
                     pm_name = raw[2].strip().lower()
 
-                    pm_entries = []
-                    pm_line = 0
+                    # gather the entry lines and external tables, then parse
+                    # them in bulk
+                    entry_lines, entry_counts, tables = [], [], []
                     while True:
                         line2 = f.readline()
-                        pm_line += 1
                         count += 1
                         if line2 == "":
                             raise EOFError(
                                 f"EOF while reading performance_measure block '{line}'"
                             )
-                        elif len(line.strip()) == 0 or line.strip()[0] == "#":
+                        elif len(line2.strip()) == 0 or line2.strip()[0] == "#":
                             continue
                         elif line2.lower().strip().startswith("begin"):
                             raise Exception(
@@ -235,134 +363,57 @@ class Mf6Adj(object):
                             line2.lower().strip().startswith("end performance_measure")
                         ):
                             break
-                        elif line2.lower().strip().startswith("open"):
-                            fname = line2.split()[1]
+                        elif line2.lower().strip().split()[0] == "open":
+                            raw2 = line2.strip().split()
+                            if len(raw2) < 2:
+                                raise Exception(
+                                    f"'open' line {count} is missing the filename"
+                                )
+                            fname = raw2[1]
                             if not os.path.exists(fname):
-                                raise Exception(f"external file '{fname}' found")
-                            # df = pd.read_csv()
-                            raise NotImplementedError()
-
-                        raw = line2.lower().strip().split()
-                        if self.is_structured and len(raw) != 9:
-                            self.logger.info("parsed line: " + str(raw))
-                            raise Exception(
-                                (
-                                    f"performance measure entry on line {count} has "
-                                    + f"the wrong number of items, found {len(raw)}, "
-                                    + "should have 9"
+                                raise Exception(
+                                    f"external file '{fname}' on line {count} "
+                                    + "not found"
                                 )
-                            )
-                        elif not self.is_structured and len(raw) != 8:
-                            self.logger.info("parsed line: " + str(raw))
-                            raise Exception(
-                                (
-                                    f"performance measure entry on line {count} has "
-                                    + f"the wrong number of items, found {len(raw)}, "
-                                    + "should have 8"
+                            # keep the entry order of the block
+                            tables.append(
+                                self._parse_pm_entries(
+                                    entry_lines, entry_counts, node_lookup, nstp, ncpl
                                 )
                             )
-                        kper = int(raw[0]) - 1
-                        kstp = int(raw[1]) - 1
-                        if kper > nper - 1:
-                            raise Exception(f"kper > nper -1 on line number {count}")
-                        if kstp > nstp[kper] - 1:
-                            raise Exception(
-                                f"kstp > nstp[kper] -1 on line number {count}"
-                            )
-
-                        i, j = None, None
-                        if self.is_structured:
-                            kij = []
-                            for i in range(3):
-                                try:
-                                    kij.append(int(raw[i + 2]) - 1)
-                                except Exception as e:
-                                    print(
-                                        f"{e}\n\nerror casting k-i-j info on "
-                                        + f"line {count}: '{line2}'"
-                                    )
-                            k, i, j = kij[0], kij[1], kij[2]
-                            # convert to node number
-                            inode = PerfMeas.get_node(self._shape, [kij])[0]
-                            # if there is a reduced node scheme
-                            if len(nuser) > 1:
-                                nn = np.where(nuser == inode)[0]
-                                if nn.shape[0] != 1:
-                                    self.logger.info(str(nuser) + " " + str(nn))
-                                    if self.is_structured:
-                                        self.logger.info(str(kij))
-                                    raise Exception(
-                                        f"node num {nuser} not in reduced node num"
-                                    )
-
-                                inode = nn[0]
-
-                        else:
-                            try:
-                                lay = int(raw[2])
-                            except Exception as e:
-                                print(
-                                    f"{e}\n\nerror casting layer info info on "
-                                    + f"line {count}: '{line2}'"
-                                )
-                            k = lay - 1
-                            try:
-                                node = int(raw[3])
-                            except Exception as e:
-                                print(
-                                    f"{e}\n\nerror casting layer info info on "
-                                    + f"line {count}: '{line2}'"
-                                )
-
-                            inode = ((ncpl * (lay - 1)) + node) - 1
-
-                            # if there is a reduced node scheme
-                            if len(nuser) > 1:
-                                nn = np.where(nuser == inode)[0]
-                                if nn.shape[0] != 1:
-                                    raise Exception(
-                                        f"node num {nuser} not in reduced node num"
-                                    )
-                                inode = nn[0]
-
-                        obsval = float(raw[-1])
-                        weight = float(raw[-2])
-                        pm_form = raw[-3].strip().lower()
-                        pm_type = raw[-4].strip().lower()
-                        if pm_type != "head":
-                            found = False
-                            ppnames = []
-                            for ptype, pnames in self._gwf_package_dict.items():
-                                if pm_type in pnames:
-                                    found = True
-                                    break
-                                ppnames.extend(pnames)
-                            if not found:
-                                self.logger.info(str(ppnames))
-                                raise Exception(
-                                    f"`pm_type` {pm_type} names a GWF package "
-                                    + "instance that was not found"
+                            entry_lines, entry_counts = [], []
+                            self.logger.info(f"reading external PM file '{fname}'")
+                            tables.append(
+                                self._check_pm_table(
+                                    self._read_pm_table(fname, self.is_structured),
+                                    lambda n, fname=fname: (
+                                        f"entry {n + 1} of external file '{fname}'"
+                                    ),
+                                    node_lookup,
+                                    nstp,
+                                    ncpl,
                                 )
-
-                        pm_entries.append(
-                            PerfMeasRecord(
-                                kper,
-                                kstp,
-                                inode,
-                                pm_type,
-                                pm_form,
-                                weight,
-                                obsval,
-                                k,
-                                i,
-                                j,
                             )
+                            continue
+                        entry_lines.append(line2)
+                        entry_counts.append(count)
+                    tables.append(
+                        self._parse_pm_entries(
+                            entry_lines, entry_counts, node_lookup, nstp, ncpl
                         )
-                    if len(pm_entries) == 0:
+                    )
+                    tables = [table for table in tables if table is not None]
+                    if len(tables) == 0:
                         raise Exception(f"no entries found for PM {pm_name}")
-                    pm_types = {entry.pm_type for entry in pm_entries}
-
-                    pm_forms = {entry.pm_form for entry in pm_entries}
+                    pm_table = {
+                        key: None
+                        if tables[0][key] is None
+                        else np.concatenate([table[key] for table in tables])
+                        for key in tables[0].keys()
+                    }
+                    pm_types = {str(v) for v in np.unique(pm_table["pm_type"])}
+
+                    pm_forms = {str(v) for v in np.unique(pm_table["pm_form"])}
                     if len(pm_forms) > 1:
                         raise Exception(
                             "performance measure"
@@ -382,9 +433,10 @@ class Mf6Adj(object):
                     if pm_name in [pm._name for pm in self._performance_measures]:
                         raise Exception(f"PM {pm_name} multiply defined")
                     self._performance_measures.append(
-                        PerfMeas(pm_name, pm_entries, self.verbose_level)
+                        PerfMeas.from_arrays(
+                            pm_name, verbose_level=self.verbose_level, **pm_table
+                        )
                     )
-
                 else:
                     raise Exception(
                         f"unrecognized adj file input on line {count}: '{line}'"
@@ -392,6 +444,323 @@ class Mf6Adj(object):
         if len(self._performance_measures) == 0:
             raise Exception("no PMs found in adj file")
 
+    @staticmethod
+    def _node_lookup(nuser):
+        """private method to form the user-to-reduced node lookup
+
+        Parameters
+        ----------
+        nuser (ndarray) : the zero-based user node number of each model node
+
+        Returns
+        -------
+        lookup (ndarray) : the zero-based model node number of each user node
+            (-1 for user nodes that are not in the model), or None if there is no
+            reduced node scheme
+
+        """
+        nuser = np.asarray(nuser, dtype=int)
+        if len(nuser) <= 1:
+            return None
+        lookup = np.full(nuser.max() + 1, -1, dtype=int)
+        lookup[nuser] = np.arange(nuser.shape[0], dtype=int)
+        return lookup
+
+    @staticmethod
+    def _pm_table_columns(is_structured):
+        """private method to get the column names of a performance measure entry
+        table, in the order of the adj file entries
+
+        Parameters
+        ----------
+        is_structured (bool) : flag for a structured grid
+
+        Returns
+        -------
+        columns (list) : the column names
+
+        """
+        if is_structured:
+            return [
+                "kper",
+                "kstp",
+                "k",
+                "i",
+                "j",
+                "pm_type",
+                "pm_form",
+                "weight",
+                "obsval",
+            ]
+        return ["kper", "kstp", "k", "node", "pm_type", "pm_form", "weight", "obsval"]
+
+    def _parse_pm_entries(self, lines, counts, node_lookup, nstp, ncpl):
+        """private method to parse the entry lines of a performance measure block
+        in bulk
+
+        Parameters
+        ----------
+        lines (list) : the entry lines
+        counts (list) : the adj file line number of each entry line
+        node_lookup (ndarray) : the user-to-reduced node lookup, see
+            `_node_lookup()`
+        nstp (ndarray) : the number of time steps of each stress period
+        ncpl (int) : the number of cells per layer, for unstructured grids
+
+        Returns
+        -------
+        table (dict) : the entry arrays, see `_check_pm_table()`.  None if there
+            are no lines
+
+        """
+        if len(lines) == 0:
+            return None
+        counts = np.asarray(counts, dtype=int)
+        columns = Mf6Adj._pm_table_columns(self.is_structured)
+        nitems = len(columns)
+        tokens = [line.lower().split() for line in lines]
+        ntokens = np.fromiter(map(len, tokens), dtype=int, count=len(tokens))
+        bad = np.flatnonzero(ntokens != nitems)
+        if bad.shape[0] > 0:
+            self.logger.info("parsed line: " + str(tokens[bad[0]]))
+            raise Exception(
+                (
+                    f"performance measure entry on line {counts[bad[0]]} has "
+                    + f"the wrong number of items, found {ntokens[bad[0]]}, "
+                    + f"should have {nitems}"
+                )
+            )
+        tokens = np.array(tokens, dtype=str)
+        nint = nitems - 4
+
+        def cast(cols, dtype, what):
+            try:
+                return tokens[:, cols].astype(dtype)
+            except ValueError:
+                for irow in range(tokens.shape[0]):
+                    try:
+                        tokens[irow, cols].astype(dtype)
+                    except ValueError as e:
+                        raise Exception(
+                            f"error casting {what} info on line {counts[irow]}: "
+                            + f"'{lines[irow].strip()}': {e!s}"
+                        )
+                raise
+
+        ints = cast(slice(0, nint), int, "kper-kstp-node")
+        table = {name: ints[:, icol] for icol, name in enumerate(columns[:nint])}
+        table["pm_type"] = tokens[:, nitems - 4]
+        table["pm_form"] = tokens[:, nitems - 3]
+        table["weight"] = cast(nitems - 2, float, "weight")
+        table["obsval"] = cast(nitems - 1, float, "obsval")
+        return self._check_pm_table(
+            table, lambda n: f"line {counts[n]}", node_lookup, nstp, ncpl
+        )
+
+    @staticmethod
+    def _read_pm_table(fname, is_structured):
+        """private method to read an external performance measure entry table (the
+        'open' directive of a performance measure block)
+
+        Parameters
+        ----------
+        fname (str) : the table file.  Either a whitespace-delimited text file with
+            the same entries as the adj file (one per line, '#' comments allowed),
+            a numpy .npz file or an HDF5 file.  The binary files hold one array
+            per column, named as the columns of the adj file entries ("kper",
+            "kstp", "k", "i", "j", "pm_type", "pm_form", "weight", "obsval", with
+            "node" instead of "i" and "j" for unstructured grids), or a single
+            structured (compound) array with those fields.  Indices are one-based,
+            as in the adj file
+        is_structured (bool) : flag for a structured grid
+
+        Returns
+        -------
+        table (dict) : the one-based entry arrays, keyed by column name
+
+        """
+        columns = Mf6Adj._pm_table_columns(is_structured)
+        if fname.lower().endswith(".npz") or h5py.is_hdf5(fname):
+            if fname.lower().endswith(".npz"):
+                with np.load(fname, allow_pickle=False) as npz:
+                    arrays = {key: npz[key] for key in npz.files}
+            else:
+                with h5py.File(fname, "r") as hdf:
+                    arrays = {
+                        key: hdf[key][:]
+                        for key in hdf.keys()
+                        if isinstance(hdf[key], h5py.Dataset)
+                    }
+            if len(arrays) == 1:
+                arr = next(iter(arrays.values()))
+                if arr.dtype.names is not None:
+                    arrays = {name: arr[name] for name in arr.dtype.names}
+            missing = [name for name in columns if name not in arrays]
+            if len(missing) > 0:
+                raise Exception(
+                    f"external file '{fname}' is missing columns {missing!s}, "
+                    + f"should have {columns!s}"
+                )
+            table = {name: np.asarray(arrays[name]).ravel() for name in columns}
+            sizes = {table[name].shape[0] for name in columns}
+            if len(sizes) > 1:
+                raise Exception(
+                    f"external file '{fname}' columns have different lengths"
+                )
+        else:
+            try:
+                df = pd.read_csv(
+                    fname,
+                    sep=r"\s+",
+                    header=None,
+                    comment="#",
+                    skip_blank_lines=True,
+                    dtype=str,
+                )
+            except pd.errors.ParserError as e:
+                raise Exception(
+                    f"error reading external file '{fname}': {str(e).strip()}"
+                )
+            if df.shape[1] != len(columns) or df.isna().any().any():
+                irow = 0
+                if df.shape[1] == len(columns):
+                    irow = int(np.flatnonzero(df.isna().any(axis=1).values)[0])
+                raise Exception(
+                    f"entry {irow + 1} of external file '{fname}' has the wrong "
+                    + f"number of items, should have {len(columns)}"
+                )
+            df.columns = columns
+            table = {name: df[name].to_numpy(dtype=str) for name in columns}
+
+        # cast the numeric columns
+        for name in columns:
+            if name in ["pm_type", "pm_form"]:
+                vals = table[name]
+                if vals.dtype.kind in ["O", "S"]:
+                    vals = np.char.decode(vals.astype("S"))
+                table[name] = np.char.lower(np.char.strip(vals.astype(str)))
+                continue
+            try:
+                vals = table[name].astype(float)
+                bad = np.zeros(vals.shape[0], dtype=bool)
+            except ValueError:
+                vals = None
+                bad = pd.to_numeric(pd.Series(table[name]), errors="coerce").isna()
+            if vals is not None and name not in ["weight", "obsval"]:
+                bad = ~np.isfinite(vals) | (vals != np.round(vals))
+            if bad.any():
+                irow = int(np.flatnonzero(bad)[0])
+                raise Exception(
+                    f"error casting '{name}' of entry {irow + 1} of external file "
+                    + f"'{fname}': '{table[name][irow]!s}'"
+                )
+            table[name] = vals if name in ["weight", "obsval"] else vals.astype(int)
+        return table
+
+    def _check_pm_table(self, table, where, node_lookup, nstp, ncpl):
+        """private method to validate performance measure entry arrays and map
+        them to model nodes
+
+        Parameters
+        ----------
+        table (dict) : the one-based entry arrays, keyed by column name (see
+            `_pm_table_columns()`)
+        where (callable) : function returning a description of the location of
+            an entry (e.g. the adj file line), for error messages
+        node_lookup (ndarray) : the user-to-reduced node lookup, see
+            `_node_lookup()`
+        nstp (ndarray) : the number of time steps of each stress period
+        ncpl (int) : the number of cells per layer, for unstructured grids
+
+        Returns
+        -------
+        table (dict) : zero-based "kper", "kstp", "inode", "k", "i" and "j" arrays
+            ("i" and "j" are None for unstructured grids) and the "pm_type",
+            "pm_form", "weight" and "obsval" arrays, see `PerfMeas.from_arrays()`
+
+        """
+        kper = np.asarray(table["kper"], dtype=int) - 1
+        kstp = np.asarray(table["kstp"], dtype=int) - 1
+        if kper.shape[0] == 0:
+            return None
+        nper = nstp.shape[0]
+        bad = np.flatnonzero((kper < 0) | (kper > nper - 1))
+        if bad.shape[0] > 0:
+            raise Exception(f"kper > nper -1 on {where(bad[0])}")
+        nstp = np.asarray(nstp, dtype=int)
+        bad = np.flatnonzero((kstp < 0) | (kstp > nstp[kper] - 1))
+        if bad.shape[0] > 0:
+            raise Exception(f"kstp > nstp[kper] -1 on {where(bad[0])}")
+
+        k = np.asarray(table["k"], dtype=int) - 1
+        if self.is_structured:
+            i = np.asarray(table["i"], dtype=int) - 1
+            j = np.asarray(table["j"], dtype=int) - 1
+            bad = np.flatnonzero(
+                (k < 0)
+                | (k >= self._shape[0])
+                | (i < 0)
+                | (i >= self._shape[1])
+                | (j < 0)
+                | (j >= self._shape[2])
+            )
+            if bad.shape[0] > 0:
+                raise Exception(f"layer-row-column out of the grid on {where(bad[0])}")
+            # convert to node number
+            inode = np.ravel_multi_index((k, i, j), self._shape)
+        else:
+            i, j = None, None
+            inode = (int(np.asarray(ncpl).ravel()[0]) * k) + (
+                np.asarray(table["node"], dtype=int) - 1
+            )
+
+        # if there is a reduced node scheme
+        if node_lookup is not None:
+            valid = (inode >= 0) & (inode < node_lookup.shape[0])
+            reduced = np.full(inode.shape[0], -1, dtype=int)
+            reduced[valid] = node_lookup[inode[valid]]
+            bad = np.flatnonzero(reduced < 0)
+            if bad.shape[0] > 0:
+                raise Exception(
+                    f"node num {inode[bad[0]]} on {where(bad[0])} "
+                    + "not in reduced node num"
+                )
+            inode = reduced
+
+        pm_type = np.asarray(table["pm_type"], dtype=str)
+        pm_form = np.asarray(table["pm_form"], dtype=str)
+        package_names = set()
+        for pnames in self._gwf_package_dict.values():
+            package_names.update(pnames)
+        for ptype in np.unique(pm_type):
+            if ptype != "head" and ptype not in package_names:
+                self.logger.info(str(sorted(package_names)))
+                irow = np.flatnonzero(pm_type == ptype)[0]
+                raise Exception(
+                    f"`pm_type` {ptype} on {where(irow)} names a GWF package "
+                    + "instance that was not found"
+                )
+        for pform in np.unique(pm_form):
+            if pform not in ["direct", "residual"]:
+                irow = np.flatnonzero(pm_form == pform)[0]
+                raise Exception(
+                    f"`pm_form` {pform} on {where(irow)} must be 'direct' or "
+                    + "'residual'"
+                )
+
+        return {
+            "kper": kper,
+            "kstp": kstp,
+            "inode": inode,
+            "pm_type": pm_type,
+            "pm_form": pm_form,
+            "weight": np.asarray(table["weight"], dtype=float),
+            "obsval": np.asarray(table["obsval"], dtype=float),
+            "k": k,
+            "i": i,
+            "j": j,
+        }
+
     @staticmethod
     def get_model_names_from_mfsim(sim_ws: str):
         """return the model names from an mfsim.nam file
@@ -501,7 +870,13 @@ class Mf6Adj(object):
         return package_dict
 
     @staticmethod
-    def write_group_to_hdf(hdf, group_name: str, data_dict: dict, attr_dict: dict = {}):
+    def write_group_to_hdf(
+        hdf,
+        group_name: str,
+        data_dict: dict,
+        attr_dict: dict = {},
+        filters: Hdf5Filter | None = None,
+    ):
         """write information to an open HDF5 file
 
         Parameters
@@ -513,7 +888,10 @@ class Mf6Adj(object):
                 only 'nodelist' and 'bound' are stored.
             attr_dict (dict) : an optional dict of attributes to store with the
                 group
+            filters (Hdf5Filter) : optional compression filter and chunks of the
+                datasets
         """
+        filters = Hdf5Filter() if filters is None else filters
         if group_name in hdf:
             raise Exception(f"group_name {group_name} already in hdf file")
         grp = hdf.create_group(group_name)
@@ -523,17 +901,32 @@ class Mf6Adj(object):
             if isinstance(item, list):
                 item = np.array(item)
             if isinstance(item, np.ndarray):
-                _ = grp.create_dataset(tag, item.shape, dtype=item.dtype, data=item)
+                dclass = "amat" if tag == "amat" else "node"
+                _ = grp.create_dataset(
+                    tag,
+                    item.shape,
+                    dtype=item.dtype,
+                    data=item,
+                    **filters.kwargs(dclass, item.shape),
+                )
             elif isinstance(item, dict):
                 if "nodelist" in item:
                     iitem = item["nodelist"]
                     _ = grp.create_dataset(
-                        tag, iitem.shape, dtype=iitem.dtype, data=iitem
+                        tag,
+                        iitem.shape,
+                        dtype=iitem.dtype,
+                        data=iitem,
+                        **filters.kwargs("package", iitem.shape),
                     )
                 elif "bound" in item:
                     iitem = item["bound"]
                     _ = grp.create_dataset(
-                        tag, iitem.shape, dtype=iitem.dtype, data=iitem
+                        tag,
+                        iitem.shape,
+                        dtype=iitem.dtype,
+                        data=iitem,
+                        **filters.kwargs("package", iitem.shape),
                     )
                 else:
                     Mf6Adj.logger.info(
@@ -580,6 +973,19 @@ class Mf6Adj(object):
 
 
 
+        """
+        PerfMeas.write_group_to_hdf(
+            hdf, "gwf_info", self._get_gwf_info(), attr_dict=self._gwf_package_dict
+        )
+        hdf.attrs["gwf_name"] = self._gwf_name
+
+    def _get_gwf_info(self):
+        """get the model structure arrays from the API
+
+        Returns
+        -------
+        data_dict (dict) : the arrays of the 'gwf_info' group
+
         """
         gwf_name = self._gwf_name
         gwf = self._gwf
@@ -641,10 +1047,11 @@ class Mf6Adj(object):
             data_dict["nrow"] = nrow
             ncol = PerfMeas.get_ptr_from_gwf(gwf_name, dis_pak, "NCOL", gwf)
             data_dict["ncol"] = ncol
+        else:
+            ncpl = PerfMeas.get_ptr_from_gwf(gwf_name, dis_pak, "NCPL", gwf)
+            data_dict["ncpl"] = ncpl
 
-        PerfMeas.write_group_to_hdf(
-            hdf, "gwf_info", data_dict, attr_dict=self._gwf_package_dict
-        )
+        return data_dict
 
     @staticmethod
     def dresdss_h(
@@ -678,7 +1085,14 @@ class Mf6Adj(object):
         bot = PerfMeas.get_ptr_from_gwf(gwf_name, "DIS", "BOT", gwf)
         area = PerfMeas.get_ptr_from_gwf(gwf_name, "DIS", "AREA", gwf)
         iconvert = PerfMeas.get_ptr_from_gwf(gwf_name, "STO", "ICONVERT", gwf)
+        return Mf6Adj._dresdss_h(
+            top, bot, area, iconvert, head, head_old, dt, sat, sat_old
+        )
 
+    @staticmethod
+    def _dresdss_h(top, bot, area, iconvert, head, head_old, dt, sat, sat_old):
+        """private method for the partial of residual wrt ss times h from the
+        grid and storage arrays, see `dresdss_h()`"""
         # handle iconvert
         sat_mod = sat.copy()
         sat_mod[iconvert == 0] = 1.0
@@ -719,6 +1133,12 @@ class Mf6Adj(object):
         bot = PerfMeas.get_ptr_from_gwf(gwf_name, "DIS", "BOT", gwf)
         area = PerfMeas.get_ptr_from_gwf(gwf_name, "DIS", "AREA", gwf)
         storage = PerfMeas.get_ptr_from_gwf(gwf_name, "STO", "SS", gwf)
+        return Mf6Adj._drhsdh(top, bot, area, storage, dt)
+
+    @staticmethod
+    def _drhsdh(top, bot, area, storage, dt):
+        """private method for the partial of the RHS WRT H from the grid and
+        storage arrays, see `drhsdh()`"""
         drhsdh = -1.0 * storage * area * (top - bot) / dt
         return drhsdh
 
@@ -732,6 +1152,16 @@ class Mf6Adj(object):
         solve_func_ptr: Callable[[modflowapi.ModflowApi], None] | None = None,
         presolve_func_ptr: Callable[[modflowapi.ModflowApi], None] | None = None,
         postsolve_func_ptr: Callable[[modflowapi.ModflowApi], None] | None = None,
+        write_hdf5: bool = True,
+        harvest_func_ptr: Callable[[tuple, dict, dict], None] | None = None,
+        write_queue: int = 2,
+        dedup: bool = True,
+        lean: bool = False,
+        amat_keyframe: int = 0,
+        layout: str = "groups",
+        hdf5_filter=None,
+        hdf5_chunks: dict | None = None,
+        lossy: dict | None = None,
     ):
         """solve the flow across the modflow sim times and harvest the solution
         components needed for the adjoint solution and store them in the HDF5 file
@@ -747,6 +1177,51 @@ class Mf6Adj(object):
         pert_save (bool) : flag to save more information for the perturbation testing
         hdf5_name (str) : optional hdf5 filename to store forward solution components
             in. If None, a generic time-stamped filename is created.
+        write_hdf5 (bool) : flag to write the forward solution HDF5 file.  Default
+            is True
+        harvest_func_ptr (Callable) : optional function called after each time step
+            with the (kper,kstp), the harvested solution components and their
+            attributes (the contents of the solution group of the HDF5 file).
+            The arrays are buffers reused by the next time step, copy anything
+            kept longer than the call
+        write_queue (int) : the number of time steps that can wait to be written
+            to the HDF5 file by a background thread while MODFLOW6 solves the next
+            ones.  Writing waits when the queue is full.  Errors of the writer
+            thread are raised at the end of the solve (or by `finalize()`).  If
+            0, each time step is written before the next one is solved.  Default
+            is 2
+        dedup (bool) : flag to write arrays that have not changed since the last
+            time step (K, saturated conductance, the storage term and the boundary
+            data within a stress period, for instance) only once, later time steps
+            link to the first copy.  Linked datasets read like any other.  Default
+            is True
+        lean (bool) : flag to write only the primary state: 'head_old' and
+            'sat_old' (the last time step's 'head' and 'sat') and the storage
+            derivatives 'dresdss_h' and 'drhsdh' are left out of the file and
+            derived on read by `ForwardStore`.  Default is False
+        amat_keyframe (int) : the number of time steps from one full AMAT to
+            the next.  The time steps in between only store the AMAT entries that
+            changed since the last full AMAT (lossless, `ForwardStore` rebuilds
+            AMAT on read).  Default is 0 (every AMAT in full)
+        layout (str) : "groups" writes one HDF5 group per time step, "stacked"
+            appends each array to one extendable dataset (time x nodes for the
+            solution arrays) with a time index table, which keeps the number of
+            HDF5 objects independent of the number of time steps.  Read either
+            with `ForwardStore`.  Default is "groups"
+        hdf5_filter (str or Hdf5Filter) : the compression filter of the solution
+            datasets, "none", "gzip", "lzf" or "shuffle+gzip", or an
+            `Hdf5Filter`.  If None, the 'hdf5_filter' option of the adj file is
+            used (no filter if there is none).  Readers need no settings.  See
+            `benchmark_hdf5_filter()` to compare them for a model
+        hdf5_chunks (dict) : optional chunks of the solution datasets, keyed by
+            dataset class ("amat", "node", "package" or "time").  Replace those
+            of the 'hdf5_chunks' options.  See `Hdf5Filter`.  Default is None
+        lossy (dict) : optional error bounds to store 'amat', 'head' and 'sat'
+            lossy (quantized), keyed by array name, as ("abs", bound) or ("rel",
+            bound) tuples, for instance {"head": ("abs", 1.0e-4)}.  For
+            screening studies only.  `ForwardStore` decodes the arrays on read.
+            See `GroupWriter` and `verify_lossy()`.  Default is None (all arrays
+            stored exactly)
 
         Returns
         -------
@@ -758,7 +1233,37 @@ class Mf6Adj(object):
             self._gwf = self._initialize_gwf(self._lib_name, self._flow_dir)
         if hdf5_name is not None:
             self._hdf5_name = hdf5_name
-        fhd = self._open_hdf(self._hdf5_name)
+        fhd = None
+        writer = None
+        if write_hdf5:
+            filters = Hdf5Filter.create(
+                self._hdf5_filter if hdf5_filter is None else hdf5_filter,
+                hdf5_chunks,
+            )
+            self.logger.info(f"...hdf5 filter: {filters!s}")
+            fhd = self._open_hdf(self._hdf5_name)
+            if write_queue > 0:
+                writer = AsyncGroupWriter(
+                    fhd,
+                    max_queue=write_queue,
+                    dedup=dedup,
+                    lean=lean,
+                    amat_keyframe=amat_keyframe,
+                    layout=layout,
+                    filters=filters,
+                    lossy=lossy,
+                )
+            else:
+                writer = GroupWriter(
+                    fhd,
+                    dedup=dedup,
+                    lean=lean,
+                    amat_keyframe=amat_keyframe,
+                    layout=layout,
+                    filters=filters,
+                    lossy=lossy,
+                )
+            self._writer = writer
         sim_start = datetime.now()
 
         self.logger.info(f"...starting flow solution at {sim_start.strftime(DT_FMT)}")
@@ -771,16 +1276,11 @@ class Mf6Adj(object):
         # let's do it!
         num_fails = 0
 
-        sat_old = None
         visited = []
         ctimes = []
         dts = []
         kpers, kstps = [], []
 
-        nnode = self._gwf.get_value(
-            self._gwf.get_var_address("NODES", self._gwf_name, "DIS")
-        )[0]
-
         is_newton = self._gwf.get_value(
             self._gwf.get_var_address("INEWTON", self._gwf_name)
         )[0]
@@ -788,6 +1288,15 @@ class Mf6Adj(object):
         if PerfMeas.has_sto_iconvert(self._gwf):
             has_sto = True
 
+        harvester = Harvester(
+            self._gwf,
+            self._gwf_name,
+            self._gwf_package_dict,
+            self._gwf_package_types,
+            self._gwf_boundary_attr_dict,
+            has_sto=has_sto,
+        )
+
         sp_package_data = None
         head_dict = None
         if pert_save:
@@ -803,12 +1312,7 @@ class Mf6Adj(object):
 
             kiter = 0
             # prep to solve
-            stress_period = self._gwf.get_value(
-                self._gwf.get_var_address("KPER", "TDIS")
-            )[0]
-            time_step = self._gwf.get_value(self._gwf.get_var_address("KSTP", "TDIS"))[
-                0
-            ]
+            stress_period, time_step = harvester.kper_kstp()
             kper, kstp = stress_period - 1, time_step - 1
             kperkstp = (kper, kstp)
 
@@ -864,10 +1368,7 @@ class Mf6Adj(object):
                 presolve_func_ptr(self._gwf)
 
             self._gwf.prepare_solve(1)
-            if sat_old is None:
-                sat_old = self._gwf.get_value(
-                    self._gwf.get_var_address("SAT", self._gwf_name, "NPF")
-                )
+            harvester.init_sat_old()
 
             # solve until converged
             while kiter < max_iter:
@@ -914,172 +1415,62 @@ class Mf6Adj(object):
                 raise Exception(f"{kperkstp} already visited")
             visited.append(kperkstp)
 
-            amat = self._gwf.get_value(
-                self._gwf.get_var_address("AMAT", "SLN_1")
-            ).copy()
-            data_dict = {"amat": amat}
-
-            head = self._gwf.get_value(
-                self._gwf.get_var_address("X", self._gwf_name.upper())
-            )[:nnode]
-            data_dict["head"] = head
+            data_dict = harvester.harvest()
+            head = data_dict["head"]
+            head_old = data_dict["head_old"]
+            sat = data_dict["sat"]
+            sat_old = data_dict["sat_old"]
             if pert_save:
-                head_dict[kperkstp] = head
-
-            head_old = self._gwf.get_value(
-                self._gwf.get_var_address("XOLD", self._gwf_name.upper())
-            )[:nnode]
-            data_dict["head_old"] = head_old
-
-            k11 = self._gwf.get_value(
-                self._gwf.get_var_address("K11", self._gwf_name.upper(), "NPF")
-            )
-            data_dict["k11"] = k11
-            k33 = self._gwf.get_value(
-                self._gwf.get_var_address("K33", self._gwf_name.upper(), "NPF")
-            )
-            data_dict["k33"] = k33
-            condsat = self._gwf.get_value(
-                self._gwf.get_var_address("CONDSAT", self._gwf_name.upper(), "NPF")
-            )
-            data_dict["condsat"] = condsat
+                head_dict[kperkstp] = head.copy()
 
-            iss = self._gwf.get_value(
-                self._gwf.get_var_address("ISS", self._gwf_name.upper())
-            )
-            data_dict["iss"] = iss
-
-            sat = self._gwf.get_value(
-                self._gwf.get_var_address("SAT", self._gwf_name, "NPF")
-            )
-            data_dict["sat"] = sat
-            data_dict["sat_old"] = sat_old
-
-            sat_old = sat.copy()
             if has_sto:  # has storage
-                dresdss_h = Mf6Adj.dresdss_h(
-                    self._gwf_name, self._gwf, head, head_old, dt1, sat, sat_old
+                grid = harvester.grid
+                data_dict["dresdss_h"] = Mf6Adj._dresdss_h(
+                    grid["top"],
+                    grid["bot"],
+                    grid["area"],
+                    grid["iconvert"],
+                    head,
+                    head_old,
+                    dt1,
+                    sat,
+                    # the current saturation, as the derivative always used
+                    sat,
+                )
+                data_dict["drhsdh"] = Mf6Adj._drhsdh(
+                    grid["top"], grid["bot"], grid["area"], grid["ss"], dt1
                 )
-                data_dict["dresdss_h"] = dresdss_h
-                drhsdh = Mf6Adj.drhsdh(self._gwf_name, self._gwf, dt1)
-                data_dict["drhsdh"] = drhsdh
             else:
                 data_dict["drhsdh"] = np.zeros_like(sat_old)
 
-            for package_type in self._gwf_package_types:
-                if package_type in self._gwf_package_dict:
-                    if pert_save and package_type not in sp_package_data:
-                        sp_package_data[package_type] = {}
-                    for tag in self._gwf_package_dict[package_type]:
-                        nbound = self._gwf.get_value(
-                            self._gwf.get_var_address(
-                                "NBOUND", self._gwf_name, tag.upper()
-                            )
-                        )[0]
-                        if nbound > 0:
-                            if pert_save and kperkstp in sp_package_data[package_type]:
-                                if len(self._gwf_package_dict[package_type]) == 1:
-                                    raise Exception(
-                                        f"kperkstp '{kperkstp}' already in "
-                                        + "sp_package_data"
-                                    )
-                                else:
-                                    pass
-                            elif pert_save:
-                                sp_package_data[package_type][kperkstp] = []
-                            nodelist = self._gwf.get_value(
-                                self._gwf.get_var_address(
-                                    "NODELIST", self._gwf_name, tag.upper()
-                                )
-                            )
-                            bound = self._gwf.get_value(
-                                self._gwf.get_var_address(
-                                    "BOUND", self._gwf_name, tag.upper()
-                                )
-                            )
-                            hcof = self._gwf.get_value(
-                                self._gwf.get_var_address(
-                                    "HCOF", self._gwf_name, tag.upper()
-                                )
-                            )
-                            rhs = self._gwf.get_value(
-                                self._gwf.get_var_address(
-                                    "RHS", self._gwf_name, tag.upper()
-                                )
-                            )
-
-                            simvals = self._gwf.get_value(
-                                self._gwf.get_var_address(
-                                    "SIMVALS", self._gwf_name, tag.upper()
-                                )
-                            )
-                            bnd_attrs = {}
-                            if package_type in self._gwf_boundary_attr_dict:
-                                fill_bound = False
-                                if bound.size == 0:
-                                    bound = np.zeros(
-                                        (
-                                            len(nodelist),
-                                            len(
-                                                self._gwf_boundary_attr_dict[
-                                                    package_type
-                                                ]
-                                            ),
-                                        )
-                                    )
-                                    fill_bound = True
-                                for i, attr in enumerate(
-                                    self._gwf_boundary_attr_dict[package_type]
-                                ):
-                                    vals = self._gwf.get_value(
-                                        self._gwf.get_var_address(
-                                            attr.upper(), self._gwf_name, tag.upper()
-                                        )
-                                    )
-                                    bnd_attrs[attr] = vals
-                                    if fill_bound:
-                                        bound[:, i] = vals
-
-                            if package_type == "sfr6":
-                                tag = self._gwf_package_dict[package_type][0]
-                                stage = self._gwf.get_value(
-                                    self._gwf.get_var_address(
-                                        "STAGE", self._gwf_name, tag.upper()
-                                    )
-                                )
-                                bound[:, 0] = stage
-                                bound[:, 1] = -1.0 * hcof
-
-                            if pert_save:
-                                for i in range(nbound):
-                                    # note bound is an array!
-                                    pak_data = {
-                                        "node": nodelist[i],
-                                        "bound": bound[i],
-                                        "hcof": hcof[i],
-                                        "rhs": rhs[i],
-                                        "packagename": tag,
-                                        "simval": simvals[i],
-                                    }
-                                    for key, val in bnd_attrs.items():
-                                        pak_data[key] = val[i]
-                                    sp_package_data[package_type][kperkstp].append(
-                                        pak_data
-                                    )
-                            data_dict[tag] = {
-                                "ptype": package_type,
-                                "nodelist": nodelist,
-                                "bound": bound,
-                                "hcof": hcof,
-                                "rhs": rhs,
-                                "simvals": simvals,
-                            }
-                            for key, val in bnd_attrs.items():
-                                assert key not in data_dict[tag], (
-                                    f"boundary attribute '{key}' already in "
-                                    + f"data dict for {tag}"
-                                )
-                                data_dict[tag][key] = val
+            if pert_save:
+                for package_type in self._gwf_package_types:
+                    if package_type in self._gwf_package_dict:
+                        sp_package_data.setdefault(package_type, {})
+            for package_type, tag, nbound, pdata in harvester.harvest_packages():
+                if pert_save and kperkstp in sp_package_data[package_type]:
+                    if len(self._gwf_package_dict[package_type]) == 1:
+                        raise Exception(
+                            f"kperkstp '{kperkstp}' already in sp_package_data"
+                        )
+                elif pert_save:
+                    sp_package_data[package_type][kperkstp] = []
+                if pert_save:
+                    attrs = self._gwf_boundary_attr_dict.get(package_type, [])
+                    for i in range(nbound):
+                        # note bound is an array!
+                        pak_data = {
+                            "node": pdata["nodelist"][i],
+                            "bound": pdata["bound"][i].copy(),
+                            "hcof": pdata["hcof"][i],
+                            "rhs": pdata["rhs"][i],
+                            "packagename": tag,
+                            "simval": pdata["simvals"][i],
+                        }
+                        for key in attrs:
+                            pak_data[key] = pdata[key][i]
+                        sp_package_data[package_type][kperkstp].append(pak_data)
+                data_dict[tag] = pdata
             attr_dict = {
                 "ctime": ctime,
                 "dt": dt1,
@@ -1088,12 +1479,18 @@ class Mf6Adj(object):
                 "is_newton": is_newton,
                 "has_sto": has_sto,
             }
-            PerfMeas.write_group_to_hdf(
-                fhd,
-                group_name=f"solution_kper:{kper:05d}_kstp:{kstp:05d}",
-                data_dict=data_dict,
-                attr_dict=attr_dict,
-            )
+            if harvest_func_ptr is not None:
+                harvest_func_ptr(kperkstp, data_dict, attr_dict)
+            group_name = f"solution_kper:{kper:05d}_kstp:{kstp:05d}"
+            if writer is not None:
+                try:
+                    writer.write(group_name, data_dict, attr_dict)
+                except Exception:
+                    # the writer failed (now or on an earlier time step), stop here
+                    self._writer = None
+                    writer.close(raise_error=False)
+                    fhd.close()
+                    raise
 
         sim_end = datetime.now()
         td = (sim_end - sim_start).total_seconds() / 60.0
@@ -1105,11 +1502,19 @@ class Mf6Adj(object):
             if num_fails > 0:
                 self.logger.info(f"...failed to converge {num_fails} times")
 
-        PerfMeas.write_group_to_hdf(
-            fhd, "aux", {"totime": ctimes, "dt": dts, "kper": kpers, "kstp": kstps}
-        )
-        self._add_gwf_info_to_hdf(fhd)
-        fhd.close()
+        if writer is not None:
+            self._writer = None
+            try:
+                writer.close()
+            except Exception:
+                fhd.close()
+                raise
+        if fhd is not None:
+            PerfMeas.write_group_to_hdf(
+                fhd, "aux", {"totime": ctimes, "dt": dts, "kper": kpers, "kstp": kstps}
+            )
+            self._add_gwf_info_to_hdf(fhd)
+            fhd.close()
         if pert_save:
             return head_dict, sp_package_data
 
@@ -1118,6 +1523,16 @@ class Mf6Adj(object):
         linear_solver=None,
         linear_solver_kwargs: dict = {},
         use_precon: bool = True,
+        max_memory=None,
+        checkpoint_interval: int | None = None,
+        resume: bool = False,
+        cache_dir: str | None = None,
+        cache_max_size=None,
+        use_basis: bool = False,
+        projection: dict | None = None,
+        write_nodes: bool = True,
+        hdf5_filter=None,
+        hdf5_chunks: dict | None = None,
     ):
         """Solve for the adjoint state, one performance measure at at time
 
@@ -1133,6 +1548,43 @@ class Mf6Adj(object):
             `linear_solver`.  Default is {}
         use_precon (bool): flag to use an ILU preconditioner with iterative
             linear solver.
+        max_memory (int or str): optional memory budget for each performance
+            measure adjoint solve, in bytes or as a string such as "8GB".  See
+            `PerfMeas.solve_adjoint()`.  Default is None
+        checkpoint_interval (int): optional number of timesteps between adjoint
+            state checkpoints.  See `PerfMeas.solve_adjoint()`.  Default is None
+        resume (bool): flag to continue interrupted adjoint solves from their
+            checkpoints.  Performance measures that finished are solved again.
+            Default is False
+        cache_dir (str): optional directory of an `AdjointCache`.  Performance
+            measures whose entries, forward solution and solver options match a
+            cached result are not solved again: the cached adjoint solution and
+            summary files are restored instead.  New results are added to the
+            cache.  Default is None (no caching)
+        cache_max_size (int or str): optional size limit of the cache, in bytes
+            or as a string such as "10GB".  Least recently used results are
+            evicted past this size.  Default is None (no limit)
+        use_basis (bool): flag to solve the head performance measures through the
+            unit adjoint basis: one adjoint solve per unique observation location
+            and time, stored in 'adjoint_basis_<hdf5_name>', from which each
+            performance measure is assembled as a weighted sum.  The basis is
+            reused in later calls, so changing weights or observed values needs
+            no new solves.  Per time step adjoint results are not written for
+            these performance measures.  Other performance measures are solved
+            as usual.  Can't be combined with `max_memory`,
+            `checkpoint_interval` or `resume`.  See `PerfMeas.solve_basis()`.
+            Default is False
+        projection (dict) : optional node-to-parameter projections (zone arrays
+            or sparse matrices), keyed by composite name.  See
+            `PerfMeas.solve_adjoint()`.  Can't be combined with `cache_dir` or
+            `use_basis`.  Default is None
+        write_nodes (bool) : flag to write the node-level results to the adjoint
+            solution HDF5 files.  Default is True
+        hdf5_filter (str or Hdf5Filter) : the compression filter of the adjoint
+            solution datasets.  If None, the 'hdf5_filter' option of the adj file
+            is used.  See `solve_gwf()`
+        hdf5_chunks (dict) : optional chunks of the adjoint solution datasets,
+            keyed by dataset class.  See `solve_gwf()`.  Default is None
 
         Returns
         -------
@@ -1140,23 +1592,699 @@ class Mf6Adj(object):
         dfs (dict) : dictionary of dataframes (one per performance measure) summarizing
             the composite sensitivity information.  More granular information can be
             found in the corresponding HDF5 file that is created by the adjoint
-            solve
+            solve.  If `projection` is not None, each value is a (dataframe,
+            projected dataframe) tuple
 
 
         """
         if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
             raise Exception("need to call solve_gwf() first")
+        if projection is not None and (cache_dir is not None or use_basis):
+            raise Exception(
+                "'projection' can't be combined with 'cache_dir' or 'use_basis'"
+            )
+        if use_basis and (
+            max_memory is not None or checkpoint_interval is not None or resume
+        ):
+            raise Exception(
+                "'use_basis' can't be combined with 'max_memory', "
+                + "'checkpoint_interval' or 'resume'"
+            )
+
+        filters = Hdf5Filter.create(
+            self._hdf5_filter if hdf5_filter is None else hdf5_filter, hdf5_chunks
+        )
+        cache, fwd_fingerprint = None, None
+        if cache_dir is not None:
+            cache = AdjointCache(cache_dir, max_size=cache_max_size)
+            fwd_fingerprint = PerfMeas.forward_fingerprint(self._hdf5_name)
+
+        dfs, keys = {}, {}
+        for pm in self._performance_measures:
+            if cache is not None:
+                keys[pm.name] = AdjointCache.key(
+                    pm.fingerprint(),
+                    fwd_fingerprint,
+                    linear_solver=linear_solver,
+                    linear_solver_kwargs=linear_solver_kwargs,
+                    use_precon=use_precon,
+                    write_nodes=write_nodes,
+                    hdf5_filter=filters,
+                    use_basis=use_basis and not pm._entries.has_flux,
+                )
+                df = cache.get(
+                    keys[pm.name],
+                    pm.adjoint_solution_fname(self._hdf5_name),
+                    f"adjoint_summary_{pm.name}.csv",
+                )
+                if df is not None:
+                    self.logger.info(f"using cached adjoint solution for pm {pm.name}")
+                    dfs[pm.name] = df
+
+        basis_pms = []
+        if use_basis:
+            locations = []
+            for pm in self._performance_measures:
+                if pm.name in dfs:
+                    continue
+                if not pm._entries.has_flux:
+                    basis_pms.append(pm.name)
+                    locations.extend(pm.basis_locations())
+            if len(basis_pms) > 0:
+                PerfMeas.solve_basis(
+                    self._hdf5_name,
+                    locations,
+                    linear_solver=linear_solver,
+                    linear_solver_kwargs=linear_solver_kwargs,
+                    use_precon=use_precon,
+                )
 
-        dfs = {}
         for pm in self._performance_measures:
-            df = pm.solve_adjoint(
+            if pm.name in dfs:
+                continue
+            if pm.name in basis_pms:
+                df = pm.solve_adjoint_from_basis(
+                    self._hdf5_name, write_nodes=write_nodes, hdf5_filter=filters
+                )
+            else:
+                df = pm.solve_adjoint(
+                    self._hdf5_name,
+                    linear_solver=linear_solver,
+                    linear_solver_kwargs=linear_solver_kwargs,
+                    use_precon=use_precon,
+                    max_memory=max_memory,
+                    checkpoint_interval=checkpoint_interval,
+                    resume=resume,
+                    projection=projection,
+                    write_nodes=write_nodes,
+                    hdf5_filter=filters,
+                )
+            if cache is not None:
+                cache.put(
+                    keys[pm.name],
+                    pm.name,
+                    pm.adjoint_solution_fname(self._hdf5_name),
+                    f"adjoint_summary_{pm.name}.csv",
+                )
+            dfs[pm.name] = df
+        dfs = {pm.name: dfs[pm.name] for pm in self._performance_measures}
+        return dfs
+
+    def benchmark_hdf5_filter(
+        self, filters: list | None = None, sol_key: str | None = None
+    ):
+        """Compare compression filters on a time step of the forward solution
+        HDF5 file: the bytes written, the write throughput and the read-back
+        throughput of each.  See `Hdf5Filter.benchmark()`
+
+        Parameters
+        ----------
+        filters (list) : the filters to compare, as `Hdf5Filter` or filter specs
+            such as "shuffle+gzip".  If None, "none", "lzf", "gzip",
+            "shuffle+gzip" and the filter of the adj file options are compared
+        sol_key (str) : the solution group of the time step.  If None, the
+            middle time step is used
+
+        Returns
+        -------
+        df (DataFrame) : the bytes and throughput of each filter
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        if filters is None:
+            filters = ["none", "lzf", "gzip", "shuffle+gzip"]
+            if str(self._hdf5_filter) not in [str(Hdf5Filter(f)) for f in filters]:
+                filters.append(self._hdf5_filter)
+        df = Hdf5Filter.benchmark(self._hdf5_name, filters=filters, sol_key=sol_key)
+        self.logger.info(f"hdf5 filter benchmark:\n{df.to_string()}")
+        return df
+
+    def verify_lossy(
+        self,
+        pm_name: str,
+        lossy: dict,
+        linear_solver=None,
+        linear_solver_kwargs: dict = {},
+        use_precon: bool = True,
+    ):
+        """Report the effect of lossy storage (see `solve_gwf()`) on the
+        composite sensitivities of a performance measure, from an exactly stored
+        forward solution.  See `PerfMeas.verify_lossy()`
+
+        Parameters
+        ----------
+        pm_name (str) : the performance measure name
+        lossy (dict) : the error bounds, keyed by "amat", "head" or "sat"
+        linear_solver (varies) : the linear solver.  See `solve_adjoint()`
+        linear_solver_kwargs (dict): dictionary of keyword args to pass to
+            `linear_solver`.  Default is {}
+        use_precon (bool): flag to use an ILU preconditioner with iterative
+            linear solver.
+
+        Returns
+        -------
+        df (DataFrame) : the sensitivity errors of each composite
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        pms = [
+            pm
+            for pm in self._performance_measures
+            if pm.name == pm_name.lower().strip()
+        ]
+        if len(pms) == 0:
+            raise Exception(f"performance measure '{pm_name}' not found")
+        df = pms[0].verify_lossy(
+            self._hdf5_name,
+            lossy,
+            linear_solver=linear_solver,
+            linear_solver_kwargs=linear_solver_kwargs,
+            use_precon=use_precon,
+        )
+        self.logger.info(f"lossy storage check of {pm_name}:\n{df.to_string()}")
+        return df
+
+    def evaluate(self, return_entries: bool = False):
+        """Calculate the value of each performance measure from the forward
+        solution HDF5 file.  See `PerfMeas.evaluate()`
+
+        Parameters
+        ----------
+        return_entries (bool) : flag to also return the simulated value of each
+            entry.  Default is False
+
+        Returns
+        -------
+        values (dict) : the performance measure values, keyed by name.  If
+            `return_entries` is True, each value is a (value, entries dataframe)
+            tuple
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        with ForwardStore(self._hdf5_name) as hdf:
+            return {
+                pm.name: pm.evaluate(hdf, return_entries=return_entries)
+                for pm in self._performance_measures
+            }
+
+    def solve_fused(
+        self,
+        write_hdf5: bool = False,
+        hdf5_name: str | None = None,
+        write_results: bool = True,
+    ):
+        """Solve the forward model and, right after the time step converges, the
+        adjoint states of all performance measures from the in-memory solution
+        components, sharing one AMAT factorization.  Only for models with a
+        single time step (e.g. steady state), where the adjoint needs nothing but
+        that time step.  See `PerfMeas.solve_adjoint_fused()`
+
+        Parameters
+        ----------
+        write_hdf5 (bool) : flag to also write the forward solution HDF5 file, for
+            later use with the other methods.  Default is False
+        hdf5_name (str) : optional forward solution HDF5 filename, used if
+            `write_hdf5` is True
+        write_results (bool) : flag to write the summary CSV file of each
+            performance measure.  Default is True
+
+        Returns
+        -------
+        dfs (dict) : dictionary of dataframes (one per performance measure)
+            summarizing the composite sensitivity information
+
+        """
+        nstp = self._gwf.get_value(self._gwf.get_var_address("NSTP", "TDIS"))
+        if int(np.sum(nstp)) != 1:
+            raise Exception(
+                f"solve_fused() needs a single time step model, found {np.sum(nstp)}"
+            )
+        gwf_info = self._get_gwf_info()
+        dfs = {}
+
+        def solve_adjoints(kperkstp, data_dict, attr_dict):
+            dfs.update(
+                PerfMeas.solve_adjoint_fused(
+                    self._performance_measures,
+                    kperkstp,
+                    data_dict,
+                    gwf_info,
+                    self._gwf_package_dict,
+                    attr_dict["is_newton"],
+                    write_results=write_results,
+                )
+            )
+
+        self.solve_gwf(
+            hdf5_name=hdf5_name,
+            write_hdf5=write_hdf5,
+            harvest_func_ptr=solve_adjoints,
+        )
+        return {pm.name: dfs[pm.name] for pm in self._performance_measures}
+
+    def solve_jacobian(
+        self,
+        jco_fname: str | None = None,
+        composites: list | None = None,
+        zones: dict | None = None,
+        linear_solver=None,
+        linear_solver_kwargs: dict = {},
+        use_precon: bool = True,
+    ):
+        """Solve for the Jacobian matrix, with one row per performance measure
+        entry and one column per parameter.  Each row holds the composite
+        sensitivities of the entry, as if it were a performance measure on its own.
+        Rows are streamed to a pyemu dense binary matrix file as they are solved;
+        no per performance measure HDF5 or CSV files are written.  Head entries
+        are assembled from the unit adjoint basis (see `PerfMeas.solve_basis()`),
+        flux entries take one adjoint solve each.
+
+        Parameters
+        ----------
+        jco_fname (str) : the Jacobian file to write.  If None,
+            '<hdf5_name>.jcb' is used.  Can be read with
+            `pyemu.Jco.from_binary()`
+        composites (list) : the composite sensitivities to use as parameter
+            types, for example ["k11", "ss"].  If None, all of them are used
+        zones (dict) : optional integer zone arrays, keyed by composite name.  The
+            sensitivities of the nodes in each zone are summed into one parameter,
+            named '<composite>_z<zone>'.  Zones less than or equal to zero are
+            excluded.  Composites not in `zones` have one parameter per node,
+            named '<composite>_<node>'.  See `PerfMeas.zone_projection()`.
+            Default is None
+        linear_solver (varies) : the linear solver.  See `solve_adjoint()`
+        linear_solver_kwargs (dict): dictionary of keyword args to pass to
+            `linear_solver`.  Default is {}
+        use_precon (bool): flag to use an ILU preconditioner with iterative
+            linear solver.
+
+        Returns
+        -------
+        jco_fname (str) : the Jacobian file
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        if jco_fname is None:
+            jco_fname = self._hdf5_name + ".jcb"
+        rows, heads, kk_sol_map, nnodes, composites, projs, col_names = (
+            self._jacobian_setup(composites, zones)
+        )
+        locations = [
+            (entry.kperkstp[0], entry.kperkstp[1], entry.inode)
+            for _, _, entry in rows
+            if entry.pm_type == "head"
+        ]
+        if len(locations) > 0:
+            PerfMeas.solve_basis(
                 self._hdf5_name,
+                locations,
                 linear_solver=linear_solver,
                 linear_solver_kwargs=linear_solver_kwargs,
                 use_precon=use_precon,
             )
-            dfs[pm.name] = df
-        return dfs
+            bdf = h5py.File(PerfMeas.basis_fname(self._hdf5_name), "r")
+            col_map = {
+                tuple(loc): i for i, loc in enumerate(bdf["locations"][:].tolist())
+            }
+
+        jac_start = datetime.now()
+        f = jco_fname
+        for irow, (row_name, pm, entry) in enumerate(rows):
+            if entry.pm_type == "head":
+                coef = 0.0
+                if entry.kperkstp in kk_sol_map:
+                    coef = entry.dfdh(heads.get(entry.kperkstp, None))
+                    col = col_map[(entry.kperkstp[0], entry.kperkstp[1], entry.inode)]
+                comp = {
+                    name: (
+                        coef * bdf["basis"][name][:, col]
+                        if coef != 0.0
+                        else np.zeros(nnodes)
+                    )
+                    for name in composites
+                }
+            else:
+                df = PerfMeas(
+                    row_name, [entry], verbose_level=pm.verbose_level
+                ).solve_adjoint(
+                    self._hdf5_name,
+                    linear_solver=linear_solver,
+                    linear_solver_kwargs=linear_solver_kwargs,
+                    use_precon=use_precon,
+                    write_results=False,
+                )
+                comp = {name: df[name].values for name in composites}
+            row = Mf6Adj._project(comp, composites, projs)
+            f = pyemu.Matrix.write_dense(
+                f, [row_name], col_names, row[None, :], close=irow == len(rows) - 1
+            )
+            if (irow + 1) % 100 == 0:
+                rate = (irow + 1) / (datetime.now() - jac_start).total_seconds()
+                self.logger.info(
+                    f"jacobian: {irow + 1} of {len(rows)} rows, {rate:.2f} rows/sec"
+                )
+        if len(locations) > 0:
+            bdf.close()
+        took = (datetime.now() - jac_start).total_seconds()
+        msg = (
+            f"jacobian: {len(rows)} rows by {len(col_names)} columns took {took} "
+            + f"seconds, {len(rows) / max(took, 1e-10):.2f} rows/sec"
+        )
+        self.logger.info(msg)
+        print(datetime.now(), msg)
+        return jco_fname
+
+    def solve_tangent(self, directions: dict):
+        """Solve for the directional derivatives of all heads and boundary flows
+        with the forward-mode (tangent-linear) engine, one sweep forward in time
+        per call for any number of parameter directions.  This is cheaper than
+        the adjoint when there are few parameters and many outputs.  See
+        `TangentLinear.solve()`
+
+        Parameters
+        ----------
+        directions (dict) : parameter directions, keyed by direction name.  Each
+            direction is a dict of perturbations keyed by composite name (e.g.
+            "k11" or "ghb_0_cond"), either a scalar or one value per model node
+
+        Returns
+        -------
+        results (dict) : keyed by direction name, each a dict of 'head' and
+            boundary flow derivative arrays (time steps by nodes or boundary
+            entries)
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        tl = TangentLinear(self._hdf5_name)
+        try:
+            results = tl.solve(directions)
+        finally:
+            tl.close()
+        return results
+
+    def sketch_jacobian(
+        self,
+        k: int,
+        seed: int | None = None,
+        composites: list | None = None,
+        zones: dict | None = None,
+        linear_solver=None,
+        linear_solver_kwargs: dict = {},
+        use_precon: bool = True,
+    ):
+        """Form a randomized, rank-`k` approximation of the Jacobian matrix (see
+        `solve_jacobian()`) from `k` adjoint solves instead of one per entry.  Each
+        solve is for a synthetic performance measure that is a random (standard
+        normal) combination of all the head performance measure entries, giving a
+        sketch Y = J^T Omega of the parameter space.  Since E[Y Y^T] / k = J^T J,
+        the singular value decomposition of Y / sqrt(k) estimates the dominant
+        right singular vectors and singular values of J, for FOSM and null space
+        analyses.
+
+        Parameters
+        ----------
+        k (int) : the number of synthetic performance measures (the sketch rank)
+        seed (int) : optional random seed
+        composites (list) : the composite sensitivities to use as parameter
+            types.  See `solve_jacobian()`
+        zones (dict) : optional integer zone arrays, keyed by composite name.  See
+            `solve_jacobian()`
+        linear_solver (varies) : the linear solver.  See `solve_adjoint()`
+        linear_solver_kwargs (dict): dictionary of keyword args to pass to
+            `linear_solver`.  Default is {}
+        use_precon (bool): flag to use an ILU preconditioner with iterative
+            linear solver.
+
+        Returns
+        -------
+        sketch (dict) : with keys 'u' (DataFrame of the approximate right singular
+            vectors of J, parameters by `k`), 's' (ndarray of the approximate
+            singular values of J), 'y' (DataFrame of the sketch Y, parameters by
+            `k`) and 'omega' (DataFrame of the random weights, entries by `k`)
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        k = int(k)
+        if k < 1:
+            raise Exception("'k' must be at least 1")
+        rows, heads, kk_sol_map, _, composites, projs, col_names = self._jacobian_setup(
+            composites, zones
+        )
+        for row_name, _, entry in rows:
+            if entry.pm_type != "head":
+                raise Exception(
+                    f"entry '{row_name}' is a '{entry.pm_type}' flux entry, only "
+                    + "head entries can be combined in a sketch"
+                )
+        coefs = np.zeros(len(rows))
+        for irow, (_, _, entry) in enumerate(rows):
+            if entry.kperkstp in kk_sol_map:
+                coefs[irow] = entry.dfdh(heads.get(entry.kperkstp, None))
+
+        rng = np.random.default_rng(seed)
+        omega = rng.standard_normal((len(rows), k))
+        y = np.zeros((len(col_names), k))
+        for isketch in range(k):
+            # entries at the same location and time are summed into one
+            loc_coefs = {}
+            for irow, (_, _, entry) in enumerate(rows):
+                loc = (entry.kperkstp[0], entry.kperkstp[1], entry.inode)
+                loc_coefs[loc] = (
+                    loc_coefs.get(loc, 0.0) + omega[irow, isketch] * coefs[irow]
+                )
+            entries = [
+                PerfMeasRecord(kper, kstp, inode, "head", "direct", coef, 0.0)
+                for (kper, kstp, inode), coef in loc_coefs.items()
+            ]
+            df = PerfMeas(f"sketch_{isketch + 1}", entries).solve_adjoint(
+                self._hdf5_name,
+                linear_solver=linear_solver,
+                linear_solver_kwargs=linear_solver_kwargs,
+                use_precon=use_precon,
+                write_results=False,
+            )
+            y[:, isketch] = Mf6Adj._project(
+                {name: df[name].values for name in composites}, composites, projs
+            )
+
+        u, s, _ = np.linalg.svd(y / np.sqrt(k), full_matrices=False)
+        sv_names = [f"sv_{i + 1}" for i in range(s.shape[0])]
+        return {
+            "u": pd.DataFrame(u, index=col_names, columns=sv_names),
+            "s": s,
+            "y": pd.DataFrame(
+                y,
+                index=col_names,
+                columns=[f"sketch_{i + 1}" for i in range(k)],
+            ),
+            "omega": pd.DataFrame(
+                omega,
+                index=[row[0] for row in rows],
+                columns=[f"sketch_{i + 1}" for i in range(k)],
+            ),
+        }
+
+    def gauss_newton_operator(
+        self,
+        pm_names: list | None = None,
+        composites: list | None = None,
+        zones: dict | None = None,
+    ):
+        """Form a matrix-free Gauss-Newton Hessian operator J^T W J for the head
+        entries of the performance measures, where J holds the sensitivities of
+        the simulated heads at the entries to the parameters and W is the diagonal
+        matrix of the entry weights.  Each product costs one tangent-linear and one
+        adjoint sweep that share the per time step AMAT factorizations, regardless
+        of the number of entries, for truncated-Newton or CG-based inversions.  See
+        `GaussNewtonOperator`.  The parameters are ordered as the columns of
+        `solve_jacobian()`.  Call `close()` on the operator when done
+
+        Parameters
+        ----------
+        pm_names (list) : the performance measures to use.  Default is None (all)
+        composites (list) : the composite sensitivities to use as parameter
+            types.  See `solve_jacobian()`
+        zones (dict) : optional integer zone arrays, keyed by composite name.  See
+            `solve_jacobian()`
+
+        Returns
+        -------
+        op (GaussNewtonOperator) : a scipy LinearOperator, with the parameter
+            names in `op.par_names`
+
+        """
+        if self._hdf5_name is None or not os.path.exists(self._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        rows, _, _, _, composites, projs, col_names = self._jacobian_setup(
+            composites, zones
+        )
+        if pm_names is not None:
+            pm_names = [name.lower() for name in pm_names]
+            missing = set(pm_names) - {pm.name for _, pm, _ in rows}
+            if len(missing) > 0:
+                raise Exception(f"performance measures not found: {missing!s}")
+            rows = [row for row in rows if row[1].name in pm_names]
+        for row_name, _, entry in rows:
+            if entry.pm_type != "head":
+                raise Exception(
+                    f"entry '{row_name}' is a '{entry.pm_type}' flux entry, only "
+                    + "head entries can be used in the Gauss-Newton operator"
+                )
+        locations = [
+            (entry.kperkstp[0], entry.kperkstp[1], entry.inode) for _, _, entry in rows
+        ]
+        weights = [entry.weight for _, _, entry in rows]
+        return GaussNewtonOperator(
+            TangentLinear(self._hdf5_name),
+            locations,
+            weights,
+            composites,
+            projs=projs,
+            par_names=col_names,
+        )
+
+    def gradient_service(
+        self,
+        composites: list,
+        zones: dict | None = None,
+        pm_names: list | None = None,
+        max_entries: int = 8,
+    ):
+        """Form an objective function and gradient service for optimizers, with
+        `value()`, `grad()` and `value_and_grad()` methods of a flat parameter
+        vector.  Forward and adjoint results are cached by parameter vector.  See
+        `GradientService`
+
+        Parameters
+        ----------
+        composites (list) : the parameter types, e.g. ["k11", "ghb_0_cond"]
+        zones (dict) : optional integer zone arrays, keyed by composite name
+        pm_names (list) : the performance measures that make up the objective.
+            Default is None (all)
+        max_entries (int) : the number of parameter vectors to keep in the cache.
+            Default is 8
+
+        Returns
+        -------
+        svc (GradientService) : the service, with the initial parameter values in
+            `svc.x0` and the parameter names in `svc.par_names`
+
+        """
+        return GradientService(
+            self, composites, zones=zones, pm_names=pm_names, max_entries=max_entries
+        )
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0, path: str | None = None):
+        """Serve run, parameter-update and adjoint requests from this resident
+        instance until a 'shutdown' request.  See `AdjointServer`
+
+        Parameters
+        ----------
+        host (str) : the host to listen on.  Default is "127.0.0.1"
+        port (int) : the port to listen on.  Default is 0 (any free port, which
+            is logged)
+        path (str) : optional unix socket path to listen on instead of `host`
+            and `port`
+
+        """
+        AdjointServer(self, host=host, port=port, path=path).serve_forever()
+
+    def _jacobian_setup(self, composites, zones):
+        """private method to gather the rows, columns and parameter projections
+        for solve_jacobian() and sketch_jacobian()
+
+        Parameters
+        ----------
+        composites (list) : the composite sensitivities to use, or None for all
+        zones (dict) : optional integer zone arrays, keyed by composite name
+
+        Returns
+        -------
+        rows (list) : (row name, PerfMeas, PerfMeasRecord) tuples
+        heads (dict) : forward heads, keyed by (kper,kstp), for residual entries
+        kk_sol_map (dict) : solution group name, keyed by (kper,kstp)
+        nnodes (int) : number of model nodes
+        composites (list) : the composite sensitivities to use
+        projs (dict) : the zone projection matrix (or None) of each composite
+        col_names (list) : the parameter names
+
+        """
+        if zones is None:
+            zones = {}
+
+        hdf = ForwardStore(self._hdf5_name)
+        sol_keys, _, kk_sol_map = PerfMeas._get_solution_keys(hdf)
+        nnodes = hdf["gwf_info"]["nnodes"][0]
+        nodeuser = hdf["gwf_info"]["nodeuser"][:]
+        if len(nodeuser) == 1:
+            nodeuser = np.arange(nnodes, dtype=int)
+        comp_names = PerfMeas._composite_names(
+            dict(hdf["gwf_info"].attrs.items()), hdf[sol_keys[0]].attrs["has_sto"]
+        )
+        heads = {}
+        for pm in self._performance_measures:
+            residual = pm._entries.residual
+            for kk in pm._entries.kperkstps:
+                if kk in heads or kk not in kk_sol_map:
+                    continue
+                if residual[pm._entries.rows(kk)].any():
+                    heads[kk] = hdf[kk_sol_map[kk]]["head"][:]
+        hdf.close()
+
+        if composites is None:
+            composites = comp_names
+        for name in list(composites) + list(zones.keys()):
+            if name not in comp_names:
+                raise Exception(
+                    f"composite '{name}' not found, should be one of {comp_names!s}"
+                )
+        projs, col_names = {}, []
+        for name in composites:
+            if name in zones:
+                projs[name], labels = PerfMeas.zone_projection(zones[name], nodeuser)
+                col_names.extend([f"{name}_z{label}" for label in labels])
+            else:
+                projs[name] = None
+                col_names.extend([f"{name}_{node}" for node in nodeuser + 1])
+
+        rows = []
+        for pm in self._performance_measures:
+            for i, entry in enumerate(pm._entries):
+                row_name = pm.name
+                if len(pm._entries) > 1:
+                    row_name = f"{pm.name}_{i + 1}"
+                rows.append((row_name, pm, entry))
+        if len(rows) == 0:
+            raise Exception("no performance measure entries for the jacobian")
+        return rows, heads, kk_sol_map, nnodes, composites, projs, col_names
+
+    @staticmethod
+    def _project(comp, composites, projs):
+        """private method to project node composite sensitivities onto parameters
+
+        Parameters
+        ----------
+        comp (dict) : node sensitivities, keyed by composite name
+        composites (list) : the composite names, in parameter order
+        projs (dict) : the zone projection matrix (or None) of each composite
+
+        Returns
+        -------
+        row (ndarray) : the parameter sensitivities
+
+        """
+        return np.concatenate(
+            [
+                comp[name] if projs[name] is None else projs[name] @ comp[name]
+                for name in composites
+            ]
+        )
 
     def _initialize_gwf(self, lib_name: str, sim_ws: str):
         """initialize the MODFLOW6 API
@@ -1179,12 +2307,18 @@ class Mf6Adj(object):
         return gwf
 
     def finalize(self):
-        """close the api and file handles"""
-        try:
-            self._gwf.finalize()
-        except Exception as e:
-            print(f"{e}\n\nCould not execute finalize()")
-        self._gwf = None
+        """close the api and file handles.  Raises the error of an unfinished
+        forward solution HDF5 writer, if any"""
+        writer = getattr(self, "_writer", None)
+        self._writer = None
+        if self._gwf is not None:
+            try:
+                self._gwf.finalize()
+            except Exception as e:
+                print(f"{e}\n\nCould not execute finalize()")
+            self._gwf = None
+        if writer is not None:
+            writer.close()
 
     def _perturbation_test(self, pert_mult: float = 1.01):
         """run the perturbation testing - this is for dev and testing only"""
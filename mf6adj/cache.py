@@ -0,0 +1,251 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import h5py
+import pandas as pd
+
+from .pm import PerfMeas
+from .store import Hdf5Filter
+
+
+class AdjointCache(object):
+    """a size-limited, on-disk store of adjoint solution results.  Each entry holds
+    the adjoint solution HDF5 file and the summary CSV file of one performance
+    measure solve.  Entries are keyed by the performance measure fingerprint, the
+    forward solution fingerprint, the linear solver options and the options that
+    change the adjoint solution file ('write_nodes', the HDF5 filter and
+    'use_basis').  When the store grows past `max_size`, the least recently used
+    entries are evicted.
+
+    Parameters
+    ----------
+    cache_dir (str) : the directory to hold the cache entries.  Created if needed
+    max_size (int or str) : optional size limit of the cache, in bytes or as a
+        string such as "10GB".  Default is None (no limit)
+
+    """
+
+    INDEX_FNAME = "index.json"
+
+    def __init__(self, cache_dir: str, max_size=None):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.max_size = None
+        if max_size is not None:
+            self.max_size = PerfMeas.parse_memory(max_size)
+        self.logger = logging.getLogger(logging.__name__ + ".AdjointCache")
+        self._index = self._read_index()
+
+    @property
+    def size(self):
+        """get the total size of the cache entries
+
+        Returns
+        -------
+        size (int) : size in bytes
+
+        """
+        return int(sum(entry["size"] for entry in self._index.values()))
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def key(
+        pm_fingerprint,
+        fwd_fingerprint,
+        linear_solver=None,
+        linear_solver_kwargs={},
+        use_precon=True,
+        write_nodes=True,
+        hdf5_filter=None,
+        use_basis=False,
+    ):
+        """form a cache key
+
+        Parameters
+        ----------
+        pm_fingerprint (str) : the performance measure fingerprint.  See
+            `PerfMeas.fingerprint()`
+        fwd_fingerprint (str) : the forward solution fingerprint.  See
+            `PerfMeas.forward_fingerprint()`
+        linear_solver (varies) : the linear solver option passed to the solve
+        linear_solver_kwargs (dict) : the linear solver kwargs passed to the solve
+        use_precon (bool) : the preconditioner flag passed to the solve
+        write_nodes (bool) : the node-level results flag passed to the solve
+        hdf5_filter (str or Hdf5Filter) : the compression filter (and chunks) of
+            the adjoint solution HDF5 file.  Default is None (no filter)
+        use_basis (bool) : flag of a result assembled from the adjoint basis,
+            which has no per time step groups.  Default is False
+
+        Returns
+        -------
+        key (str) : hex digest
+
+        """
+        h = hashlib.sha256(pm_fingerprint.encode())
+        h.update(fwd_fingerprint.encode())
+        h.update(
+            PerfMeas._solver_signature(
+                linear_solver, linear_solver_kwargs, use_precon
+            ).encode()
+        )
+        # the default file options leave the keys of earlier caches unchanged
+        if not write_nodes:
+            h.update(b"write_nodes:False")
+        filters = str(Hdf5Filter.create(hdf5_filter))
+        if filters != "none":
+            h.update(f"hdf5_filter:{filters}".encode())
+        if use_basis:
+            h.update(b"use_basis:True")
+        return h.hexdigest()
+
+    def get(self, key, hdf5_adjoint_solution_fname, summary_fname):
+        """retrieve a cached result.  The cached files are copied to the
+        requested locations, unless those already hold the cached result
+
+        Parameters
+        ----------
+        key (str) : the cache key
+        hdf5_adjoint_solution_fname (str) : where the adjoint solution HDF5
+            file should be
+        summary_fname (str) : where the summary CSV file should be
+
+        Returns
+        -------
+        df (DataFrame) : the summary of composite sensitivity information, or
+            None if `key` is not in the cache
+
+        """
+        if key not in self._index:
+            return None
+        entry_dir = os.path.join(self.cache_dir, key)
+        cached_hdf = os.path.join(entry_dir, "adjoint_solution.hd5")
+        cached_csv = os.path.join(entry_dir, "adjoint_summary.csv")
+        if not os.path.exists(cached_hdf) or not os.path.exists(cached_csv):
+            self.logger.warning(f"WARNING: cache entry '{key}' is missing files")
+            self._remove(key)
+            self._write_index()
+            return None
+        if AdjointCache.adjoint_solution_key(hdf5_adjoint_solution_fname) != key:
+            shutil.copyfile(cached_hdf, hdf5_adjoint_solution_fname)
+        shutil.copyfile(cached_csv, summary_fname)
+        self._index[key]["last_used"] = time.time()
+        self._write_index()
+        return pd.read_csv(summary_fname, index_col=0)
+
+    def put(self, key, name, hdf5_adjoint_solution_fname, summary_fname):
+        """store a result in the cache, then evict the least recently used entries
+        if the cache is larger than `max_size`
+
+        Parameters
+        ----------
+        key (str) : the cache key
+        name (str) : the performance measure name
+        hdf5_adjoint_solution_fname (str) : the adjoint solution HDF5 file
+        summary_fname (str) : the summary CSV file
+
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.exists(entry_dir):
+            os.makedirs(entry_dir)
+        cached_hdf = os.path.join(entry_dir, "adjoint_solution.hd5")
+        cached_csv = os.path.join(entry_dir, "adjoint_summary.csv")
+        with h5py.File(hdf5_adjoint_solution_fname, "a") as f:
+            f.attrs["cache_key"] = key
+        shutil.copyfile(hdf5_adjoint_solution_fname, cached_hdf)
+        shutil.copyfile(summary_fname, cached_csv)
+        self._index[key] = {
+            "name": name,
+            "size": os.path.getsize(cached_hdf) + os.path.getsize(cached_csv),
+            "last_used": time.time(),
+        }
+        self.evict()
+
+    def evict(self):
+        """remove the least recently used entries until the cache fits in
+        `max_size`
+
+        Returns
+        -------
+        evicted (list) : the evicted keys
+
+        """
+        evicted = []
+        if self.max_size is not None:
+            keys = sorted(self._index, key=lambda k: self._index[k]["last_used"])
+            while self.size > self.max_size and len(keys) > 0:
+                key = keys.pop(0)
+                self.logger.info(
+                    f"evicting cache entry '{key}' for pm {self._index[key]['name']}"
+                )
+                self._remove(key)
+                evicted.append(key)
+        self._write_index()
+        return evicted
+
+    def clear(self):
+        """remove all cache entries"""
+        for key in list(self._index.keys()):
+            self._remove(key)
+        self._write_index()
+
+    @staticmethod
+    def adjoint_solution_key(hdf5_adjoint_solution_fname):
+        """get the cache key stored in an adjoint solution HDF5 file
+
+        Parameters
+        ----------
+        hdf5_adjoint_solution_fname (str) : the adjoint solution HDF5 file
+
+        Returns
+        -------
+        key (str) : the cache key, or None if the file doesn't exist or
+            has no key
+
+        """
+        if not os.path.exists(hdf5_adjoint_solution_fname):
+            return None
+        try:
+            with h5py.File(hdf5_adjoint_solution_fname, "r") as f:
+                key = f.attrs.get("cache_key", None)
+        except Exception:
+            return None
+        if key is None:
+            return None
+        return str(key)
+
+    def _remove(self, key):
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        self._index.pop(key, None)
+
+    def _read_index(self):
+        index_fname = os.path.join(self.cache_dir, AdjointCache.INDEX_FNAME)
+        if not os.path.exists(index_fname):
+            return {}
+        try:
+            with open(index_fname, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.warning(
+                f"WARNING: error reading cache index '{index_fname}', "
+                + f"starting an empty cache: {e!s}"
+            )
+            return {}
+
+    def _write_index(self):
+        index_fname = os.path.join(self.cache_dir, AdjointCache.INDEX_FNAME)
+        tmp_fname = index_fname + ".tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(tmp_fname, index_fname)
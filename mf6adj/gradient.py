@@ -0,0 +1,348 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .pm import PerfMeas
+from .store import ForwardStore
+
+
+class GradientService(object):
+    """Objective function and gradient evaluations for optimizers (e.g.
+    `scipy.optimize.minimize(svc.value_and_grad, svc.x0, jac=True)`).  A flat
+    parameter vector is mapped onto MODFLOW6 arrays through the API pointers, the
+    forward model is solved into its own HDF5 store, the objective (the sum of the
+    performance measure values) is computed from that store and the gradient
+    comes from the adjoint solves against it.  Forward stores, values and
+    gradients are cached by parameter vector, so asking for the gradient at a
+    point that was just evaluated (or re-evaluating a point during a line search)
+    does not rerun MODFLOW6.
+
+    Parameters
+    ----------
+    adj (Mf6Adj) : the adjoint instance.  `solve_gwf()` must have been called,
+        the forward store provides the initial parameter values
+    composites (list) : the parameter types.  Supported are "k11", "k33" and the
+        level and conductance composites of the ghb, riv and drn packages (e.g.
+        "ghb_0_cond").  Specific storage is not supported because MODFLOW6 does
+        not pick up changes to the storage arrays made through the API pointers
+    zones (dict) : optional integer zone arrays, keyed by composite name.  Each
+        zone is one parameter whose value is assigned to all the nodes of the
+        zone, nodes in zones less than or equal to zero keep their model values.
+        Composites without zones have one parameter per node
+    pm_names (list) : the performance measures that make up the objective.
+        Default is None (all)
+    max_entries (int) : the number of parameter vectors (and forward stores) to
+        keep in the cache.  Default is 8
+    hdf5_prefix (str) : the filename prefix of the forward stores.  Default is
+        "gradient_service"
+
+    """
+
+    def __init__(
+        self,
+        adj,
+        composites: list,
+        zones: dict | None = None,
+        pm_names: list | None = None,
+        max_entries: int = 8,
+        hdf5_prefix: str = "gradient_service",
+    ):
+        if adj._hdf5_name is None or not os.path.exists(adj._hdf5_name):
+            raise Exception("need to call solve_gwf() first")
+        if zones is None:
+            zones = {}
+        self.adj = adj
+        self.logger = logging.getLogger(logging.__name__ + ".GradientService")
+        self.max_entries = max(1, int(max_entries))
+        self.hdf5_prefix = hdf5_prefix
+        self._cache = OrderedDict()
+        self.nfwd = 0
+        self.nadj = 0
+
+        pms = adj._performance_measures
+        if pm_names is not None:
+            pm_names = [name.lower() for name in pm_names]
+            missing = set(pm_names) - {pm.name for pm in pms}
+            if len(missing) > 0:
+                raise Exception(f"performance measures not found: {missing!s}")
+            pms = [pm for pm in pms if pm.name in pm_names]
+        if len(pms) == 0:
+            raise Exception("no performance measures for the objective")
+        self.performance_measures = pms
+
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+        bnd_items = {}
+        for ptype, pnames in adj._gwf_package_dict.items():
+            if ptype not in ["ghb6", "riv6", "drn6"]:
+                continue
+            for pname in pnames:
+                for icol, item in bnd_dict[ptype].items():
+                    bnd_items[pname + "_" + item] = (pname, item, icol)
+        self._bnd_items = bnd_items
+
+        with ForwardStore(adj._hdf5_name) as hdf:
+            sol_keys, _, _ = PerfMeas._get_solution_keys(hdf)
+            nnodes = int(hdf["gwf_info"]["nnodes"][0])
+            nodeuser = hdf["gwf_info"]["nodeuser"][:]
+            if len(nodeuser) == 1:
+                nodeuser = np.arange(nnodes, dtype=int)
+            base = {}
+            for name in composites:
+                if name in ["k11", "k33"]:
+                    base[name] = hdf[sol_keys[0]][name][:]
+                elif name in bnd_items:
+                    # the value at each node from the first time step with an entry
+                    pname, _, icol = bnd_items[name]
+                    values = np.full(nnodes, np.nan)
+                    for sol_key in sol_keys[::-1]:
+                        if pname not in hdf[sol_key]:
+                            continue
+                        n = hdf[sol_key][pname]["nodelist"][:] - 1
+                        bound = hdf[sol_key][pname]["bound"][:]
+                        keep = (n >= 0) & (n < nnodes)
+                        values[n[keep]] = bound[keep, icol]
+                    base[name] = values
+                else:
+                    raise Exception(
+                        f"composite '{name}' not supported, should be one of "
+                        + f"{['k11', 'k33'] + list(bnd_items.keys())!s}"
+                    )
+        for name in zones.keys():
+            if name not in composites:
+                raise Exception(f"zones composite '{name}' not in composites")
+        self.nnodes = nnodes
+        self.composites = list(composites)
+
+        self._projs, self._masks, self.par_names, x0 = {}, {}, [], []
+        for name in self.composites:
+            if name in zones:
+                proj, labels = PerfMeas.zone_projection(zones[name], nodeuser)
+                self._projs[name] = proj
+                self._masks[name] = np.asarray(proj.sum(axis=0)).ravel() > 0
+                self.par_names.extend([f"{name}_z{label}" for label in labels])
+                for izone in range(proj.shape[0]):
+                    vals = base[name][proj[izone].indices]
+                    vals = vals[~np.isnan(vals)]
+                    x0.append(vals.mean() if vals.shape[0] > 0 else 0.0)
+            else:
+                self._projs[name] = None
+                self._masks[name] = np.ones(nnodes, dtype=bool)
+                self.par_names.extend([f"{name}_{node}" for node in nodeuser + 1])
+                x0.extend(list(np.nan_to_num(base[name])))
+        self._base = base
+        self.x0 = np.array(x0, dtype=float)
+
+    def close(self):
+        """remove the cached forward stores"""
+        for entry in self._cache.values():
+            self._remove(entry["hdf5_name"])
+        self._cache = OrderedDict()
+
+    def _remove(self, hdf5_name):
+        """private method to remove a cached forward store, except the one the
+        adjoint instance uses
+
+        Parameters
+        ----------
+        hdf5_name (str) : the forward store filename
+
+        """
+        own = self.adj._hdf5_name
+        if own is not None and os.path.abspath(own) == os.path.abspath(hdf5_name):
+            return
+        if os.path.exists(hdf5_name):
+            os.remove(hdf5_name)
+
+    @staticmethod
+    def key(x):
+        """the cache key of a parameter vector
+
+        Parameters
+        ----------
+        x (ndarray) : the parameter vector
+
+        Returns
+        -------
+        key (str) : hex digest
+
+        """
+        x = np.ascontiguousarray(x, dtype=float).ravel()
+        return hashlib.sha256(x.tobytes()).hexdigest()
+
+    def node_values(self, x):
+        """map a parameter vector onto node arrays
+
+        Parameters
+        ----------
+        x (ndarray) : the parameter vector
+
+        Returns
+        -------
+        values (dict) : node values, keyed by composite name.  Nodes that are
+            not parameters are NaN for the boundary composites
+
+        """
+        x = np.asarray(x, dtype=float).ravel()
+        if x.shape[0] != len(self.par_names):
+            raise Exception(
+                f"parameter vector has {x.shape[0]} values, should be "
+                + f"{len(self.par_names)}"
+            )
+        values, offset = {}, 0
+        for name in self.composites:
+            proj = self._projs[name]
+            size = self.nnodes if proj is None else proj.shape[0]
+            seg = x[offset : offset + size]
+            offset += size
+            vals = self._base[name].copy()
+            if proj is None:
+                vals[:] = seg
+            else:
+                mask = self._masks[name]
+                vals[mask] = (proj.T @ seg)[mask]
+            values[name] = vals
+        return values
+
+    def _forward(self, x):
+        """private method to solve the forward model for a parameter vector,
+        through the cache
+
+        Parameters
+        ----------
+        x (ndarray) : the parameter vector
+
+        Returns
+        -------
+        entry (dict) : the cache entry, with 'hdf5_name', 'value' and 'grad'
+
+        """
+        key = GradientService.key(x)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        adj = self.adj
+        values = self.node_values(x)
+        hdf5_name = f"{self.hdf5_prefix}_{key[:16]}.hd5"
+        gwf_name = adj._gwf_name.upper()
+        adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+        force_k_update = False
+        for name in ["k11", "k33"]:
+            if name in values:
+                ptr = adj._gwf.get_value_ptr(
+                    adj._gwf.get_var_address(name.upper(), gwf_name, "NPF")
+                )
+                ptr[:] = values[name]
+                force_k_update = True
+
+        bnd_values = {
+            name: vals for name, vals in values.items() if name in self._bnd_items
+        }
+
+        def set_bnd_values(gwf):
+            for name, vals in bnd_values.items():
+                pname, item, _ = self._bnd_items[name]
+                nbound = gwf.get_value(
+                    gwf.get_var_address("NBOUND", gwf_name, pname.upper())
+                )[0]
+                if nbound == 0:
+                    continue
+                nodelist = gwf.get_value_ptr(
+                    gwf.get_var_address("NODELIST", gwf_name, pname.upper())
+                )[:nbound]
+                bnd_ptr = gwf.get_value_ptr(
+                    gwf.get_var_address(item.upper(), gwf_name, pname.upper())
+                )
+                idx = np.flatnonzero(self._masks[name][nodelist - 1])
+                bnd_ptr[idx] = vals[nodelist[idx] - 1]
+
+        presolve_func_ptr = None
+        if len(bnd_values) > 0:
+            presolve_func_ptr = set_bnd_values
+        # solve_gwf() points the instance at the trial store, restore its own so
+        # solve_adjoint() and friends keep using the forward solution of the model
+        own_hdf5_name = adj._hdf5_name
+        try:
+            adj.solve_gwf(
+                verbose=False,
+                _force_k_update=force_k_update,
+                hdf5_name=hdf5_name,
+                presolve_func_ptr=presolve_func_ptr,
+            )
+        finally:
+            adj._hdf5_name = own_hdf5_name
+        self.nfwd += 1
+
+        with ForwardStore(hdf5_name) as hdf:
+            value = sum(pm.evaluate(hdf) for pm in self.performance_measures)
+        entry = {"hdf5_name": hdf5_name, "value": value, "grad": None}
+        self._cache[key] = entry
+        while len(self._cache) > self.max_entries:
+            _, old = self._cache.popitem(last=False)
+            self._remove(old["hdf5_name"])
+        return entry
+
+    def value(self, x):
+        """the objective function value, one forward solve unless `x` is cached
+
+        Parameters
+        ----------
+        x (ndarray) : the parameter vector
+
+        Returns
+        -------
+        value (float) : the sum of the performance measure values
+
+        """
+        return self._forward(x)["value"]
+
+    def grad(self, x):
+        """the objective function gradient, one adjoint solve per performance
+        measure (plus a forward solve unless `x` is cached)
+
+        Parameters
+        ----------
+        x (ndarray) : the parameter vector
+
+        Returns
+        -------
+        grad (ndarray) : the gradient with respect to the parameters
+
+        """
+        entry = self._forward(x)
+        if entry["grad"] is not None:
+            return entry["grad"].copy()
+        grad = np.zeros(len(self.par_names))
+        for pm in self.performance_measures:
+            df = pm.solve_adjoint(entry["hdf5_name"], write_results=False)
+            self.nadj += 1
+            grad += np.concatenate(
+                [
+                    df[name].values
+                    if self._projs[name] is None
+                    else self._projs[name] @ df[name].values
+                    for name in self.composites
+                ]
+            )
+        entry["grad"] = grad
+        return grad.copy()
+
+    def value_and_grad(self, x):
+        """the objective function value and gradient, for use with
+        `scipy.optimize.minimize(..., jac=True)`
+
+        Parameters
+        ----------
+        x (ndarray) : the parameter vector
+
+        Returns
+        -------
+        value (float) : the sum of the performance measure values
+        grad (ndarray) : the gradient with respect to the parameters
+
+        """
+        grad = self.grad(x)
+        return self.value(x), grad
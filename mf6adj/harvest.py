@@ -0,0 +1,207 @@
+import numpy as np
+
+
+class Harvester(object):
+    """Reads the solution components of each time step from the MODFLOW6 API for
+    `Mf6Adj.solve_gwf()`.  The variable addresses are resolved once, the values
+    are read through the API pointers (refreshed at the start of each stress
+    period, when MODFLOW6 reads new boundary data) and copied into buffers that
+    are reused from one time step to the next.  The harvested arrays are only
+    valid until the next `harvest()`: anything kept longer must be copied
+    (writing them to HDF5 copies them).
+
+    Parameters
+    ----------
+    gwf (MODFLOW6 API) : the initialized API instance
+    gwf_name (str) : name of the GWF model
+    gwf_package_dict (dict) : the package names, keyed by package type
+    gwf_package_types (list) : the boundary package types to harvest, in order
+    gwf_boundary_attr_dict (dict) : the attribute arrays to harvest, keyed by
+        package type
+    has_sto (bool) : flag for a storage package
+
+    """
+
+    # solution components, (variable name, component, subcomponent)
+    _solution_vars = {
+        "amat": ("AMAT", "SLN_1", ""),
+        "head": ("X", None, ""),
+        "head_old": ("XOLD", None, ""),
+        "k11": ("K11", None, "NPF"),
+        "k33": ("K33", None, "NPF"),
+        "condsat": ("CONDSAT", None, "NPF"),
+        "iss": ("ISS", None, ""),
+        "sat": ("SAT", None, "NPF"),
+    }
+    # boundary package components, in the order they are stored
+    _package_vars = ["nodelist", "bound", "hcof", "rhs", "simvals"]
+
+    def __init__(
+        self,
+        gwf,
+        gwf_name: str,
+        gwf_package_dict: dict,
+        gwf_package_types: list,
+        gwf_boundary_attr_dict: dict,
+        has_sto: bool = False,
+    ):
+        self._gwf = gwf
+        gwf_name = gwf_name.upper()
+        self.nnode = int(
+            gwf.get_value(gwf.get_var_address("NODES", gwf_name, "DIS"))[0]
+        )
+
+        self._addrs = {}
+        for name, (var, comp, subcomp) in Harvester._solution_vars.items():
+            comp = gwf_name if comp is None else comp
+            self._addrs[name] = gwf.get_var_address(var, comp, subcomp)
+        self._addrs["kper"] = gwf.get_var_address("KPER", "TDIS")
+        self._addrs["kstp"] = gwf.get_var_address("KSTP", "TDIS")
+        grid_vars = [("top", "DIS"), ("bot", "DIS"), ("area", "DIS")]
+        if has_sto:
+            grid_vars += [("iconvert", "STO"), ("ss", "STO")]
+        for name, pak in grid_vars:
+            self._addrs[name] = gwf.get_var_address(name.upper(), gwf_name, pak)
+        self._grid_names = [name for name, _ in grid_vars]
+
+        # (package type, package name, storage name, {component: address})
+        self._packages = []
+        for package_type in gwf_package_types:
+            if package_type not in gwf_package_dict:
+                continue
+            for tag in gwf_package_dict[package_type]:
+                names = ["nbound", *Harvester._package_vars]
+                names += list(gwf_boundary_attr_dict.get(package_type, []))
+                addrs = {
+                    name: gwf.get_var_address(name.upper(), gwf_name, tag.upper())
+                    for name in names
+                }
+                key = tag
+                if package_type == "sfr6":
+                    # the stage is read from (and stored as) the first sfr package
+                    key = gwf_package_dict[package_type][0]
+                    addrs["stage"] = gwf.get_var_address("STAGE", gwf_name, key.upper())
+                attrs = list(gwf_boundary_attr_dict.get(package_type, []))
+                self._packages.append((package_type, tag, key, addrs, attrs))
+
+        self._ptrs = {}
+        self._buffers = {}
+        self._kper = None
+        self._sat_old = None
+        self._has_sat = False
+        self.refresh()
+
+    def refresh(self):
+        """get the API pointers of all the harvested variables"""
+        gwf = self._gwf
+        self._ptrs = {
+            name: gwf.get_value_ptr(addr) for name, addr in self._addrs.items()
+        }
+        for _, tag, _, addrs, _ in self._packages:
+            for name, addr in addrs.items():
+                self._ptrs[(tag, name)] = gwf.get_value_ptr(addr)
+
+    def _copy(self, name, ptr):
+        """private method to copy a pointer into its reused buffer"""
+        buf = self._buffers.get(name, None)
+        if buf is None or buf.shape != ptr.shape or buf.dtype != ptr.dtype:
+            buf = np.empty_like(ptr)
+            self._buffers[name] = buf
+        np.copyto(buf, ptr)
+        return buf
+
+    def kper_kstp(self):
+        """get the current stress period and time step
+
+        Returns
+        -------
+        kper (int) : one-based stress period
+        kstp (int) : one-based time step
+
+        """
+        return int(self._ptrs["kper"][0]), int(self._ptrs["kstp"][0])
+
+    @property
+    def grid(self):
+        """get the grid arrays (and the storage arrays if there is a storage
+        package) used for the storage derivatives
+
+        Returns
+        -------
+        grid (dict) : API pointers to 'top', 'bot', 'area', 'iconvert' and 'ss'
+
+        """
+        return {name: self._ptrs[name] for name in self._grid_names}
+
+    def init_sat_old(self):
+        """store the saturation before the first solve, once"""
+        if self._sat_old is None:
+            self._sat_old = self._ptrs["sat"].copy()
+
+    def harvest(self):
+        """copy the solution components of the time step that was just solved
+
+        Returns
+        -------
+        data_dict (dict) : the 'amat', 'head', 'head_old', 'k11', 'k33',
+            'condsat', 'iss', 'sat' and 'sat_old' arrays (reused buffers)
+
+        """
+        kper = self.kper_kstp()[0]
+        if kper != self._kper:
+            self.refresh()
+            self._kper = kper
+        # last time step's saturation is this time step's old saturation
+        if self._has_sat:
+            self._sat_old, self._buffers["sat"] = self._buffers["sat"], self._sat_old
+        data_dict = {}
+        for name in Harvester._solution_vars.keys():
+            ptr = self._ptrs[name]
+            if name in ["head", "head_old"]:
+                ptr = ptr[: self.nnode]
+            data_dict[name] = self._copy(name, ptr)
+        self._has_sat = True
+        data_dict["sat_old"] = self._sat_old
+        return data_dict
+
+    def harvest_packages(self):
+        """copy the boundary package components of the time step that was just
+        solved
+
+        Returns
+        -------
+        packages (list) : (package type, package name, nbound, data dict) tuples
+            of the packages with boundaries.  The data dict holds the 'nodelist',
+            'bound', 'hcof', 'rhs' and 'simvals' arrays and the attribute arrays
+            of the package (reused buffers)
+
+        """
+        packages = []
+        for package_type, tag, key, addrs, attrs in self._packages:
+            nbound = self._ptrs[(tag, "nbound")][0]
+            if nbound <= 0:
+                continue
+            pdata = {"ptype": package_type}
+            for name in Harvester._package_vars:
+                pdata[name] = self._copy((tag, name), self._ptrs[(tag, name)])
+            bound = pdata["bound"]
+            if len(attrs) > 0 and bound.size == 0:
+                shape = (pdata["nodelist"].shape[0], len(attrs))
+                bound = self._buffers.get((tag, "bound_fill"), None)
+                if bound is None or bound.shape != shape:
+                    bound = np.zeros(shape)
+                    self._buffers[(tag, "bound_fill")] = bound
+                for i, attr in enumerate(attrs):
+                    bound[:, i] = self._ptrs[(tag, attr)]
+                pdata["bound"] = bound
+            if package_type == "sfr6":
+                bound[:, 0] = self._ptrs[(tag, "stage")]
+                bound[:, 1] = -1.0 * pdata["hcof"]
+            for attr in attrs:
+                if attr in pdata:
+                    raise Exception(
+                        f"boundary attribute '{attr}' already in data dict for {key}"
+                    )
+                pdata[attr] = self._copy((tag, attr), self._ptrs[(tag, attr)])
+            packages.append((package_type, key, int(nbound), pdata))
+        return packages
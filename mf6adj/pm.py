@@ -1,13 +1,23 @@
+import hashlib
 import logging
 import os
+import re
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Union
 
 import h5py
 import numpy as np
 import pandas as pd
 import scipy.sparse as sparse
-from scipy.sparse.linalg import LinearOperator, bicgstab, spilu, spsolve
+from scipy.sparse.linalg import LinearOperator, bicgstab, spilu, splu, spsolve
+
+from .store import ForwardStore, Hdf5Filter
+
+# number of array elements per chunk for on-disk composite accumulators and
+# streamed boundary package data when running under a memory budget
+_SPILL_CHUNK = 2**18
+# scipy's default spilu fill factor
+_ILU_FILL_FACTOR = 10
 
 
 class PerfMeasRecord(object):
@@ -71,6 +81,25 @@ class PerfMeasRecord(object):
                 + f"not '{self.pm_form}'"
             )
 
+    def dfdh(self, head=None):
+        """the partial of a head record with respect to the head at its node
+
+        Parameters
+        ----------
+        head (ndarray) : the forward head array at the record's (kper,kstp).
+            Only needed for residual records
+
+        Returns
+        -------
+        dfdh (float) : the partial
+
+        """
+        if self.pm_type != "head":
+            raise Exception(f"dfdh() is only for head records, not '{self.pm_type}'")
+        if self.pm_form == "residual":
+            return 2.0 * self.weight * (head[self.inode] - self.obsval)
+        return self.weight
+
     def __repr__(self):
         s = (
             f"kperkstp:{self.kperkstp}, inode:{self.inode}, "
@@ -83,13 +112,370 @@ class PerfMeasRecord(object):
         return s
 
 
+class _PerfMeasEntryView(PerfMeasRecord):
+    """`PerfMeasRecord` of one row of a `PerfMeasEntries`, whose 'weight' and
+    'obsval' read from and write to the entry arrays
+
+    Parameters
+    ----------
+    entries (PerfMeasEntries) : the columnar entries
+    n (int) : the entry position
+
+    """
+
+    def __init__(self, entries, n):
+        self._entries = entries
+        self._n = n
+        super().__init__(
+            entries.kper[n],
+            entries.kstp[n],
+            entries.inode[n],
+            entries.pm_types[entries.type_code[n]],
+            PerfMeasEntries.pm_forms[entries.form_code[n]],
+            entries.weight[n],
+            entries.obsval[n],
+            *[
+                None if vals is None or vals[n] < 0 else vals[n]
+                for vals in [entries.k, entries.i, entries.j]
+            ],
+        )
+
+    @property
+    def weight(self):
+        return float(self._entries.weight[self._n])
+
+    @weight.setter
+    def weight(self, value):
+        self._entries.weight[self._n] = float(value)
+
+    @property
+    def obsval(self):
+        return float(self._entries.obsval[self._n])
+
+    @obsval.setter
+    def obsval(self, value):
+        self._entries.obsval[self._n] = float(value)
+
+
+class PerfMeasEntries(object):
+    """Columnar storage of the entries of a performance measure: one array per
+    attribute, with the 'pm_type' and 'pm_form' strings stored as integer codes,
+    and the entry positions indexed by (kper,kstp).  Indexing and iteration give
+    `PerfMeasRecord` views of the entries, for compatibility with code written
+    against a list of records: setting their 'weight' or 'obsval' changes the
+    entry arrays, the other attributes are read-only copies
+
+    Parameters
+    ----------
+    kper (ndarray) : zero-based stress periods
+    kstp (ndarray) : zero-based time steps
+    inode (ndarray) : zero-based (reduced) node numbers
+    pm_type (ndarray) : either 'head' or boundary package names
+    pm_form (ndarray) : either 'direct' or 'residual'
+    weight (ndarray) : weight values
+    obsval (ndarray) : observed values
+    k (ndarray) : optional zero-based layers (only for reporting, -1 for
+        missing values)
+    i (ndarray) : optional zero-based rows (only for reporting, -1 for missing
+        values)
+    j (ndarray) : optional zero-based columns (only for reporting, -1 for
+        missing values)
+
+    """
+
+    pm_forms = ["direct", "residual"]
+
+    def __init__(
+        self,
+        kper,
+        kstp,
+        inode,
+        pm_type,
+        pm_form,
+        weight,
+        obsval,
+        k=None,
+        i=None,
+        j=None,
+    ):
+        self.inode = np.asarray(inode, dtype=np.int64).ravel()
+        nentries = self.inode.shape[0]
+
+        def column(vals, dtype, name):
+            if vals is None:
+                return None
+            vals = np.asarray(vals, dtype=dtype).ravel()
+            if vals.shape[0] != nentries:
+                raise Exception(
+                    f"'{name}' has {vals.shape[0]} entries, should have {nentries}"
+                )
+            return vals
+
+        self.kper = column(kper, np.int32, "kper")
+        self.kstp = column(kstp, np.int32, "kstp")
+        self.weight = column(weight, float, "weight")
+        self.obsval = column(obsval, float, "obsval")
+        self.k = column(k, np.int32, "k")
+        self.i = column(i, np.int32, "i")
+        self.j = column(j, np.int32, "j")
+
+        # factorize first, the strings are normalized once per unique value
+        codes, uniques = pd.factorize(column(pm_type, str, "pm_type"), sort=True)
+        uniques = [str(ptype).lower().strip() for ptype in uniques]
+        self.pm_types = sorted(set(uniques))
+        remap = np.array([self.pm_types.index(ptype) for ptype in uniques], dtype=int)
+        self.type_code = remap[codes].astype(np.int16)
+
+        codes, uniques = pd.factorize(column(pm_form, str, "pm_form"))
+        form_code = np.full(nentries, -1, dtype=np.int8)
+        for code, form in enumerate(uniques):
+            form = str(form).lower().strip()
+            if form not in PerfMeasEntries.pm_forms:
+                raise Exception(
+                    "PerfMeasRecord.pm_form must be 'direct' or 'residual', "
+                    + f"not '{form}'"
+                )
+            form_code[codes == code] = PerfMeasEntries.pm_forms.index(form)
+        self.form_code = form_code
+        self._kk_index = None
+        self._groups = None
+
+    @classmethod
+    def from_records(cls, records):
+        """create the columnar storage from `PerfMeasRecord` instances
+
+        Parameters
+        ----------
+        records (list(PerfMeasRecord)) : the entries
+
+        Returns
+        -------
+        entries (PerfMeasEntries) : the columnar entries
+
+        """
+        records = list(records)
+
+        def column(attr):
+            vals = [getattr(rec, attr) for rec in records]
+            if all(val is None for val in vals):
+                return None
+            return [-1 if val is None else val for val in vals]
+
+        return cls(
+            [rec.kperkstp[0] for rec in records],
+            [rec.kperkstp[1] for rec in records],
+            [rec.inode for rec in records],
+            [rec.pm_type for rec in records],
+            [rec.pm_form for rec in records],
+            [rec.weight for rec in records],
+            [rec.obsval for rec in records],
+            column("_k"),
+            column("_i"),
+            column("_j"),
+        )
+
+    def __len__(self):
+        return self.inode.shape[0]
+
+    def __getitem__(self, n):
+        n = range(len(self))[n]
+        return _PerfMeasEntryView(self, n)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    @property
+    def pm_type(self):
+        """the 'pm_type' of each entry
+
+        Returns
+        -------
+        pm_type (ndarray) : 'head' or boundary package names
+
+        """
+        return np.array(self.pm_types, dtype=str)[self.type_code]
+
+    @property
+    def pm_form(self):
+        """the 'pm_form' of each entry
+
+        Returns
+        -------
+        pm_form (ndarray) : 'direct' or 'residual'
+
+        """
+        return np.array(PerfMeasEntries.pm_forms, dtype=str)[self.form_code]
+
+    @property
+    def residual(self):
+        """flags for the residual entries
+
+        Returns
+        -------
+        residual (ndarray) : True for 'residual' entries
+
+        """
+        return self.form_code == PerfMeasEntries.pm_forms.index("residual")
+
+    @property
+    def is_head(self):
+        """flags for the head entries
+
+        Returns
+        -------
+        is_head (ndarray) : True for 'head' entries, False for flux entries
+
+        """
+        if "head" not in self.pm_types:
+            return np.zeros(len(self), dtype=bool)
+        return self.type_code == self.pm_types.index("head")
+
+    @property
+    def has_flux(self):
+        """flag for entries of boundary package flux
+
+        Returns
+        -------
+        has_flux (bool) : True if any entry is not a 'head' entry
+
+        """
+        return any(ptype != "head" for ptype in self.pm_types)
+
+    @property
+    def nbytes(self):
+        """the memory used by the entry arrays
+
+        Returns
+        -------
+        nbytes (int) : number of bytes
+
+        """
+        arrays = [
+            self.kper,
+            self.kstp,
+            self.inode,
+            self.type_code,
+            self.form_code,
+            self.weight,
+            self.obsval,
+            self.k,
+            self.i,
+            self.j,
+        ]
+        return int(sum(arr.nbytes for arr in arrays if arr is not None))
+
+    def _index(self):
+        """private method to build (and cache) the entry positions of each
+        (kper,kstp)"""
+        if self._kk_index is None:
+            self._kk_index = {}
+            if len(self) > 0:
+                nkstp = int(self.kstp.max()) + 1
+                codes = self.kper.astype(np.int64) * nkstp + self.kstp
+                order = np.argsort(codes, kind="stable")
+                ucodes, starts = np.unique(codes[order], return_index=True)
+                bounds = np.append(starts, order.shape[0])
+                for icode, code in enumerate(ucodes):
+                    kk = (int(code // nkstp), int(code % nkstp))
+                    self._kk_index[kk] = order[bounds[icode] : bounds[icode + 1]]
+        return self._kk_index
+
+    @property
+    def kperkstps(self):
+        """the (kper,kstp) of the entries
+
+        Returns
+        -------
+        kperkstps (list) : sorted, unique zero-based (kper,kstp) tuples
+
+        """
+        return list(self._index().keys())
+
+    def rows(self, kk):
+        """the positions of the entries of a (kper,kstp)
+
+        Parameters
+        ----------
+        kk (tuple) : zero-based stress period and time step
+
+        Returns
+        -------
+        rows (ndarray) : the entry positions, in entry order
+
+        """
+        kk = (int(kk[0]), int(kk[1]))
+        return self._index().get(kk, np.zeros(0, dtype=int))
+
+    def groups(self):
+        """the positions of the entries grouped by (kper,kstp) and 'pm_type'
+
+        Returns
+        -------
+        groups (dict) : entry position arrays keyed by ((kper,kstp), pm_type)
+
+        """
+        if self._groups is None:
+            self._groups = {}
+            for kk, rows in self._index().items():
+                codes = self.type_code[rows]
+                for code in np.unique(codes):
+                    self._groups[(kk, self.pm_types[code])] = rows[codes == code]
+        return self._groups
+
+
+class _StreamingGroup(object):
+    """dict-like stand-in for the per-timestep `data` dict that writes each
+    item straight to an HDF5 group instead of holding it in memory
+
+    Parameters
+    ----------
+    grp (h5py.Group) : the open HDF5 group to write to
+    grid_shape (tuple) : optional structured grid shape
+    nodeuser (ndarray) : optional `nodeuser` array from MODFLOW6
+    nodereduced (ndarray) : optional `nodereduced` array from MODFLOW6
+    filters (Hdf5Filter) : optional compression filter and chunks
+
+    """
+
+    def __init__(
+        self, grp, grid_shape=None, nodeuser=None, nodereduced=None, filters=None
+    ):
+        self._grp = grp
+        self._grid_shape = grid_shape
+        self._nodeuser = nodeuser
+        self._nodereduced = nodereduced
+        self._filters = filters
+
+    def __setitem__(self, tag, item):
+        PerfMeas._write_dataset(
+            self._grp,
+            tag,
+            item,
+            grid_shape=self._grid_shape,
+            nodeuser=self._nodeuser,
+            nodereduced=self._nodereduced,
+            filters=self._filters,
+        )
+
+    def close(self):
+        """write the node info datasets to the group"""
+        PerfMeas._write_node_info(
+            self._grp,
+            grid_shape=self._grid_shape,
+            nodeuser=self._nodeuser,
+            filters=self._filters,
+        )
+
+
 class PerfMeas(object):
     """Performance measures for adjoint solves
 
     Parameters
     ----------
     pm_name (str) : name of the performance measure
-    pm_entries (list(PerfMeasRec)) : container of performance measure entries
+    pm_entries (list(PerfMeasRecord) or PerfMeasEntries) : container of
+        performance measure entries, stored as `PerfMeasEntries`
     verbose_level (int) : how much stdout
 
 
@@ -108,9 +494,14 @@ class PerfMeas(object):
     """
 
     def __init__(
-        self, pm_name: str, pm_entries: List[PerfMeasRecord], verbose_level: int = 1
+        self,
+        pm_name: str,
+        pm_entries: Union[List[PerfMeasRecord], PerfMeasEntries],
+        verbose_level: int = 1,
     ):
         self._name = pm_name.lower().strip()
+        if not isinstance(pm_entries, PerfMeasEntries):
+            pm_entries = PerfMeasEntries.from_records(pm_entries)
         self._entries = pm_entries
         self.verbose_level = int(verbose_level)
         self.logger = logging.getLogger(logging.__name__ + self._name)
@@ -118,6 +509,49 @@ class PerfMeas(object):
             filename=self._name + ".log", format="%(asctime)s %(message)s"
         )
 
+    @classmethod
+    def from_arrays(
+        cls,
+        pm_name: str,
+        kper,
+        kstp,
+        inode,
+        pm_type,
+        pm_form,
+        weight,
+        obsval,
+        k=None,
+        i=None,
+        j=None,
+        verbose_level: int = 1,
+    ):
+        """create a performance measure from entry arrays (one value per entry)
+
+        Parameters
+        ----------
+        pm_name (str) : name of the performance measure
+        kper (ndarray) : zero-based stress periods
+        kstp (ndarray) : zero-based time steps
+        inode (ndarray) : zero-based (reduced) node numbers
+        pm_type (ndarray) : either 'head' or boundary package names
+        pm_form (ndarray) : either 'direct' or 'residual'
+        weight (ndarray) : weight values
+        obsval (ndarray) : observed values
+        k (ndarray) : optional zero-based layers (only for reporting)
+        i (ndarray) : optional zero-based rows (only for reporting)
+        j (ndarray) : optional zero-based columns (only for reporting)
+        verbose_level (int) : how much stdout
+
+        Returns
+        -------
+        pm (PerfMeas) : the performance measure
+
+        """
+        entries = PerfMeasEntries(
+            kper, kstp, inode, pm_type, pm_form, weight, obsval, k=k, i=i, j=j
+        )
+        return cls(pm_name, entries, verbose_level)
+
     @property
     def name(self):
         """get self._name
@@ -149,39 +583,131 @@ class PerfMeas(object):
         return d
 
     def solve_forward(self, head_dict, sp_package_dict):
-        """calculate forward solution for the performance measure.
-        Thjs is only for the perturbation testing process
+        """calculate forward solution for the performance measure: the sum of
+        weight * simulated for direct entries and weight * (simulated -
+        obsval)^2 for residual entries, the same objective as `evaluate()` and
+        the adjoint.  Thjs is only for the perturbation testing process
 
 
         """
+        entries = self._entries
+        residual = entries.residual
         result = 0.0
-        for pfr in self._entries:
-            if pfr.pm_type == "head":
-                if pfr.pm_form == "direct":
-                    result += pfr.weight * head_dict[pfr.kperkstp][pfr.inode]
-                elif pfr.pm_form == "residual":
-                    result += (
-                        pfr.weight * (head_dict[pfr.kperkstp][pfr.inode] - pfr.obsval)
-                    ) ** 2
-                else:
-                    raise Exception("something is wrong")
-            else:
-                for gwf_ptype, bnd_d in sp_package_dict.items():
-                    for kk, kk_list in bnd_d.items():
-                        if kk == pfr.kperkstp:
-                            for kk_d in kk_list:
-                                if (
-                                    kk_d["node"] == pfr.inode + 1
-                                    and kk_d["packagename"] == pfr.pm_type
-                                ):
-                                    if pfr.pm_form == "direct":
-                                        result += pfr.weight * kk_d["simval"]
-                                    elif pfr.pm_form == "residual":
-                                        result += (
-                                            pfr.weight * (kk_d["simval"] - pfr.obsval)
-                                        ) ** 2
+        for (kk, pm_type), rows in entries.groups().items():
+            if pm_type == "head":
+                sim = head_dict[kk][entries.inode[rows]]
+                contrib = np.where(
+                    residual[rows],
+                    entries.weight[rows] * (sim - entries.obsval[rows]) ** 2,
+                    entries.weight[rows] * sim,
+                )
+                result += contrib.sum()
+                continue
+            # every stored flow of the package at the entry node contributes
+            nodes, simvals = [], []
+            for bnd_d in sp_package_dict.values():
+                for kk_d in bnd_d.get(kk, []):
+                    if kk_d["packagename"] == pm_type:
+                        nodes.append(kk_d["node"] - 1)
+                        simvals.append(kk_d["simval"])
+            if len(nodes) == 0:
+                continue
+            nodes, simvals = np.array(nodes, dtype=int), np.array(simvals)
+            order = np.argsort(nodes, kind="stable")
+            nodes, simvals = nodes[order], simvals[order]
+            inode = entries.inode[rows]
+            lo = np.searchsorted(nodes, inode, side="left")
+            counts = np.searchsorted(nodes, inode, side="right") - lo
+            rows = np.repeat(rows, counts)
+            pos = np.arange(rows.shape[0]) - np.repeat(
+                np.cumsum(counts) - counts, counts
+            )
+            sim = simvals[np.repeat(lo, counts) + pos]
+            contrib = np.where(
+                residual[rows],
+                entries.weight[rows] * (sim - entries.obsval[rows]) ** 2,
+                entries.weight[rows] * sim,
+            )
+            result += contrib.sum()
         return result
 
+    def evaluate(self, hdf5_forward_solution_fname, return_entries: bool = False):
+        """calculate the value of the performance measure from the forward
+        solution HDF5 file, consistent with the adjoint: the sum of
+        weight * simulated for direct entries and weight * (simulated -
+        obsval)^2 for residual entries.  Each stored 'head' or boundary
+        'simvals' array is read once per time step.  The simulated value of a
+        flux entry is the sum of the package flows at its node
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str, h5py.File or ForwardStore) : the
+            forward solution HDF5 file (or open file handle) written by
+            `Mf6Adj.solve_gwf()`
+        return_entries (bool) : flag to also return the simulated value of each
+            entry.  Default is False
+
+        Returns
+        -------
+        value (float) : the performance measure value
+        entries (DataFrame) : the entries and their 'simulated' and 'value'
+            contributions, only if `return_entries` is True.  Entries whose
+            (kper,kstp) is not in the file are NaN
+
+        """
+        if not isinstance(hdf5_forward_solution_fname, ForwardStore):
+            with ForwardStore(hdf5_forward_solution_fname) as hdf:
+                return self.evaluate(hdf, return_entries=return_entries)
+        hdf = hdf5_forward_solution_fname
+        _, _, kk_sol_map = PerfMeas._get_solution_keys(hdf)
+        entries = self._entries
+        inode = entries.inode
+        sim = np.full(inode.shape[0], np.nan)
+        heads = {}
+        for (kk, pm_type), idx in entries.groups().items():
+            if kk not in kk_sol_map:
+                continue
+            grp = hdf[kk_sol_map[kk]]
+            if pm_type == "head":
+                if kk not in heads:
+                    heads[kk] = grp["head"][:]
+                sim[idx] = heads[kk][inode[idx]]
+            elif pm_type in grp:
+                # the flows summed by node, for the nodes of these entries
+                nodelist = grp[pm_type]["nodelist"][:] - 1
+                simvals = grp[pm_type]["simvals"][:]
+                keep = nodelist >= 0
+                order = np.argsort(nodelist[keep], kind="stable")
+                nodes = nodelist[keep][order]
+                csum = np.concatenate([[0.0], np.cumsum(simvals[keep][order])])
+                lo = np.searchsorted(nodes, inode[idx], side="left")
+                hi = np.searchsorted(nodes, inode[idx], side="right")
+                sim[idx] = csum[hi] - csum[lo]
+            else:
+                sim[idx] = 0.0
+        contrib = np.where(
+            entries.residual,
+            entries.weight * (sim - entries.obsval) ** 2,
+            entries.weight * sim,
+        )
+        value = float(np.nansum(contrib))
+        if not return_entries:
+            return value
+        df = pd.DataFrame(
+            {
+                "kper": entries.kper,
+                "kstp": entries.kstp,
+                "inode": inode,
+                "pm_type": entries.pm_type,
+                "pm_form": entries.pm_form,
+                "weight": entries.weight,
+                "obsval": entries.obsval,
+                "simulated": sim,
+                "value": contrib,
+            }
+        )
+        return value, df
+
     def solve_adjoint(
         self,
         hdf5_forward_solution_fname: str,
@@ -189,6 +715,14 @@ class PerfMeas(object):
         linear_solver=None,
         linear_solver_kwargs: dict = {},
         use_precon: bool = True,
+        max_memory=None,
+        checkpoint_interval: Optional[int] = None,
+        resume: bool = False,
+        write_results: bool = True,
+        projection: Optional[dict] = None,
+        write_nodes: bool = True,
+        hdf5_filter=None,
+        hdf5_chunks: Optional[dict] = None,
     ):
         """Solve for the adjoint state for the performance measure.
 
@@ -210,15 +744,56 @@ class PerfMeas(object):
             `linear_solver`.  Default is {}
         use_precon (bool): flag to use an ILU preconditioner with iterative
             linear solver.
+        max_memory (int or str): optional memory budget for the adjoint solve,
+            either in bytes or as a string such as "8GB".  If the estimated
+            memory use exceeds the budget, the composite accumulators are spilled
+            to chunked on-disk arrays, per-timestep results and boundary package
+            data are streamed and, if `linear_solver` is None, a leaner linear
+            solver is chosen.  If nothing fits, an exception is raised before the
+            solve starts.  Default is None (no budget)
+        checkpoint_interval (int): optional number of timesteps between
+            checkpoints of the adjoint state, the composite accumulators and the
+            last completed solution key, which are written to the adjoint HDF5
+            file.  Default is None (no checkpoints)
+        resume (bool): flag to continue an interrupted solve from the newest valid
+            checkpoint in an existing adjoint HDF5 file.  A checkpoint is only
+            valid if the forward solution file and the performance measure are
+            the same ones it was written for.  If there is no valid checkpoint,
+            the solve starts over.  Default is False
+        write_results (bool): flag to write the adjoint solution HDF5 file and the
+            summary CSV file.  If False, only the summary dataframe is returned.
+            Can't be combined with `checkpoint_interval` or `resume`.  Default
+            is True
+        projection (dict) : optional node-to-parameter projections, keyed by
+            composite name (e.g. "k11").  Each value is either an integer zone
+            array (see `PerfMeas.zone_projection()`) or a sparse matrix of shape
+            (number of parameters, number of nodes), such as pilot point
+            interpolation factors.  The sensitivities of these composites are
+            contracted to parameter space as the sweep runs, so only the
+            parameter values are accumulated and written, to the 'projected'
+            subgroup of each solution group and to the 'projected' group.
+            Default is None
+        write_nodes (bool) : flag to write the node-level per time step and
+            composite results to the adjoint solution HDF5 file.  Default is True
+        hdf5_filter (str or Hdf5Filter) : the compression filter of the adjoint
+            solution HDF5 datasets, "none", "gzip", "lzf" or "shuffle+gzip", or
+            an `Hdf5Filter`.  Default is None (no filter)
+        hdf5_chunks (dict) : optional chunks of the adjoint solution HDF5
+            datasets, keyed by dataset class ("node" or "package").  See
+            `Hdf5Filter`.  Default is None
 
         Returns
         -------
-        dfs (DataFrame) : summary of composite sensitivity information
+        dfs (DataFrame) : summary of composite sensitivity information, for the
+            composites that are not projected
+        pdf (DataFrame) : summary of the projected sensitivity information, with
+            the composite name and parameter sensitivity of each parameter.  Only
+            returned if `projection` is not None
 
         """
         adj_start = datetime.now()
         try:
-            hdf = h5py.File(hdf5_forward_solution_fname, "r")
+            hdf = ForwardStore(hdf5_forward_solution_fname)
         except Exception as e:
             raise Exception(
                 (
@@ -227,52 +802,34 @@ class PerfMeas(object):
                 )
             )
         if hdf5_adjoint_solution_fname is None:
-            pth = os.path.split(hdf5_forward_solution_fname)[0]
-            hdf5_adjoint_solution_fname = os.path.join(
-                pth,
-                f"adjoint_solution_{self._name}_" + hdf5_forward_solution_fname,
+            hdf5_adjoint_solution_fname = self.adjoint_solution_fname(
+                hdf5_forward_solution_fname
             )
 
-        if os.path.exists(hdf5_adjoint_solution_fname):
-            self.logger.warning(
-                (
-                    "WARNING: removing existing adjoint solution "
-                    + f"file '{hdf5_adjoint_solution_fname}'"
+        if not write_results:
+            if checkpoint_interval is not None or resume:
+                raise Exception(
+                    "'checkpoint_interval' and 'resume' need 'write_results=True'"
                 )
-            )
-            os.remove(hdf5_adjoint_solution_fname)
+            adf = None
+        elif resume and os.path.exists(hdf5_adjoint_solution_fname):
+            adf = h5py.File(hdf5_adjoint_solution_fname, "a")
+        else:
+            if os.path.exists(hdf5_adjoint_solution_fname):
+                self.logger.warning(
+                    (
+                        "WARNING: removing existing adjoint solution "
+                        + f"file '{hdf5_adjoint_solution_fname}'"
+                    )
+                )
+                os.remove(hdf5_adjoint_solution_fname)
 
-        adf = h5py.File(hdf5_adjoint_solution_fname, "w")
+            adf = h5py.File(hdf5_adjoint_solution_fname, "w")
+        filters = Hdf5Filter.create(hdf5_filter, hdf5_chunks)
 
-        keys = list(hdf.keys())
         gwf_package_dict = dict(hdf["gwf_info"].attrs.items())
 
-        sol_keys = [k for k in keys if k.startswith("solution")]
-        sol_keys.sort()
-        if len(sol_keys) == 0:
-            raise Exception("no 'solution' keys found")
-        kperkstp = [
-            (kper, kstp) for kper, kstp in zip(hdf["aux"]["kper"], hdf["aux"]["kstp"])
-        ]
-        if len(kperkstp) != len(sol_keys):
-            raise Exception(
-                (
-                    f"number of solution datasets ({len(sol_keys)}) != number "
-                    + f"of kper,kstp entries ({len(kperkstp)})"
-                )
-            )
-        kk_sol_map = {}
-        for kk in kperkstp:
-            sol = None
-            for s in sol_keys:
-                skper, skstp = hdf[s].attrs["kper"], hdf[s].attrs["kstp"]
-                # print(skper, skstp)
-                if skper == kk[0] and skstp == kk[1]:
-                    sol = s
-                    break
-            if sol is None:
-                raise Exception(f"no solution dataset found for kper,kstp:{kk!s}")
-            kk_sol_map[kk] = sol
+        sol_keys, kperkstp, kk_sol_map = PerfMeas._get_solution_keys(hdf)
 
         nnodes = hdf["gwf_info"]["nnodes"][:]
         nodeuser = hdf["gwf_info"]["nodeuser"][:]
@@ -303,33 +860,80 @@ class PerfMeas(object):
         bot = hdf["gwf_info"]["bot"][:]
         icelltype = hdf["gwf_info"]["icelltype"][:]
 
-        comp_k33_sens = np.zeros(nnodes)
-        comp_k_sens = np.zeros(nnodes)
-        comp_ss_sens = None
-
         has_sto = hdf[sol_keys[0]].attrs["has_sto"]
-        if has_sto:
-            comp_ss_sens = np.zeros(nnodes)
 
-        has_flux_pm = False
-        for entry in self._entries:
-            if entry.pm_type != "head":
-                has_flux_pm = True
-                break
-
-        comp_welq_sens = np.zeros(nnodes)
-        comp_rch_sens = np.zeros((nnodes))
+        has_flux_pm = self._entries.has_flux
 
         bnd_dict = PerfMeas.get_mf6_bound_dict()
-        comp_bnd_results = {}
-        for ptype, pnames in gwf_package_dict.items():
-            if ptype in bnd_dict:
+        comp_names = PerfMeas._composite_names(gwf_package_dict, has_sto)
+
+        spill = False
+        scratch_fname = None
+        if max_memory is not None:
+            max_nbound = 0
+            for ptype, pnames in gwf_package_dict.items():
                 for pname in pnames:
-                    for idx, aname in bnd_dict[ptype].items():
-                        comp_bnd_results[pname + "_" + aname] = np.zeros(nnodes)
+                    if pname in hdf[sol_keys[0]]:
+                        max_nbound = max(
+                            max_nbound, hdf[sol_keys[0]][pname]["nodelist"].shape[0]
+                        )
+            linear_solver, use_precon, spill, estimate = PerfMeas._plan_memory(
+                PerfMeas.parse_memory(max_memory),
+                int(nnodes[0]),
+                int(ja.shape[0]),
+                len(comp_names),
+                max_nbound,
+                linear_solver,
+                use_precon,
+            )
+            self.logger.info(
+                f"memory plan for PerfMeas {self._name}: linear_solver:"
+                + f"{linear_solver}, use_precon:{use_precon}, spill:{spill}, "
+                + f"estimate:{estimate}"
+            )
+
+        projs = PerfMeas._projection_setup(projection, nodeuser, comp_names)
+
+        if spill:
+            scratch_fname = hdf5_adjoint_solution_fname + ".scratch"
+            if os.path.exists(scratch_fname):
+                os.remove(scratch_fname)
+            scratch = h5py.File(scratch_fname, "w")
+            chunk_size = int(min(nnodes[0], _SPILL_CHUNK))
+            composites = {
+                name: scratch.create_dataset(
+                    name, (nnodes[0],), dtype=float, chunks=(chunk_size,), fillvalue=0.0
+                )
+                for name in comp_names
+                if name not in projs
+            }
+        else:
+            composites = {
+                name: np.zeros(nnodes) for name in comp_names if name not in projs
+            }
+        for name, (proj, _) in projs.items():
+            composites[name] = np.zeros(proj.shape[0])
+        composites = {name: composites[name] for name in comp_names}
+
+        fwd_fingerprint, pm_fingerprint = None, None
+        if checkpoint_interval is not None or resume:
+            fwd_fingerprint = PerfMeas.forward_fingerprint(hdf)
+            pm_fingerprint = self.fingerprint()
+        start_itime = 0
+        if resume:
+            start_itime = self._restore_checkpoint(
+                adf,
+                lamb,
+                composites,
+                [kk_sol_map[kk] for kk in kperkstp[::-1]],
+                fwd_fingerprint,
+                pm_fingerprint,
+            )
 
         for itime, kk in enumerate(kperkstp[::-1]):
-            data = {}
+            if itime < start_itime:
+                continue
+            data, pdata = {}, {}
             kper_start = datetime.now()
             self.logger.info(
                 kper_start,
@@ -339,10 +943,18 @@ class PerfMeas(object):
                 kk,
             )
             sol_key = kk_sol_map[kk]
-            if sol_key in adf:
+            if adf is not None and sol_key in adf:
                 raise Exception(
                     f"solution key '{sol_key}' already in adjoint hdf5 file"
                 )
+            if spill and adf is not None and write_nodes:
+                data = _StreamingGroup(
+                    PerfMeas._create_group(adf, sol_key),
+                    grid_shape=grid_shape,
+                    nodeuser=nodeuser,
+                    nodereduced=nodereduced,
+                    filters=filters,
+                )
 
             start = datetime.now()
             self.logger.info("forming rhs")
@@ -371,73 +983,30 @@ class PerfMeas(object):
             self.logger.info(f"...took:{(datetime.now() - start).total_seconds()}")
             start = datetime.now()
             self.logger.info("lambda solve")
-            m = None
-            if linear_solver is None:
-                if head.shape[0] < 50000:
-                    _linear_solver = spsolve
-                    _linear_solver_kwargs = {"use_umfpack": True}
-                else:
-                    _linear_solver = bicgstab
-                    _linear_solver_kwargs = {"rtol": 1e-5, "atol": 1e-5, "maxiter": 200}
-                    if use_precon:
-                        amat_ilu = spilu(amat)
-                        m = LinearOperator(
-                            (head.shape[0], head.shape[0]), amat_ilu.solve
-                        )
-
-            elif isinstance(linear_solver, str):
-                if linear_solver == "direct":
-                    _linear_solver = spsolve
-                    if len(linear_solver_kwargs) == 0:
-                        _linear_solver_kwargs = {"use_umfpack": True}
-                    else:
-                        _linear_solver_kwargs = linear_solver_kwargs
-                elif linear_solver == "bicgstab":
-                    _linear_solver = bicgstab
-                    if len(linear_solver_kwargs) == 0:
-                        _linear_solver_kwargs = {
-                            "rtol": 1e-5,
-                            "atol": 1e-5,
-                            "maxiter": 200,
-                        }
-                    else:
-                        _linear_solver_kwargs = linear_solver_kwargs
-                    if use_precon:
-                        amat_ilu = spilu(amat)
-                        m = LinearOperator(
-                            (head.shape[0], head.shape[0]), amat_ilu.solve
-                        )
-                else:
-                    raise Exception(
-                        "unrecognized 'linear_solver' value: "
-                        + f"'{linear_solver}', "
-                        + "should be 'direct' or 'bicgstab'"
-                    )
+            if not np.any(rhs):
+                # nothing forces the adjoint state (yet), so it is zero
+                self.logger.info("...zero rhs, skipping solve")
+                lamb = np.zeros_like(rhs)
             else:
-                _linear_solver = linear_solver
-                _linear_solver_kwargs = linear_solver_kwargs
-                if use_precon:
-                    amat_ilu = spilu(amat)
-                    m = LinearOperator((head.shape[0], head.shape[0]), amat_ilu.solve)
-
-            if m is not None:
-                _linear_solver_kwargs["M"] = m
-
-            self.logger.info("...solving with " + str(_linear_solver))
-            self.logger.info("...with options:" + str(_linear_solver_kwargs))
+                _linear_solver, _linear_solver_kwargs = PerfMeas._get_linear_solver(
+                    amat, linear_solver, linear_solver_kwargs, use_precon
+                )
 
-            # lamb = spsolve(amat, rhs,use_umfpack=True)
-            lamb = _linear_solver(amat, rhs, **_linear_solver_kwargs)
-            if isinstance(lamb, tuple):
-                self.logger.info("solver returned:" + str(lamb[1]))
-                lamb = lamb[0]
-            if np.any(np.isnan(lamb)):
-                self.logger.warning(
-                    (
-                        f"WARNING: nans in adjoint states for pm {self.name} "
-                        + f"at kperkstp {kk}"
+                self.logger.info("...solving with " + str(_linear_solver))
+                self.logger.info("...with options:" + str(_linear_solver_kwargs))
+
+                # lamb = spsolve(amat, rhs,use_umfpack=True)
+                lamb = _linear_solver(amat, rhs, **_linear_solver_kwargs)
+                if isinstance(lamb, tuple):
+                    self.logger.info("solver returned:" + str(lamb[1]))
+                    lamb = lamb[0]
+                if np.any(np.isnan(lamb)):
+                    self.logger.warning(
+                        (
+                            f"WARNING: nans in adjoint states for pm {self.name} "
+                            + f"at kperkstp {kk}"
+                        )
                     )
-                )
             self.logger.info(f"...took:{(datetime.now() - start).total_seconds()}")
             is_newton = hdf[sol_key].attrs["is_newton"]
 
@@ -471,10 +1040,8 @@ class PerfMeas(object):
                 hdf[sol_key]["k33"][:],
             )
 
-            data["k11"] = k_sens
-            data["k33"] = k33_sens
-            comp_k_sens += k_sens
-            comp_k33_sens += k33_sens
+            PerfMeas._store_sensitivity(data, pdata, composites, projs, "k11", k_sens)
+            PerfMeas._store_sensitivity(data, pdata, composites, projs, "k33", k33_sens)
             self.logger.info(f"...took:{(datetime.now() - start).total_seconds()}")
 
             if has_sto:
@@ -486,14 +1053,15 @@ class PerfMeas(object):
                     ss_sens = lamb * hdf[sol_key]["dresdss_h"][:]
                 else:
                     ss_sens = np.zeros_like(lamb)
-                data["ss"] = ss_sens
-                comp_ss_sens += ss_sens
+                PerfMeas._store_sensitivity(
+                    data, pdata, composites, projs, "ss", ss_sens
+                )
                 self.logger.info(f"...took:{(datetime.now() - start).total_seconds()}")
 
-            data["wel6_q"] = lamb
-            comp_welq_sens += lamb
-            comp_rch_sens += lamb
-            data["rch6_recharge"] = lamb
+            PerfMeas._store_sensitivity(data, pdata, composites, projs, "wel6_q", lamb)
+            PerfMeas._store_sensitivity(
+                data, pdata, composites, projs, "rch6_recharge", lamb
+            )
 
             for ptype, pnames in gwf_package_dict.items():
                 if ptype == "chd6":
@@ -506,22 +1074,31 @@ class PerfMeas(object):
 
                         self.logger.info(f"{ptype},{pname}")
 
-                        sp_bnd_dict = {
-                            "bound": hdf[sol_key][pname]["bound"][:],
-                            "node": hdf[sol_key][pname]["nodelist"][:],
-                        }
-                        # print(pname,ptype)
-                        # print(hdf[sol_key][pname]["bound"][:])
-                        sens_level, sens_cond = self.lam_drhs_dbnd(
-                            lamb, head, sp_bnd_dict, has_flux_pm
+                        if spill:
+                            sens_level, sens_cond = self._lam_drhs_dbnd_chunked(
+                                lamb,
+                                head,
+                                hdf[sol_key][pname],
+                                has_flux_pm,
+                                chunk_size,
+                            )
+                        else:
+                            sp_bnd_dict = {
+                                "bound": hdf[sol_key][pname]["bound"][:],
+                                "node": hdf[sol_key][pname]["nodelist"][:],
+                            }
+                            sens_level, sens_cond = self.lam_drhs_dbnd(
+                                lamb, head, sp_bnd_dict, has_flux_pm
+                            )
+                        name = pname + "_" + bnd_dict[ptype][0]
+                        PerfMeas._store_sensitivity(
+                            data, pdata, composites, projs, name, sens_level
                         )
-                        comp_bnd_results[pname + "_" + bnd_dict[ptype][0]] += sens_level
-                        data[pname + "_" + bnd_dict[ptype][0]] = sens_level
                         if len(bnd_dict[ptype]) > 1:
-                            comp_bnd_results[pname + "_" + bnd_dict[ptype][1]] += (
-                                sens_cond
+                            name = pname + "_" + bnd_dict[ptype][1]
+                            PerfMeas._store_sensitivity(
+                                data, pdata, composites, projs, name, sens_cond
                             )
-                            data[pname + "_" + bnd_dict[ptype][1]] = sens_cond
                         self.logger.info(
                             f"...took:{(datetime.now() - start).total_seconds()}"
                         )
@@ -540,68 +1117,1374 @@ class PerfMeas(object):
                 data["amat"] = amat
                 data["rhs"] = rhs
             self.logger.info("...save")
-            PerfMeas.write_group_to_hdf(
-                adf,
-                sol_key,
-                data,
-                nodeuser=nodeuser,
-                grid_shape=grid_shape,
-                nodereduced=nodereduced,
-            )
+            if isinstance(data, _StreamingGroup):
+                data.close()
+            elif adf is not None and write_nodes:
+                PerfMeas.write_group_to_hdf(
+                    adf,
+                    sol_key,
+                    data,
+                    nodeuser=nodeuser,
+                    grid_shape=grid_shape,
+                    nodereduced=nodereduced,
+                    filters=filters,
+                )
+            if adf is not None and len(pdata) > 0:
+                grp = adf.require_group(sol_key)
+                PerfMeas.write_group_to_hdf(grp, "projected", pdata, filters=filters)
+            if (
+                checkpoint_interval is not None
+                and (itime + 1) % checkpoint_interval == 0
+                and itime != len(kperkstp) - 1
+            ):
+                self.logger.info(f"...checkpoint after {sol_key}")
+                PerfMeas._write_checkpoint(
+                    adf,
+                    ((itime + 1) // checkpoint_interval) % 2,
+                    lamb,
+                    composites,
+                    itime,
+                    sol_key,
+                    fwd_fingerprint,
+                    pm_fingerprint,
+                )
         self.logger.info("...form composite sensitivities")
-        data = {}
-        data["k11"] = comp_k_sens
-        data["k33"] = comp_k33_sens
-
-        if has_sto:
-            data["ss"] = comp_ss_sens
-        data["wel6_q"] = comp_welq_sens
-        data["rch6_recharge"] = comp_rch_sens
+        if adf is not None:
+            self.logger.info("...save")
+            if write_nodes:
+                # one composite at a time so spilled accumulators are only read once
+                data = _StreamingGroup(
+                    PerfMeas._create_group(adf, "composite"),
+                    grid_shape=grid_shape,
+                    nodeuser=nodeuser,
+                    nodereduced=nodereduced,
+                    filters=filters,
+                )
+                for name, comp in composites.items():
+                    if name not in projs:
+                        data[name] = comp[:]
+                data.close()
+            if len(projs) > 0:
+                grp = PerfMeas._create_group(adf, "projected")
+                for name, (proj, par_names) in projs.items():
+                    grp.create_dataset(
+                        name,
+                        data=composites[name],
+                        **filters.kwargs("node", composites[name].shape),
+                    )
+                    grp.create_dataset(
+                        name + "_parameters", data=np.array(par_names, dtype="S")
+                    )
+            for slot in range(2):
+                if f"checkpoint_{slot}" in adf:
+                    del adf[f"checkpoint_{slot}"]
+            adf.close()
+        hdf.close()
 
-        for name, vals in comp_bnd_results.items():
-            data[name] = vals
-        self.logger.info("...save")
-        PerfMeas.write_group_to_hdf(
-            adf,
-            "composite",
-            data,
-            nodeuser=nodeuser,
-            grid_shape=grid_shape,
-            nodereduced=nodereduced,
-        )
-        adf.close()
+        df = pd.DataFrame(
+            {name: comp[:] for name, comp in composites.items() if name not in projs},
+            index=nodeuser + 1,
+        )
+        pdf = None
+        if len(projs) > 0:
+            pdf = pd.concat(
+                [
+                    pd.DataFrame(
+                        {"composite": name, "sensitivity": composites[name]},
+                        index=par_names,
+                    )
+                    for name, (proj, par_names) in projs.items()
+                ]
+            )
+            pdf.index.name = "parameter"
+        if scratch_fname is not None:
+            scratch.close()
+            os.remove(scratch_fname)
+
+        df.index.name = "node"
+        if write_results:
+            df.to_csv(f"adjoint_summary_{self._name}.csv")
+            if pdf is not None:
+                pdf.to_csv(f"adjoint_projected_summary_{self._name}.csv")
+
+        print(
+            datetime.now(),
+            "adjoint solve took: "
+            + str((datetime.now() - adj_start).total_seconds())
+            + f" for pm {self._name} at kperkstp {kk}",
+        )
+        self.logger.info(
+            "adjoint solve took: "
+            + str((datetime.now() - adj_start).total_seconds())
+            + f" for pm {self._name} at kperkstp {kk}"
+        )
+        if pdf is not None:
+            return df, pdf
+        return df
+
+    @staticmethod
+    def zone_projection(zones, nodeuser):
+        """form the sparse matrix that sums node values by zone
+
+        Parameters
+        ----------
+        zones (ndarray) : integer zone array, with either one value per model node
+            or one value per user node (e.g. shape (nlay, nrow, ncol) for a
+            structured grid).  Zones less than or equal to zero are excluded
+        nodeuser (ndarray) : the zero-based user node number of each model node
+
+        Returns
+        -------
+        proj (scipy.sparse.csr_matrix) : projection matrix, shape (nzone, nnodes)
+        labels (ndarray) : the zone number of each row of `proj`
+
+        """
+        zones = np.asarray(zones).ravel()
+        nnodes = nodeuser.shape[0]
+        if zones.shape[0] != nnodes:
+            if zones.shape[0] <= nodeuser.max():
+                raise Exception(
+                    f"zone array size {zones.shape[0]} doesn't match the number of "
+                    + f"model nodes ({nnodes}) or user nodes"
+                )
+            zones = zones[nodeuser]
+        zones = zones.astype(int)
+        labels = np.unique(zones[zones > 0])
+        nodes = np.flatnonzero(zones > 0)
+        proj = sparse.csr_matrix(
+            (
+                np.ones(nodes.shape[0]),
+                (np.searchsorted(labels, zones[nodes]), nodes),
+            ),
+            shape=(labels.shape[0], nnodes),
+        )
+        return proj, labels
+
+    @staticmethod
+    def _projection_setup(projection, nodeuser, comp_names):
+        """private method to form the projection matrices and parameter names
+        for the `projection` arg of solve_adjoint()
+
+        Parameters
+        ----------
+        projection (dict) : zone arrays or sparse matrices, keyed by composite name
+        nodeuser (ndarray) : the zero-based user node number of each model node
+        comp_names (list) : the composite names
+
+        Returns
+        -------
+        projs (dict) : (projection matrix, parameter names) tuples, keyed by
+            composite name
+
+        """
+        projs = {}
+        if projection is None:
+            return projs
+        for name, proj in projection.items():
+            if name not in comp_names:
+                raise Exception(
+                    f"projection composite '{name}' not found, should be one "
+                    + f"of {comp_names!s}"
+                )
+            if sparse.issparse(proj):
+                proj = sparse.csr_matrix(proj)
+                if proj.shape[1] != nodeuser.shape[0]:
+                    raise Exception(
+                        f"projection matrix for '{name}' has {proj.shape[1]} "
+                        + f"columns, should be {nodeuser.shape[0]} (nodes)"
+                    )
+                par_names = [f"{name}_{i + 1}" for i in range(proj.shape[0])]
+            else:
+                proj, labels = PerfMeas.zone_projection(proj, nodeuser)
+                par_names = [f"{name}_z{label}" for label in labels]
+            projs[name] = (proj, par_names)
+        return projs
+
+    @staticmethod
+    def _store_sensitivity(data, pdata, composites, projs, name, vals):
+        """private method to save a per time step sensitivity and add it to its
+        composite.  Projected sensitivities are contracted to parameter space first
+
+        Parameters
+        ----------
+        data (dict) : the node-level per time step results
+        pdata (dict) : the projected per time step results
+        composites (dict) : the composite accumulators
+        projs (dict) : see _projection_setup()
+        name (str) : the composite name
+        vals (ndarray) : the node sensitivities
+
+        """
+        if name in projs:
+            vals = projs[name][0] @ vals
+            pdata[name] = vals
+        else:
+            data[name] = vals
+        PerfMeas._accumulate(composites, name, vals)
+
+    def basis_locations(self):
+        """get the unique observation locations and times of the head entries
+
+        Returns
+        -------
+        locations (list) : sorted, unique (kper, kstp, inode) tuples, zero-based
+
+        """
+        entries = self._entries
+        head = entries.is_head
+        locations = set(
+            zip(
+                entries.kper[head].tolist(),
+                entries.kstp[head].tolist(),
+                entries.inode[head].tolist(),
+            )
+        )
+        return sorted(locations)
+
+    @staticmethod
+    def basis_fname(hdf5_forward_solution_fname):
+        """get the default adjoint basis HDF5 filename
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the forward solution HDF5 filename
+
+        Returns
+        -------
+        fname (str) : the adjoint basis HDF5 filename
+
+        """
+        pth, fname = os.path.split(hdf5_forward_solution_fname)
+        return os.path.join(pth, "adjoint_basis_" + fname)
+
+    @staticmethod
+    def solve_basis(
+        hdf5_forward_solution_fname: str,
+        locations: list,
+        hdf5_basis_fname: Optional[str] = None,
+        linear_solver=None,
+        linear_solver_kwargs: dict = {},
+        use_precon: bool = True,
+    ):
+        """Solve for the unit adjoint basis: the composite sensitivities of the
+        head at each observation location and time.  The adjoint is linear in the
+        partial of the performance measure with respect to head, so the composite
+        sensitivities of any head performance measure are a weighted sum of the
+        basis (see `PerfMeas.solve_adjoint_from_basis()`).  All the basis adjoint
+        states are solved together, one factorization per time step.  Locations
+        already in an existing basis file for the same forward solution and
+        linear solver options are not solved again.
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the HDF5 file written during the forward
+            GWF solution
+        locations (list) : the (kper, kstp, inode) tuples (zero-based) to solve
+            the basis for.  See `PerfMeas.basis_locations()`
+        hdf5_basis_fname (str) : the HDF5 file to store the basis in.  If None,
+            'adjoint_basis_<hdf5_forward_solution_fname>' is used
+        linear_solver (varies) : the linear solver to use.  See
+            `PerfMeas.solve_adjoint()`
+        linear_solver_kwargs (dict): dictionary of keyword args to pass to
+            `linear_solver`.  Default is {}
+        use_precon (bool): flag to use an ILU preconditioner with iterative
+            linear solver.
+
+        Returns
+        -------
+        nsolved (int) : the number of basis locations solved
+
+        """
+        logger = logging.getLogger(logging.__name__ + "basis")
+        if hdf5_basis_fname is None:
+            hdf5_basis_fname = PerfMeas.basis_fname(hdf5_forward_solution_fname)
+        basis_start = datetime.now()
+        hdf = ForwardStore(hdf5_forward_solution_fname)
+        sol_keys, kperkstp, kk_sol_map = PerfMeas._get_solution_keys(hdf)
+        fwd_fingerprint = PerfMeas.forward_fingerprint(hdf)
+
+        solver_signature = PerfMeas._solver_signature(
+            linear_solver, linear_solver_kwargs, use_precon
+        )
+
+        bdf = None
+        if os.path.exists(hdf5_basis_fname):
+            bdf = h5py.File(hdf5_basis_fname, "a")
+            if (
+                bdf.attrs.get("forward_fingerprint", None) != fwd_fingerprint
+                or bdf.attrs.get("solver_signature", None) != solver_signature
+            ):
+                logger.warning(
+                    f"WARNING: basis file '{hdf5_basis_fname}' is for a different "
+                    + "forward solution or linear solver, removing"
+                )
+                bdf.close()
+                os.remove(hdf5_basis_fname)
+                bdf = None
+        if bdf is None:
+            bdf = h5py.File(hdf5_basis_fname, "w")
+            bdf.attrs["forward_fingerprint"] = fwd_fingerprint
+            bdf.attrs["solver_signature"] = solver_signature
+
+        existing = set()
+        if "locations" in bdf:
+            existing = {tuple(loc) for loc in bdf["locations"][:].tolist()}
+        new_locations = []
+        for loc in locations:
+            loc = tuple(int(v) for v in loc)
+            if loc in existing or loc in new_locations:
+                continue
+            if (loc[0], loc[1]) not in kk_sol_map:
+                logger.warning(
+                    f"WARNING: no solution dataset for basis location {loc!s}"
+                )
+                continue
+            new_locations.append(loc)
+        if len(new_locations) == 0:
+            bdf.close()
+            hdf.close()
+            return 0
+        logger.info(f"solving {len(new_locations)} basis locations")
+
+        gwf_package_dict = dict(hdf["gwf_info"].attrs.items())
+        nnodes = int(hdf["gwf_info"]["nnodes"][0])
+        ia = hdf["gwf_info"]["ia"][:]
+        ja = hdf["gwf_info"]["ja"][:]
+        ihc = hdf["gwf_info"]["ihc"][:]
+        jas = hdf["gwf_info"]["jas"][:]
+        cl1 = hdf["gwf_info"]["cl1"][:]
+        cl2 = hdf["gwf_info"]["cl2"][:]
+        hwva = hdf["gwf_info"]["hwva"][:]
+        top = hdf["gwf_info"]["top"][:]
+        bot = hdf["gwf_info"]["bot"][:]
+        icelltype = hdf["gwf_info"]["icelltype"][:]
+        has_sto = hdf[sol_keys[0]].attrs["has_sto"]
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+        comp_names = PerfMeas._composite_names(gwf_package_dict, has_sto)
+
+        nbasis = len(new_locations)
+        loc_kk = [(loc[0], loc[1]) for loc in new_locations]
+        loc_inode = np.array([loc[2] for loc in new_locations], dtype=int)
+        composites = {name: np.zeros((nnodes, nbasis)) for name in comp_names}
+        lamb = np.zeros((nnodes, nbasis))
+
+        for itime, kk in enumerate(kperkstp[::-1]):
+            sol_key = kk_sol_map[kk]
+            grp = hdf[sol_key]
+            if itime != 0:
+                rhs = grp["drhsdh"][:][:, None] * lamb
+            else:
+                rhs = np.zeros((nnodes, nbasis))
+            # the unit partial of the performance measure with respect to head
+            for ib in range(nbasis):
+                if loc_kk[ib] == kk:
+                    rhs[loc_inode[ib], ib] -= 1.0
+            active = np.flatnonzero(np.any(rhs != 0.0, axis=0))
+            lamb = np.zeros((nnodes, nbasis))
+            if active.shape[0] == 0:
+                continue
+
+            amat = grp["amat"][:]
+            amat = sparse.csr_matrix(
+                (amat.copy()[: ja.shape[0]], ja.copy(), ia.copy()),
+                shape=(len(ia) - 1, len(ia) - 1),
+            )
+            amat = amat.transpose()
+            _linear_solver, _linear_solver_kwargs = PerfMeas._get_linear_solver(
+                amat, linear_solver, linear_solver_kwargs, use_precon
+            )
+            if _linear_solver is spsolve:
+                # one factorization for all the active basis states
+                lamb[:, active] = _linear_solver(
+                    amat.tocsc(), rhs[:, active], **_linear_solver_kwargs
+                ).reshape(nnodes, -1)
+            else:
+                for ib in active:
+                    result = _linear_solver(amat, rhs[:, ib], **_linear_solver_kwargs)
+                    if isinstance(result, tuple):
+                        result = result[0]
+                    lamb[:, ib] = result
+
+            # zero out the adj state for chd nodes
+            if "chd6" in gwf_package_dict:
+                for pname in gwf_package_dict["chd6"]:
+                    lamb[grp[pname]["nodelist"][:] - 1, :] = 0.0
+
+            head = grp["head"][:]
+            op_k, op_k33 = PerfMeas._dresdk_h_operators(
+                grp.attrs["is_newton"],
+                grp["sat"][:],
+                head,
+                ihc,
+                ia,
+                ja,
+                jas,
+                cl1,
+                cl2,
+                hwva,
+                top,
+                bot,
+                icelltype,
+                grp["k11"][:],
+                grp["k33"][:],
+            )
+            composites["k11"] += op_k @ lamb
+            composites["k33"] += op_k33 @ lamb
+            if has_sto and grp["iss"][0] == 0:
+                composites["ss"] += grp["dresdss_h"][:][:, None] * lamb
+            composites["wel6_q"] += lamb
+            composites["rch6_recharge"] += lamb
+
+            for ptype, pnames in gwf_package_dict.items():
+                if ptype == "chd6" or ptype not in bnd_dict:
+                    continue
+                for pname in pnames:
+                    if pname not in grp:
+                        continue
+                    # the same (last entry wins) semantics as lam_drhs_dbnd()
+                    bound = grp[pname]["bound"][:]
+                    n = grp[pname]["nodelist"][:] - 1
+                    boundcond = np.full(n.shape[0], 1e10)
+                    if bound.shape[1] > 1:
+                        boundcond = bound[:, 1]
+                    sens_level = np.zeros((nnodes, nbasis))
+                    sens_level[n, :] = boundcond[:, None] * lamb[n, :]
+                    composites[pname + "_" + bnd_dict[ptype][0]] += sens_level
+                    if len(bnd_dict[ptype]) > 1:
+                        sens_cond = np.zeros((nnodes, nbasis))
+                        sens_cond[n, :] = (bound[:, 0] - head[n])[:, None] * lamb[n, :]
+                        composites[pname + "_" + bnd_dict[ptype][1]] += sens_cond
+
+        if "locations" not in bdf:
+            bdf.create_dataset(
+                "locations", (0, 3), maxshape=(None, 3), dtype=int, chunks=True
+            )
+        nexisting = bdf["locations"].shape[0]
+        bdf["locations"].resize((nexisting + nbasis, 3))
+        bdf["locations"][nexisting:, :] = np.array(new_locations, dtype=int)
+        bgrp = bdf.require_group("basis")
+        for name, comp in composites.items():
+            if name not in bgrp:
+                bgrp.create_dataset(
+                    name,
+                    (nnodes, 0),
+                    maxshape=(nnodes, None),
+                    dtype=float,
+                    chunks=(min(nnodes, _SPILL_CHUNK), 1),
+                )
+            bgrp[name].resize((nnodes, nexisting + nbasis))
+            bgrp[name][:, nexisting:] = comp
+        bdf.close()
         hdf.close()
+        print(
+            datetime.now(),
+            "adjoint basis solve took: "
+            + str((datetime.now() - basis_start).total_seconds())
+            + f" for {nbasis} locations",
+        )
+        return nbasis
+
+    @staticmethod
+    def solve_adjoint_fused(
+        performance_measures: List,
+        kperkstp: tuple,
+        sol: dict,
+        gwf_info: dict,
+        gwf_package_dict: dict,
+        is_newton: bool,
+        write_results: bool = True,
+    ):
+        """Solve the adjoint states of several performance measures for a single
+        time step model, directly from the in-memory forward solution components
+        and with one factorization of AMAT shared by all the performance measures.
+        Used by `Mf6Adj.solve_fused()` right after the time step converges; no
+        adjoint solution HDF5 files are written.
+
+        Parameters
+        ----------
+        performance_measures (list) : the `PerfMeas` instances to solve
+        kperkstp (tuple) : the zero-based stress period and time step
+        sol (dict) : the forward solution components of the time step, as in a
+            solution group of the forward solution HDF5 file ('amat', 'head',
+            'k11', ..., and a dict of 'nodelist', 'bound' and 'hcof' for each
+            boundary package)
+        gwf_info (dict) : the model structure arrays, as in the 'gwf_info' group of
+            the forward solution HDF5 file
+        gwf_package_dict (dict) : the package names, keyed by package type
+        is_newton (bool) : flag for the Newton-Raphson formulation
+        write_results (bool): flag to write the summary CSV file of each
+            performance measure.  Default is True
+
+        Returns
+        -------
+        dfs (dict) : summary of composite sensitivity information, keyed by
+            performance measure name
+
+        """
+        adj_start = datetime.now()
+        nnodes = int(gwf_info["nnodes"][0])
+        nodeuser = gwf_info["nodeuser"]
+        if len(nodeuser) == 1:
+            nodeuser = np.arange(nnodes, dtype=int)
+        ia, ja = gwf_info["ia"], gwf_info["ja"]
+        has_sto = "dresdss_h" in sol
+        comp_names = PerfMeas._composite_names(gwf_package_dict, has_sto)
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+
+        rhs = np.zeros((nnodes, len(performance_measures)))
+        for ipm, pm in enumerate(performance_measures):
+            rhs[:, ipm] = -pm._dfdh(kperkstp, sol)
+        amat = sparse.csr_matrix(
+            (sol["amat"][: ja.shape[0]].copy(), ja.copy(), ia.copy()),
+            shape=(len(ia) - 1, len(ia) - 1),
+        )
+        lamb = np.zeros_like(rhs)
+        active = np.flatnonzero(np.any(rhs != 0.0, axis=0))
+        if active.shape[0] > 0:
+            lamb[:, active] = splu(amat.tocsc()).solve(rhs[:, active], trans="T")
+
+        # zero out the adj state for chd nodes
+        if "chd6" in gwf_package_dict:
+            for pname in gwf_package_dict["chd6"]:
+                lamb[sol[pname]["nodelist"][:] - 1, :] = 0.0
+
+        head = sol["head"]
+        op_k, op_k33 = PerfMeas._dresdk_h_operators(
+            is_newton,
+            sol["sat"],
+            head,
+            gwf_info["ihc"],
+            ia,
+            ja,
+            gwf_info["jas"],
+            gwf_info["cl1"],
+            gwf_info["cl2"],
+            gwf_info["hwva"],
+            gwf_info["top"],
+            gwf_info["bot"],
+            gwf_info["icelltype"],
+            sol["k11"],
+            sol["k33"],
+        )
+        k_sens = op_k @ lamb
+        k33_sens = op_k33 @ lamb
+
+        dfs = {}
+        for ipm, pm in enumerate(performance_measures):
+            has_flux_pm = pm._entries.has_flux
+            composites = {
+                "k11": k_sens[:, ipm],
+                "k33": k33_sens[:, ipm],
+                "wel6_q": lamb[:, ipm],
+                "rch6_recharge": lamb[:, ipm],
+            }
+            if has_sto:
+                if sol["iss"][0] == 0:
+                    composites["ss"] = lamb[:, ipm] * sol["dresdss_h"]
+                else:
+                    composites["ss"] = np.zeros(nnodes)
+            for ptype, pnames in gwf_package_dict.items():
+                if ptype == "chd6" or ptype not in bnd_dict:
+                    continue
+                for pname in pnames:
+                    if pname not in sol:
+                        continue
+                    sp_bnd_dict = {
+                        "bound": sol[pname]["bound"],
+                        "node": sol[pname]["nodelist"],
+                    }
+                    sens_level, sens_cond = pm.lam_drhs_dbnd(
+                        lamb[:, ipm], head, sp_bnd_dict, has_flux_pm
+                    )
+                    composites[pname + "_" + bnd_dict[ptype][0]] = sens_level
+                    if len(bnd_dict[ptype]) > 1:
+                        composites[pname + "_" + bnd_dict[ptype][1]] = sens_cond
+            df = pd.DataFrame(
+                {name: composites.get(name, np.zeros(nnodes)) for name in comp_names},
+                index=nodeuser + 1,
+            )
+            df.index.name = "node"
+            if write_results:
+                df.to_csv(f"adjoint_summary_{pm.name}.csv")
+            dfs[pm.name] = df
+        print(
+            datetime.now(),
+            "fused adjoint solve took: "
+            + str((datetime.now() - adj_start).total_seconds())
+            + f" for {len(performance_measures)} pms at kperkstp {kperkstp}",
+        )
+        return dfs
+
+    def solve_adjoint_from_basis(
+        self,
+        hdf5_forward_solution_fname: str,
+        hdf5_basis_fname: Optional[str] = None,
+        hdf5_adjoint_solution_fname: Optional[str] = None,
+        write_nodes: bool = True,
+        hdf5_filter=None,
+        hdf5_chunks: Optional[dict] = None,
+    ):
+        """Assemble the composite sensitivities of a head performance measure from
+        the unit adjoint basis, without solving.  Only the 'composite' group is
+        written to the adjoint solution HDF5 file; the per time step adjoint
+        states are not available in this mode.
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the HDF5 file written during the forward
+            GWF solution
+        hdf5_basis_fname (str) : the adjoint basis HDF5 file written by
+            `PerfMeas.solve_basis()`.  If None, the default name is used
+        hdf5_adjoint_solution_fname (str) : the adjoint solution HDF5 file to
+            write.  If None, the default name is used
+        write_nodes (bool) : flag to write the 'composite' group to the adjoint
+            solution HDF5 file.  Default is True
+        hdf5_filter (str or Hdf5Filter) : the compression filter of the adjoint
+            solution HDF5 datasets.  See `solve_adjoint()`.  Default is None (no
+            filter)
+        hdf5_chunks (dict) : optional chunks of the adjoint solution HDF5
+            datasets.  See `solve_adjoint()`.  Default is None
+
+        Returns
+        -------
+        dfs (DataFrame) : summary of composite sensitivity information
+
+        """
+        if self._entries.has_flux:
+            ptype = next(ptype for ptype in self._entries.pm_types if ptype != "head")
+            raise Exception(
+                f"PerfMeas {self._name} has '{ptype}' entries, only head "
+                + "performance measures can be assembled from the basis"
+            )
+        if hdf5_basis_fname is None:
+            hdf5_basis_fname = PerfMeas.basis_fname(hdf5_forward_solution_fname)
+        if hdf5_adjoint_solution_fname is None:
+            hdf5_adjoint_solution_fname = self.adjoint_solution_fname(
+                hdf5_forward_solution_fname
+            )
+        if not os.path.exists(hdf5_basis_fname):
+            raise Exception(f"basis file '{hdf5_basis_fname}' not found")
+        hdf = ForwardStore(hdf5_forward_solution_fname)
+        bdf = h5py.File(hdf5_basis_fname, "r")
+        if bdf.attrs["forward_fingerprint"] != PerfMeas.forward_fingerprint(hdf):
+            raise Exception(
+                f"basis file '{hdf5_basis_fname}' is for a different forward solution"
+            )
+        sol_keys, _, kk_sol_map = PerfMeas._get_solution_keys(hdf)
+
+        # the partial of the performance measure WRT head at each location,
+        # with the same (last entry wins) semantics as _dfdh()
+        coefs = {}
+        entries = self._entries
+        for kk in entries.kperkstps:
+            if kk not in kk_sol_map:
+                continue
+            rows = entries.rows(kk)
+            vals = entries.weight[rows]
+            residual = entries.residual[rows]
+            if residual.any():
+                head = hdf[kk_sol_map[kk]]["head"][:]
+                sim = head[entries.inode[rows][residual]]
+                vals = vals.copy()
+                vals[residual] = (
+                    2.0 * vals[residual] * (sim - entries.obsval[rows][residual])
+                )
+            for inode, val in zip(entries.inode[rows].tolist(), vals.tolist()):
+                coefs[(kk[0], kk[1], inode)] = val
+
+        col_map = {tuple(loc): i for i, loc in enumerate(bdf["locations"][:].tolist())}
+        missing = [loc for loc in coefs if loc not in col_map]
+        if len(missing) > 0:
+            raise Exception(
+                f"{len(missing)} locations of PerfMeas {self._name} are not in the "
+                + f"basis, first one: {missing[0]!s}, call solve_basis() first"
+            )
+        cols = np.array([col_map[loc] for loc in coefs], dtype=int)
+        weights = np.array(list(coefs.values()), dtype=float)
+        order = np.argsort(cols)
+        cols, weights = cols[order], weights[order]
+
+        nnodes = hdf["gwf_info"]["nnodes"][:]
+        nodeuser = hdf["gwf_info"]["nodeuser"][:]
+        nodereduced = hdf["gwf_info"]["nodereduced"][:]
+        if len(nodeuser) == 1:
+            nodeuser = np.arange(nnodes[0], dtype=int)
+        if len(nodereduced) == 1:
+            nodereduced = None
+        grid_shape = None
+        if "nrow" in hdf["gwf_info"].keys():
+            grid_shape = (
+                hdf["gwf_info"]["nlay"][0],
+                hdf["gwf_info"]["nrow"][0],
+                hdf["gwf_info"]["ncol"][0],
+            )
+        gwf_package_dict = dict(hdf["gwf_info"].attrs.items())
+        has_sto = hdf[sol_keys[0]].attrs["has_sto"]
+        comp_names = PerfMeas._composite_names(gwf_package_dict, has_sto)
+
+        composites = {}
+        for name in comp_names:
+            if len(cols) == 0:
+                composites[name] = np.zeros(nnodes[0])
+            else:
+                composites[name] = bdf["basis"][name][:, cols] @ weights
+        bdf.close()
+        hdf.close()
+
+        if os.path.exists(hdf5_adjoint_solution_fname):
+            os.remove(hdf5_adjoint_solution_fname)
+        adf = h5py.File(hdf5_adjoint_solution_fname, "w")
+        adf.attrs["basis"] = True
+        if write_nodes:
+            PerfMeas.write_group_to_hdf(
+                adf,
+                "composite",
+                composites,
+                nodeuser=nodeuser,
+                grid_shape=grid_shape,
+                nodereduced=nodereduced,
+                filters=Hdf5Filter.create(hdf5_filter, hdf5_chunks),
+            )
+        adf.close()
+
+        df = pd.DataFrame(composites, index=nodeuser + 1)
+        df.index.name = "node"
+        df.to_csv(f"adjoint_summary_{self._name}.csv")
+        self.logger.info(
+            f"assembled PerfMeas {self._name} from {len(cols)} basis locations"
+        )
+        return df
+
+    @staticmethod
+    def parse_memory(max_memory):
+        """convert a memory size to a number of bytes
+
+        Parameters
+        ----------
+        max_memory (int, float or str) : number of bytes or a string such as
+            "8GB", "512 MB" or "2GiB".  Units are powers of 1024.
+
+        Returns
+        -------
+        nbytes (int) : the number of bytes
+
+        """
+        if isinstance(max_memory, (int, float, np.integer, np.floating)):
+            return int(max_memory)
+        units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+        m = re.match(
+            r"^([0-9]*\.?[0-9]+(?:e[+-]?[0-9]+)?)([kmgt]?)(?:i?b)?$",
+            str(max_memory).strip().lower().replace(" ", ""),
+        )
+        if m is None:
+            raise Exception(f"unrecognized memory size: '{max_memory}'")
+        return int(float(m.group(1)) * units[m.group(2).upper()])
+
+    @staticmethod
+    def estimate_adjoint_memory(
+        nnodes,
+        nnz,
+        ncomposite,
+        max_nbound=0,
+        linear_solver="direct",
+        use_precon=True,
+        spill=False,
+    ):
+        """rough estimate of the peak memory use of an adjoint solve.  The
+        factorization terms are heuristics (the actual fill depends on the
+        ordering and the grid), the rest is counted from the arrays that are
+        held during a timestep
+
+        Parameters
+        ----------
+        nnodes (int) : number of (reduced) nodes
+        nnz (int) : number of nonzeros in AMAT
+        ncomposite (int) : number of composite sensitivity arrays
+        max_nbound (int) : largest number of entries in a boundary package
+        linear_solver (str or callable) : "direct", "bicgstab" or a callable
+        use_precon (bool) : flag for an ILU preconditioner with an iterative solver
+        spill (bool) : flag for on-disk composites and streamed outputs
+
+        Returns
+        -------
+        estimate (dict) : estimated bytes for each component of the solve
+
+        """
+        fbytes = 8
+        estimate = {}
+        # lambda, rhs, dfdh, head, sat, k11, k33, lam_dresdk_h work arrays...
+        estimate["state"] = 20 * nnodes * fbytes
+        # amat as read, its copy and the csr indices
+        estimate["amat"] = 5 * nnz * fbytes + 2 * (nnodes + 1) * fbytes
+        if linear_solver == "direct":
+            # factor fill grows roughly like nnodes^(1/3) for 3D grids
+            fill = max(10.0, nnodes ** (1.0 / 3.0))
+            estimate["solver"] = int(fill * nnz * (fbytes + 4))
+        else:
+            estimate["solver"] = 10 * nnodes * fbytes
+            if use_precon:
+                estimate["solver"] += _ILU_FILL_FACTOR * nnz * (fbytes + 4)
+        if spill:
+            chunk = min(nnodes, _SPILL_CHUNK)
+            estimate["timestep_output"] = 2 * nnodes * fbytes
+            estimate["composites"] = 2 * chunk * fbytes
+            estimate["boundaries"] = 2 * nnodes * fbytes + 4 * chunk * fbytes
+        else:
+            estimate["timestep_output"] = (ncomposite + 5) * nnodes * fbytes
+            estimate["composites"] = ncomposite * nnodes * fbytes
+            estimate["boundaries"] = 2 * nnodes * fbytes + 4 * max_nbound * fbytes
+        # the summary dataframe
+        estimate["summary"] = (ncomposite + 1) * nnodes * fbytes
+        return estimate
+
+    @staticmethod
+    def _plan_memory(
+        max_bytes, nnodes, nnz, ncomposite, max_nbound, linear_solver, use_precon
+    ):
+        """private method to pick the adjoint solve configuration that fits in a
+        memory budget.  In-memory composites are preferred over spilling and, if
+        no `linear_solver` was passed, the default solver is preferred over the
+        leaner ones
+
+        Parameters
+        ----------
+        max_bytes (int) : the memory budget
+        nnodes (int) : number of (reduced) nodes
+        nnz (int) : number of nonzeros in AMAT
+        ncomposite (int) : number of composite sensitivity arrays
+        max_nbound (int) : largest number of entries in a boundary package
+        linear_solver (varies) : the `linear_solver` passed to solve_adjoint()
+        use_precon (bool) : the `use_precon` passed to solve_adjoint()
+
+        Returns
+        -------
+        linear_solver, use_precon, spill, estimate : the solve configuration
+            and its estimated memory use
+
+        """
+        if linear_solver is None:
+            if nnodes < 50000:
+                candidates = [("direct", use_precon), ("bicgstab", use_precon)]
+            else:
+                candidates = [("bicgstab", use_precon)]
+            if use_precon:
+                candidates.append(("bicgstab", False))
+        else:
+            candidates = [(linear_solver, use_precon)]
+        estimate = None
+        for solver, precon in candidates:
+            for spill in [False, True]:
+                estimate = PerfMeas.estimate_adjoint_memory(
+                    nnodes,
+                    nnz,
+                    ncomposite,
+                    max_nbound=max_nbound,
+                    linear_solver=solver,
+                    use_precon=precon,
+                    spill=spill,
+                )
+                if sum(estimate.values()) <= max_bytes:
+                    return solver, precon, spill, estimate
+        raise Exception(
+            f"estimated adjoint memory use of {sum(estimate.values()) / 1024**3:.3G}"
+            + f" GB exceeds the max_memory budget of {max_bytes / 1024**3:.3G} GB, "
+            + "estimate by component (bytes): "
+            + str(estimate)
+        )
+
+    def verify_lossy(
+        self,
+        hdf5_forward_solution_fname: str,
+        lossy: dict,
+        hdf5_lossy_fname: Optional[str] = None,
+        linear_solver=None,
+        linear_solver_kwargs: dict = {},
+        use_precon: bool = True,
+    ):
+        """Report the effect of lossy forward solution storage on the composite
+        sensitivities of the performance measure: the forward solution is
+        rewritten with the error bounds of `lossy` (see `ForwardStore.rewrite()`)
+        and the adjoint is solved from both files.
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the forward solution HDF5 file, stored
+            exactly
+        lossy (dict) : the error bounds, keyed by "amat", "head" or "sat".  See
+            `GroupWriter`
+        hdf5_lossy_fname (str) : the lossy forward solution HDF5 file to write.
+            If None, 'lossy_<hdf5_forward_solution_fname>' is used
+        linear_solver (varies) : the linear solver.  See `solve_adjoint()`
+        linear_solver_kwargs (dict): dictionary of keyword args to pass to
+            `linear_solver`.  Default is {}
+        use_precon (bool): flag to use an ILU preconditioner with iterative
+            linear solver.
+
+        Returns
+        -------
+        df (DataFrame) : for each composite, the largest absolute sensitivity
+            ('max_abs_sens'), the largest absolute difference of the lossy
+            sensitivities ('max_abs_error') and its ratio to the largest
+            sensitivity ('rel_error'), the sum of the sensitivities ('sum' and
+            'sum_lossy') and the rank correlation of the exact and lossy
+            sensitivities ('rank_corr')
+
+        """
+        if hdf5_lossy_fname is None:
+            pth, fname = os.path.split(hdf5_forward_solution_fname)
+            hdf5_lossy_fname = os.path.join(pth, "lossy_" + fname)
+        with ForwardStore(hdf5_forward_solution_fname) as hdf:
+            if "lossy" in hdf.attrs:
+                raise Exception(
+                    f"'{hdf5_forward_solution_fname}' is already stored lossy: "
+                    + str(hdf.attrs["lossy"])
+                )
+            layout = hdf.layout
+            value = self.evaluate(hdf)
+            hdf.rewrite(hdf5_lossy_fname, layout=layout, lossy=lossy)
+        value_lossy = self.evaluate(hdf5_lossy_fname)
+        self.logger.info(
+            f"lossy storage of PerfMeas {self._name}: "
+            + f"{os.path.getsize(hdf5_forward_solution_fname)} bytes exact, "
+            + f"{os.path.getsize(hdf5_lossy_fname)} bytes lossy, value "
+            + f"{value} exact, {value_lossy} lossy"
+        )
+
+        dfs = []
+        for fname in [hdf5_forward_solution_fname, hdf5_lossy_fname]:
+            dfs.append(
+                self.solve_adjoint(
+                    fname,
+                    linear_solver=linear_solver,
+                    linear_solver_kwargs=linear_solver_kwargs,
+                    use_precon=use_precon,
+                    write_results=False,
+                )
+            )
+        df, df_lossy = dfs
+        rows = {}
+        for name in df.columns:
+            exact, approx = df[name].values, df_lossy[name].values
+            max_abs = np.abs(exact).max()
+            max_err = np.abs(approx - exact).max()
+            rows[name] = {
+                "max_abs_sens": max_abs,
+                "max_abs_error": max_err,
+                "rel_error": max_err / max_abs if max_abs > 0 else max_err,
+                "sum": exact.sum(),
+                "sum_lossy": approx.sum(),
+                "rank_corr": df[name].corr(df_lossy[name], method="spearman"),
+            }
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    def adjoint_solution_fname(self, hdf5_forward_solution_fname):
+        """get the default adjoint solution HDF5 filename
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the forward solution HDF5 filename
+
+        Returns
+        -------
+        fname (str) : the adjoint solution HDF5 filename
+
+        """
+        pth = os.path.split(hdf5_forward_solution_fname)[0]
+        return os.path.join(
+            pth,
+            f"adjoint_solution_{self._name}_" + hdf5_forward_solution_fname,
+        )
+
+    def fingerprint(self):
+        """a sha256 digest of the performance measure name and entries
 
-        df = pd.DataFrame(
-            {
-                "k11": comp_k_sens,
-                "k33": comp_k33_sens,
-                "wel6_q": comp_welq_sens,
-                "rch6_recharge": comp_rch_sens,
-            },
-            index=nodeuser + 1,
+        Returns
+        -------
+        fingerprint (str) : hex digest
+
+        """
+        h = hashlib.sha256(self._name.encode())
+        e = self._entries
+        pm_forms = PerfMeasEntries.pm_forms
+        for kper, kstp, inode, tcode, fcode, weight, obsval in zip(
+            e.kper.tolist(),
+            e.kstp.tolist(),
+            e.inode.tolist(),
+            e.type_code.tolist(),
+            e.form_code.tolist(),
+            e.weight.tolist(),
+            e.obsval.tolist(),
+        ):
+            h.update(
+                repr(
+                    (
+                        (kper, kstp),
+                        inode,
+                        e.pm_types[tcode],
+                        pm_forms[fcode],
+                        weight,
+                        obsval,
+                    )
+                ).encode()
+            )
+        return h.hexdigest()
+
+    @staticmethod
+    def forward_fingerprint(hdf):
+        """a content fingerprint of a forward solution HDF5 file: a sha256 digest
+        of the grid connectivity and geometry, the storage coefficients, the time
+        discretization and, for every solution group, the heads, AMAT, the
+        conductance properties and the boundary package lists and values.  Stores
+        with the same heads but different properties fingerprint differently
+
+        Parameters
+        ----------
+        hdf (str, h5py.File or ForwardStore) : the forward solution HDF5 file
+            handle or name
+
+        Returns
+        -------
+        fingerprint (str) : hex digest
+
+        """
+        if not isinstance(hdf, ForwardStore):
+            with ForwardStore(hdf) as f:
+                return PerfMeas.forward_fingerprint(f)
+        h = hashlib.sha256()
+        for name in ["nodeuser", "ia", "ja"]:
+            h.update(np.ascontiguousarray(hdf["gwf_info"][name][:]).tobytes())
+        for name, arr in sorted(hdf.grid.items()):
+            h.update(name.encode())
+            h.update(np.ascontiguousarray(arr).tobytes())
+        for name in ["totime", "dt", "kper", "kstp"]:
+            h.update(np.ascontiguousarray(hdf["aux"][name][:]).tobytes())
+        pnames = sorted(
+            str(pname) for pnames in hdf["gwf_info"].attrs.values() for pname in pnames
         )
+        sol_keys = [k for k in hdf.keys() if k.startswith("solution")]
+        sol_keys.sort()
+        for sol_key in sol_keys:
+            h.update(sol_key.encode())
+            grp = hdf[sol_key]
+            for name in ["head", "amat", "k11", "k33", "condsat"]:
+                if name in grp:
+                    h.update(name.encode())
+                    h.update(np.ascontiguousarray(grp[name][:]).tobytes())
+            for pname in pnames:
+                if pname not in grp:
+                    continue
+                for name in ["nodelist", "bound"]:
+                    h.update(f"{pname}/{name}".encode())
+                    h.update(np.ascontiguousarray(grp[pname][name][:]).tobytes())
+        return h.hexdigest()
 
-        for name, vals in comp_bnd_results.items():
-            df[name] = vals
-        if has_sto:
-            df["ss"] = comp_ss_sens
+    @staticmethod
+    def _copy_array(src, dst):
+        """private method to copy between ndarrays and/or h5py datasets in chunks
 
-        df.index.name = "node"
-        df.to_csv(f"adjoint_summary_{self._name}.csv")
+        Parameters
+        ----------
+        src (ndarray or h5py.Dataset) : the source
+        dst (ndarray or h5py.Dataset) : the destination, same shape as `src`
 
-        print(
-            datetime.now(),
-            "adjoint solve took: "
-            + str((datetime.now() - adj_start).total_seconds())
-            + f" for pm {self._name} at kperkstp {kk}",
+        """
+        for s in range(0, src.shape[0], _SPILL_CHUNK):
+            dst[s : s + _SPILL_CHUNK] = src[s : s + _SPILL_CHUNK]
+
+    @staticmethod
+    def _write_checkpoint(
+        adf, slot, lamb, composites, itime, sol_key, fwd_fingerprint, pm_fingerprint
+    ):
+        """private method to write an adjoint sweep checkpoint.  There are two
+        checkpoint slots that are overwritten in place and in turn, so that an
+        interruption while writing one leaves the other one valid
+
+        Parameters
+        ----------
+        adf (h5py.File) : the adjoint solution HDF5 filehandle
+        slot (int) : checkpoint slot (0 or 1)
+        lamb (ndarray) : the current adjoint state
+        composites (dict) : the composite accumulators
+        itime (int) : the index of the last completed timestep of the sweep
+        sol_key (str) : the last completed solution key
+        fwd_fingerprint (str) : the forward solution fingerprint
+        pm_fingerprint (str) : the performance measure fingerprint
+
+        """
+        name = f"checkpoint_{slot}"
+        if name not in adf:
+            grp = adf.create_group(name)
+            grp.create_dataset("lambda", lamb.shape, dtype=float)
+            for cname, comp in composites.items():
+                grp.create_dataset(cname, comp.shape, dtype=float)
+        grp = adf[name]
+        grp.attrs["complete"] = False
+        adf.flush()
+        grp["lambda"][:] = lamb
+        for cname, comp in composites.items():
+            PerfMeas._copy_array(comp, grp[cname])
+        grp.attrs["itime"] = itime
+        grp.attrs["sol_key"] = sol_key
+        grp.attrs["forward_fingerprint"] = fwd_fingerprint
+        grp.attrs["pm_fingerprint"] = pm_fingerprint
+        grp.attrs["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        grp.attrs["complete"] = True
+        adf.flush()
+
+    def _restore_checkpoint(
+        self, adf, lamb, composites, sweep_keys, fwd_fingerprint, pm_fingerprint
+    ):
+        """private method to restore the newest valid checkpoint from an adjoint
+        solution HDF5 file.  Results written after the checkpoint are removed.  If
+        there is no valid checkpoint, the file is cleared
+
+        Parameters
+        ----------
+        adf (h5py.File) : the adjoint solution HDF5 filehandle
+        lamb (ndarray) : the adjoint state, filled in place
+        composites (dict) : the composite accumulators, filled in place
+        sweep_keys (list) : the solution keys in sweep (reverse time) order
+        fwd_fingerprint (str) : the forward solution fingerprint
+        pm_fingerprint (str) : the performance measure fingerprint
+
+        Returns
+        -------
+        start_itime (int) : the index of the first timestep left to solve
+
+        """
+        best = None
+        for slot in range(2):
+            name = f"checkpoint_{slot}"
+            if name not in adf:
+                continue
+            attrs = adf[name].attrs
+            if not attrs.get("complete", False):
+                self.logger.warning(f"WARNING: incomplete checkpoint '{name}'")
+                continue
+            if attrs["forward_fingerprint"] != fwd_fingerprint:
+                self.logger.warning(
+                    f"WARNING: checkpoint '{name}' is for a different forward solution"
+                )
+                continue
+            if attrs["pm_fingerprint"] != pm_fingerprint:
+                self.logger.warning(
+                    f"WARNING: checkpoint '{name}' is for a different PerfMeas"
+                )
+                continue
+            if set(composites.keys()) - set(adf[name].keys()):
+                continue
+            if best is None or attrs["itime"] > adf[best].attrs["itime"]:
+                best = name
+        if best is None:
+            self.logger.warning(
+                f"WARNING: no valid checkpoint for PerfMeas {self._name}, "
+                + "starting the adjoint solve over"
+            )
+            for key in list(adf.keys()):
+                del adf[key]
+            return 0
+
+        grp = adf[best]
+        itime = int(grp.attrs["itime"])
+        lamb[:] = grp["lambda"][:]
+        for cname, comp in composites.items():
+            PerfMeas._copy_array(grp[cname], comp)
+        for sol_key in sweep_keys[itime + 1 :] + ["composite"]:
+            if sol_key in adf:
+                del adf[sol_key]
+        msg = (
+            f"resuming adjoint solve for PerfMeas {self._name} after "
+            + f"{grp.attrs['sol_key']} from {best}"
         )
-        self.logger.info(
-            "adjoint solve took: "
-            + str((datetime.now() - adj_start).total_seconds())
-            + f" for pm {self._name} at kperkstp {kk}"
+        self.logger.info(msg)
+        print(msg)
+        return itime + 1
+
+    @staticmethod
+    def _accumulate(composites, name, vals):
+        """private method to add `vals` to a composite accumulator that is either
+        an in-memory ndarray or a chunked on-disk h5py dataset
+
+        Parameters
+        ----------
+        composites (dict) : the composite accumulators
+        name (str) : the composite to add to
+        vals (ndarray) : the values to add
+
+        """
+        comp = composites[name]
+        if isinstance(comp, np.ndarray):
+            comp += vals
+            return
+        chunk_size = comp.chunks[0]
+        for s in range(0, comp.shape[0], chunk_size):
+            e = s + chunk_size
+            comp[s:e] = comp[s:e] + vals[s:e]
+
+    @staticmethod
+    def _get_solution_keys(hdf):
+        """private method to match the solution groups of a forward solution HDF5
+        file to the kper,kstp entries of its 'aux' group
+
+        Parameters
+        ----------
+        hdf (ForwardStore or h5py.File) : the forward solution HDF5 file
+
+        Returns
+        -------
+        sol_keys (list) : the sorted solution group names
+        kperkstp (list) : the zero-based (kper,kstp) tuples, in time order
+        kk_sol_map (dict) : solution group name, keyed by (kper,kstp)
+
+        """
+        sol_keys = [k for k in hdf.keys() if k.startswith("solution")]
+        sol_keys.sort()
+        if len(sol_keys) == 0:
+            raise Exception("no 'solution' keys found")
+        kperkstp = [
+            (kper, kstp) for kper, kstp in zip(hdf["aux"]["kper"], hdf["aux"]["kstp"])
+        ]
+        if len(kperkstp) != len(sol_keys):
+            raise Exception(
+                (
+                    f"number of solution datasets ({len(sol_keys)}) != number "
+                    + f"of kper,kstp entries ({len(kperkstp)})"
+                )
+            )
+        # one pass over the group attributes, the first group of a kper,kstp wins
+        sol_kk_map = {}
+        for s in sol_keys[::-1]:
+            attrs = hdf[s].attrs
+            sol_kk_map[(attrs["kper"], attrs["kstp"])] = s
+        kk_sol_map = {}
+        for kk in kperkstp:
+            sol = sol_kk_map.get(kk, None)
+            if sol is None:
+                raise Exception(f"no solution dataset found for kper,kstp:{kk!s}")
+            kk_sol_map[kk] = sol
+        return sol_keys, kperkstp, kk_sol_map
+
+    @staticmethod
+    def _composite_names(gwf_package_dict, has_sto):
+        """private method to get the composite sensitivity names, in summary
+        dataframe order
+
+        Parameters
+        ----------
+        gwf_package_dict (dict) : package names, keyed by package type
+        has_sto (bool) : flag for a storage package
+
+        Returns
+        -------
+        comp_names (list) : composite names
+
+        """
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+        comp_names = ["k11", "k33", "wel6_q", "rch6_recharge"]
+        for ptype, pnames in gwf_package_dict.items():
+            if ptype in bnd_dict:
+                for pname in pnames:
+                    for idx, aname in bnd_dict[ptype].items():
+                        comp_names.append(pname + "_" + aname)
+        if has_sto:
+            comp_names.append("ss")
+        return comp_names
+
+    @staticmethod
+    def _solver_signature(linear_solver, linear_solver_kwargs, use_precon):
+        """private method to form a string that identifies the linear solver options
+
+        Parameters
+        ----------
+        linear_solver (varies) : the linear solver option
+        linear_solver_kwargs (dict) : the linear solver kwargs
+        use_precon (bool) : the preconditioner flag
+
+        Returns
+        -------
+        signature (str) : the solver options signature
+
+        """
+        if callable(linear_solver):
+            linear_solver = getattr(linear_solver, "__name__", repr(linear_solver))
+        return repr(
+            (
+                linear_solver,
+                sorted((k, repr(v)) for k, v in linear_solver_kwargs.items()),
+                bool(use_precon),
+            )
         )
-        return df
+
+    @staticmethod
+    def _get_linear_solver(amat, linear_solver, linear_solver_kwargs, use_precon):
+        """private method to choose the linear solver for the (transposed) amat.
+        See `PerfMeas.solve_adjoint()` for the options
+
+        Parameters
+        ----------
+        amat (scipy.sparse matrix) : the matrix to solve with
+        linear_solver (varies) : the linear solver option
+        linear_solver_kwargs (dict) : the linear solver kwargs
+        use_precon (bool) : flag to use an ILU preconditioner with an iterative
+            solver
+
+        Returns
+        -------
+        _linear_solver (function) : the solver function
+        _linear_solver_kwargs (dict) : the solver kwargs
+
+        """
+        nnodes = amat.shape[0]
+        m = None
+        if linear_solver is None:
+            if nnodes < 50000:
+                _linear_solver = spsolve
+                _linear_solver_kwargs = {"use_umfpack": True}
+            else:
+                _linear_solver = bicgstab
+                _linear_solver_kwargs = {"rtol": 1e-5, "atol": 1e-5, "maxiter": 200}
+                if use_precon:
+                    amat_ilu = spilu(amat)
+                    m = LinearOperator((nnodes, nnodes), amat_ilu.solve)
+
+        elif isinstance(linear_solver, str):
+            if linear_solver == "direct":
+                _linear_solver = spsolve
+                if len(linear_solver_kwargs) == 0:
+                    _linear_solver_kwargs = {"use_umfpack": True}
+                else:
+                    _linear_solver_kwargs = dict(linear_solver_kwargs)
+            elif linear_solver == "bicgstab":
+                _linear_solver = bicgstab
+                if len(linear_solver_kwargs) == 0:
+                    _linear_solver_kwargs = {
+                        "rtol": 1e-5,
+                        "atol": 1e-5,
+                        "maxiter": 200,
+                    }
+                else:
+                    _linear_solver_kwargs = dict(linear_solver_kwargs)
+                if use_precon:
+                    amat_ilu = spilu(amat)
+                    m = LinearOperator((nnodes, nnodes), amat_ilu.solve)
+            else:
+                raise Exception(
+                    "unrecognized 'linear_solver' value: "
+                    + f"'{linear_solver}', "
+                    + "should be 'direct' or 'bicgstab'"
+                )
+        else:
+            _linear_solver = linear_solver
+            _linear_solver_kwargs = dict(linear_solver_kwargs)
+            if use_precon:
+                amat_ilu = spilu(amat)
+                m = LinearOperator((nnodes, nnodes), amat_ilu.solve)
+
+        # the kwargs are a copy, the caller's dict (and with it the cache key of
+        # the solver options) is left without the preconditioner
+        if m is not None:
+            _linear_solver_kwargs["M"] = m
+        return _linear_solver, _linear_solver_kwargs
 
     @staticmethod
     def write_group_to_hdf(
@@ -612,6 +2495,7 @@ class PerfMeas(object):
         grid_shape=None,
         nodeuser=None,
         nodereduced=None,
+        filters=None,
     ):
         """write a group in data to an open HDF5 file
 
@@ -623,6 +2507,38 @@ class PerfMeas(object):
         attr_dict (dict) : optional dict of attributes to write for the group
         nodeuser (ndarray) : optional `nodeuser` array from MODFLOW6
         nodereduced (ndarray) : optional `nodereduced` array from MODFLOW6
+        filters (Hdf5Filter) : optional compression filter and chunks of the
+            datasets.  Default is None (no filter)
+
+        """
+        grp = PerfMeas._create_group(hdf, group_name, attr_dict)
+        for tag, item in data_dict.items():
+            PerfMeas._write_dataset(
+                grp,
+                tag,
+                item,
+                grid_shape=grid_shape,
+                nodeuser=nodeuser,
+                nodereduced=nodereduced,
+                filters=filters,
+            )
+        PerfMeas._write_node_info(
+            grp, grid_shape=grid_shape, nodeuser=nodeuser, filters=filters
+        )
+
+    @staticmethod
+    def _create_group(hdf, group_name, attr_dict={}):
+        """private method to create a new group in an open HDF5 file
+
+        Parameters
+        ----------
+        hdf (h5py.File) : an open HDF5 filehandle
+        group_name (str) : the group name
+        attr_dict (dict) : optional dict of attributes to write for the group
+
+        Returns
+        -------
+        grp (h5py.Group) : the new group
 
         """
         if group_name in hdf:
@@ -630,51 +2546,102 @@ class PerfMeas(object):
         grp = hdf.create_group(group_name)
         for name, val in attr_dict.items():
             grp.attrs[name] = val
-        kijs = None
-        if grid_shape is not None and nodeuser is not None:
-            kijs = PerfMeas.get_lrc(grid_shape, list(nodeuser))
-        for tag, item in data_dict.items():
-            if isinstance(item, list):
-                item = np.array(item)
-            if isinstance(item, np.ndarray):
-                if grid_shape is not None and nodeuser is not None:
-                    if len(item) == len(nodeuser):  # 3D
-                        arr = np.zeros(grid_shape, dtype=item.dtype)
-                        for kij, v in zip(kijs, item):
-                            arr[kij] = v
-
-                        _ = grp.create_dataset(
-                            tag, grid_shape, dtype=item.dtype, data=arr
-                        )
-                    else:
-                        raise Exception("doh! " + str(tag))
-                elif nodeuser is not None and nodereduced is not None:
-                    arr = np.zeros_like(nodereduced, dtype=item.dtype)
-                    for inode, v in zip(nodeuser, item):
-                        arr[inode] = v
-                    _ = grp.create_dataset(tag, arr.shape, dtype=item.dtype, data=arr)
-                else:
-                    _ = grp.create_dataset(tag, item.shape, dtype=item.dtype, data=item)
-            elif isinstance(item, dict):
-                subgrp = grp.create_group(tag)
-                for k, v in item.items():
-                    if isinstance(v, np.ndarray):
-                        _ = subgrp.create_dataset(k, v.shape, dtype=v.dtype, data=v)
-                    else:
-                        subgrp.attrs[k] = v
+        return grp
+
+    @staticmethod
+    def _write_dataset(
+        grp, tag, item, grid_shape=None, nodeuser=None, nodereduced=None, filters=None
+    ):
+        """private method to write one item to an open HDF5 group.  Node-based
+        arrays are scattered to the full grid (structured) or to `nodereduced`
+        when that information is passed.
+
+        Parameters
+        ----------
+        grp (h5py.Group) : an open HDF5 group
+        tag (str) : the dataset name
+        item (varies) : the ndarray, list or dict to write
+        grid_shape (tuple) : optional structured grid shape
+        nodeuser (ndarray) : optional `nodeuser` array from MODFLOW6
+        nodereduced (ndarray) : optional `nodereduced` array from MODFLOW6
+        filters (Hdf5Filter) : optional compression filter and chunks
 
+        """
+
+        def kwargs(dclass, shape):
+            return {} if filters is None else filters.kwargs(dclass, shape)
+
+        if isinstance(item, list):
+            item = np.array(item)
+        if isinstance(item, np.ndarray):
+            if grid_shape is not None and nodeuser is not None:
+                if len(item) == len(nodeuser):  # 3D
+                    arr = np.zeros(grid_shape, dtype=item.dtype)
+                    arr.reshape(-1)[nodeuser] = item
+                    _ = grp.create_dataset(
+                        tag,
+                        grid_shape,
+                        dtype=item.dtype,
+                        data=arr,
+                        **kwargs("node", grid_shape),
+                    )
+                else:
+                    raise Exception("doh! " + str(tag))
+            elif nodeuser is not None and nodereduced is not None:
+                arr = np.zeros_like(nodereduced, dtype=item.dtype)
+                n = min(len(nodeuser), len(item))
+                arr[nodeuser[:n]] = item[:n]
+                _ = grp.create_dataset(
+                    tag,
+                    arr.shape,
+                    dtype=item.dtype,
+                    data=arr,
+                    **kwargs("node", arr.shape),
+                )
             else:
-                raise Exception(
-                    f"unrecognized data_dict entry: {tag},type:{type(item)}"
+                _ = grp.create_dataset(
+                    tag,
+                    item.shape,
+                    dtype=item.dtype,
+                    data=item,
+                    **kwargs("node", item.shape),
                 )
+        elif isinstance(item, dict):
+            subgrp = grp.create_group(tag)
+            for k, v in item.items():
+                if isinstance(v, np.ndarray):
+                    _ = subgrp.create_dataset(
+                        k, v.shape, dtype=v.dtype, data=v, **kwargs("package", v.shape)
+                    )
+                else:
+                    subgrp.attrs[k] = v
+
+        else:
+            raise Exception(f"unrecognized data_dict entry: {tag},type:{type(item)}")
+
+    @staticmethod
+    def _write_node_info(grp, grid_shape=None, nodeuser=None, filters=None):
+        """private method to write the node number (and layer-row-column for
+        structured grids) datasets to an open HDF5 group
+
+        Parameters
+        ----------
+        grp (h5py.Group) : an open HDF5 group
+        grid_shape (tuple) : optional structured grid shape
+        nodeuser (ndarray) : optional `nodeuser` array from MODFLOW6
+        filters (Hdf5Filter) : optional compression filter and chunks
+
+        """
+        arrs = {}
         if nodeuser is not None:
-            _ = grp.create_dataset(
-                "nodeuser", nodeuser.shape, dtype=nodeuser.dtype, data=nodeuser
-            )
-        if kijs is not None:
+            arrs["nodeuser"] = nodeuser
+        if grid_shape is not None and nodeuser is not None:
+            kijs = np.unravel_index(nodeuser, grid_shape)
             for idx, name in enumerate(["k", "i", "j"]):
-                arr = np.array([kij[idx] for kij in kijs], dtype=int)
-                _ = grp.create_dataset(name, arr.shape, dtype=arr.dtype, data=arr)
+                arrs[name] = kijs[idx].astype(int)
+        for name, arr in arrs.items():
+            kwargs = {} if filters is None else filters.kwargs("node", arr.shape)
+            _ = grp.create_dataset(name, arr.shape, dtype=arr.dtype, data=arr, **kwargs)
 
     @staticmethod
     def _dconddhk(k1, k2, cl1, cl2, width, height1, height2):
@@ -844,6 +2811,56 @@ class PerfMeas(object):
         -------
         result_k, result_k33 (ndarray) : the adjoint state times the partial of
                                          residual with respect to k and k33 times head
+        """
+        op_k, op_k33 = PerfMeas._dresdk_h_operators(
+            is_newton,
+            sat,
+            head,
+            ihc,
+            ia,
+            ja,
+            jas,
+            cl1,
+            cl2,
+            hwva,
+            top,
+            bot,
+            icelltype,
+            k11,
+            k33,
+        )
+        return op_k @ lamb, op_k33 @ lamb
+
+    @staticmethod
+    def _dresdk_h_operators(
+        is_newton,
+        sat,
+        head,
+        ihc,
+        ia,
+        ja,
+        jas,
+        cl1,
+        cl2,
+        hwva,
+        top,
+        bot,
+        icelltype,
+        k11,
+        k33,
+    ):
+        """private method to form the sparse operators that map an adjoint state
+        to lam_dresdk_h(), which is linear in the adjoint state.  This way the
+        connection loop is only done once for any number of adjoint states
+
+        Parameters
+        ----------
+        see lam_dresdk_h()
+
+        Returns
+        -------
+        op_k, op_k33 (scipy.sparse.csr_matrix) : the operators for k and k33
+
         """
         iac = np.array([ia[i + 1] - ia[i] for i in range(len(ia) - 1)])
         # array of number of connections per node (size nodes)
@@ -853,15 +2870,16 @@ class PerfMeas(object):
 
         height = top - bot
 
-        result33 = np.zeros_like(head)
-        result = np.zeros_like(head)
+        # the coefficient of (lamb[node] - lamb[mnode]) for each connection
+        coef33 = np.zeros(ja.shape[0])
+        coef = np.zeros(ja.shape[0])
+        rows = np.zeros(ja.shape[0], dtype=int)
 
         for node, (offset, ncon) in enumerate(zip(ia, iac)):
-            sum1 = 0.0
-            sum2 = 0.0
             height1 = height[node]
 
             for ii in range(offset + 1, offset + ncon):
+                rows[ii] = node
                 mnode = ja[ii]
                 height2 = height[mnode]
 
@@ -880,12 +2898,7 @@ class PerfMeas(object):
                         1.0,
                         1.0,
                     )
-                    t2 = (
-                        dconddk33
-                        * (head[mnode] - head[node])
-                        * (lamb[node] - lamb[mnode])
-                    )
-                    sum1 += t2
+                    coef33[ii] = dconddk33 * (head[mnode] - head[node])
 
                 else:
                     if is_newton:
@@ -914,21 +2927,29 @@ class PerfMeas(object):
                         )
                         SF = 1.0
 
-                    t1 = (
-                        SF
-                        * dconddk
-                        * (head[mnode] - head[node])
-                        * (lamb[node] - lamb[mnode])
-                    )
-                    sum2 += t1
+                    coef[ii] = SF * dconddk * (head[mnode] - head[node])
 
-            result33[node] = sum1
-            result[node] = sum2
-        return result, result33
+        nnodes = head.shape[0]
+        # the diagonal entries of ja are skipped, their coefficients are zero
+        op_rows = np.concatenate([rows, rows])
+        op_cols = np.concatenate([rows, ja])
+        op_k = sparse.csr_matrix(
+            (np.concatenate([coef, -coef]), (op_rows, op_cols)),
+            shape=(nnodes, nnodes),
+        )
+        op_k33 = sparse.csr_matrix(
+            (np.concatenate([coef33, -coef33]), (op_rows, op_cols)),
+            shape=(nnodes, nnodes),
+        )
+        return op_k, op_k33
 
-    def lam_drhs_dbnd(self, lamb, head, sp_dict, has_flux_pm):
-        result_head = np.zeros_like(lamb)
-        result_cond = np.zeros_like(lamb)
+    def lam_drhs_dbnd(
+        self, lamb, head, sp_dict, has_flux_pm, result_head=None, result_cond=None
+    ):
+        if result_head is None:
+            result_head = np.zeros_like(lamb)
+        if result_cond is None:
+            result_cond = np.zeros_like(lamb)
 
         # for id in sp_dict:
         for node, bound in zip(sp_dict["node"], sp_dict["bound"]):
@@ -951,6 +2972,41 @@ class PerfMeas(object):
 
         return result_head, result_cond
 
+    def _lam_drhs_dbnd_chunked(self, lamb, head, bnd_grp, has_flux_pm, chunk_size):
+        """private method to evaluate lam_drhs_dbnd() for a boundary package
+        while reading its 'nodelist' and 'bound' datasets in chunks
+
+        Parameters
+        ----------
+        lamb (ndarray) : adjoint state array
+        head (ndarray) : head array
+        bnd_grp (h5py.Group) : the forward solution group of the boundary package
+        has_flux_pm (bool) : flag for a flux-type performance measure
+        chunk_size (int) : number of boundary entries to read at a time
+
+        Returns
+        -------
+        result_head, result_cond (ndarray) : see lam_drhs_dbnd()
+
+        """
+        result_head = np.zeros_like(lamb)
+        result_cond = np.zeros_like(lamb)
+        nbound = bnd_grp["nodelist"].shape[0]
+        for s in range(0, nbound, chunk_size):
+            sp_bnd_dict = {
+                "bound": bnd_grp["bound"][s : s + chunk_size],
+                "node": bnd_grp["nodelist"][s : s + chunk_size],
+            }
+            self.lam_drhs_dbnd(
+                lamb,
+                head,
+                sp_bnd_dict,
+                has_flux_pm,
+                result_head=result_head,
+                result_cond=result_cond,
+            )
+        return result_head, result_cond
+
     def _dfdh(self, kk, sol_dataset):
         """partial of the performance measure with respect to head
 
@@ -966,20 +3022,38 @@ class PerfMeas(object):
         """
         head = sol_dataset["head"][:]
         dfdh = np.zeros_like(head)
-        for pfr in self._entries:
-            if pfr.kperkstp == kk:
-                if pfr.pm_type == "head":
-                    if pfr.pm_form == "direct":
-                        dfdh[pfr.inode] = pfr.weight
-                    elif pfr.pm_form == "residual":
-                        dfdh[pfr.inode] = (
-                            2.0 * pfr.weight * (head[pfr.inode] - pfr.obsval)
-                        )
-                else:
-                    hcof = sol_dataset[pfr.pm_type]["hcof"][:]
-                    inodelist = sol_dataset[pfr.pm_type]["nodelist"][:] - 1
-                    idx = np.where(inodelist == pfr.inode)[0][0]
-                    dfdh[pfr.inode] = hcof[idx]
+        entries = self._entries
+        rows = entries.rows(kk)
+        if rows.shape[0] == 0:
+            return dfdh
+        inode = entries.inode[rows]
+        weight = entries.weight[rows]
+        vals = np.where(
+            entries.residual[rows],
+            2.0 * weight * (head[inode] - entries.obsval[rows]),
+            weight,
+        )
+        codes = entries.type_code[rows]
+        for code in np.unique(codes):
+            pm_type = entries.pm_types[code]
+            if pm_type == "head":
+                continue
+            # the hcof of the first package entry at each node
+            sel = codes == code
+            hcof = sol_dataset[pm_type]["hcof"][:]
+            inodelist = sol_dataset[pm_type]["nodelist"][:] - 1
+            unodes, first = np.unique(inodelist, return_index=True)
+            pos = np.minimum(np.searchsorted(unodes, inode[sel]), unodes.shape[0] - 1)
+            missing = unodes[pos] != inode[sel]
+            if missing.any():
+                raise Exception(
+                    f"node {inode[sel][missing][0]} of PerfMeas {self._name} is not "
+                    + f"in package '{pm_type}' at kper,kstp {kk!s}"
+                )
+            vals[sel] = hcof[first[pos]]
+        # the last entry at a node wins
+        unodes, last = np.unique(inode[::-1], return_index=True)
+        dfdh[unodes] = vals[::-1][last]
         return dfdh
 
     @staticmethod
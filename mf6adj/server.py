@@ -0,0 +1,331 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .tangent import TangentLinear
+
+# the stream buffer limit, responses with dense results are long lines
+_LINE_LIMIT = 2**30
+
+
+def _to_json(obj):
+    """private function to convert numpy types for json"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"type {type(obj)!s} is not json serializable")
+
+
+class AdjointServer(object):
+    """A long-lived local server that keeps an `Mf6Adj` instance, with the loaded
+    MODFLOW6 library, the parsed performance measures and the tangent linear
+    factorization cache, resident between requests.  The protocol is JSON lines:
+    each request is one line {"id": ..., "method": ..., "params": {...}} and each
+    response is one line {"id": ..., "result": ...} or {"id": ..., "error": ...}.
+    Requests are handled one at a time, in a worker thread so the event loop
+    stays responsive.  See `AdjointClient`.
+
+    Methods:
+
+        ping: returns "pong"
+        solve_gwf: params 'hdf5_name' (optional).  Returns the forward HDF5 name
+        solve_adjoint: params as `Mf6Adj.solve_adjoint()` (the linear solver as a
+            str), plus 'return_data' to include the summaries.  Returns the
+            summary and adjoint solution filenames of each performance measure.
+            Each request factors AMAT again for every performance measure and
+            time step, the resident factorizations are only those of
+            'solve_tangent'.  Use 'cache_dir' to skip repeated solves
+        solve_tangent: params 'directions', see `Mf6Adj.solve_tangent()`.  Uses a
+            resident `TangentLinear` whose factorizations are kept until the next
+            forward solve.  Returns the head derivatives of each direction
+        set_parameters: params as `Mf6Adj.gradient_service()`.  Returns the
+            parameter names and initial values
+        value, grad, value_and_grad: params 'x', the parameter vector.  See
+            `GradientService`
+        shutdown: stop the server
+
+    Parameters
+    ----------
+    adj (Mf6Adj) : the adjoint instance to keep resident
+    host (str) : the host to listen on.  Default is "127.0.0.1"
+    port (int) : the port to listen on.  Default is 0 (any free port, see `port`
+        after `start()`)
+    path (str) : optional unix socket path to listen on instead of `host` and
+        `port`
+
+    """
+
+    def __init__(self, adj, host="127.0.0.1", port=0, path=None):
+        self.adj = adj
+        self.host = host
+        self.port = int(port)
+        self.path = path
+        self.logger = logging.getLogger(logging.__name__ + ".AdjointServer")
+        self._server = None
+        self._stopped = None
+        self._lock = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._tl = None
+        self._svc = None
+        self._has_run = adj._hdf5_name is not None
+        self._methods = {
+            "ping": self._ping,
+            "solve_gwf": self._solve_gwf,
+            "solve_adjoint": self._solve_adjoint,
+            "solve_tangent": self._solve_tangent,
+            "set_parameters": self._set_parameters,
+            "value": self._value,
+            "grad": self._grad,
+            "value_and_grad": self._value_and_grad,
+        }
+
+    async def start(self):
+        """start listening.  The server then runs until a 'shutdown' request or
+        `stop()`, see `wait_closed()`"""
+        self._stopped = asyncio.Event()
+        self._lock = asyncio.Lock()
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self.path, limit=_LINE_LIMIT
+            )
+            self.logger.info(f"adjoint server listening on '{self.path}'")
+        else:
+            self._server = await asyncio.start_server(
+                self._handle, host=self.host, port=self.port, limit=_LINE_LIMIT
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            self.logger.info(f"adjoint server listening on {self.host}:{self.port}")
+
+    async def wait_closed(self):
+        """wait for the server to stop"""
+        await self._stopped.wait()
+        self._server.close()
+        await self._server.wait_closed()
+        self._close()
+
+    def stop(self):
+        """stop the server"""
+        if self._stopped is not None:
+            self._stopped.set()
+
+    def serve_forever(self):
+        """start the server and block until it is shut down"""
+
+        async def _serve():
+            await self.start()
+            await self.wait_closed()
+
+        asyncio.run(_serve())
+
+    def _close(self):
+        if self._tl is not None:
+            self._tl.close()
+            self._tl = None
+        if self._svc is not None:
+            self._svc.close()
+            self._svc = None
+        self._executor.shutdown(wait=False)
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def _handle(self, reader, writer):
+        """private method to serve the requests of a connection"""
+        try:
+            while not self._stopped.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._dispatch(line)
+                writer.write((json.dumps(response, default=_to_json) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _dispatch(self, line):
+        """private method to run one request
+
+        Parameters
+        ----------
+        line (bytes) : the json request
+
+        Returns
+        -------
+        response (dict) : the response
+
+        """
+        rid = None
+        try:
+            request = json.loads(line)
+            rid = request.get("id", None)
+            method = request["method"]
+            params = request.get("params", {}) or {}
+            if method == "shutdown":
+                self.stop()
+                return {"id": rid, "result": "shutting down"}
+            if method not in self._methods:
+                raise Exception(
+                    f"unknown method '{method}', should be one of "
+                    + f"{[*self._methods.keys(), 'shutdown']!s}"
+                )
+            async with self._lock:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self._executor, self._methods[method], params
+                )
+            return {"id": rid, "result": result}
+        except Exception as e:
+            self.logger.warning(f"WARNING: request {rid!s} failed: {e!s}")
+            return {"id": rid, "error": f"{e!s}"}
+
+    def _ping(self, params):
+        return "pong"
+
+    def _solve_gwf(self, params):
+        adj = self.adj
+        if self._has_run:
+            adj._gwf = adj._initialize_gwf(adj._lib_name, adj._flow_dir)
+        self._has_run = True
+        if self._tl is not None:
+            self._tl.close()
+            self._tl = None
+        adj.solve_gwf(verbose=False, hdf5_name=params.get("hdf5_name", None))
+        return {"hdf5_name": adj._hdf5_name}
+
+    def _solve_adjoint(self, params):
+        params = dict(params)
+        return_data = bool(params.pop("return_data", False))
+        if "projection" in params and params["projection"] is not None:
+            params["projection"] = {
+                name: np.array(zones) for name, zones in params["projection"].items()
+            }
+        dfs = self.adj.solve_adjoint(**params)
+        result = {}
+        for pm in self.adj._performance_measures:
+            result[pm.name] = {
+                "summary": f"adjoint_summary_{pm.name}.csv",
+                "adjoint_solution": pm.adjoint_solution_fname(self.adj._hdf5_name),
+            }
+            if return_data:
+                df = dfs[pm.name]
+                if isinstance(df, tuple):
+                    df = df[0]
+                result[pm.name]["data"] = df.to_dict(orient="list")
+        return result
+
+    def _solve_tangent(self, params):
+        adj = self.adj
+        if adj._hdf5_name is None or not os.path.exists(adj._hdf5_name):
+            raise Exception("need to call solve_gwf first")
+        if self._tl is None or self._tl.hdf5_forward_solution_fname != adj._hdf5_name:
+            if self._tl is not None:
+                self._tl.close()
+            self._tl = TangentLinear(adj._hdf5_name)
+        results = self._tl.solve(params["directions"], flows=False)
+        return {name: result["head"] for name, result in results.items()}
+
+    def _set_parameters(self, params):
+        if self._svc is not None:
+            self._svc.close()
+        self._has_run = True
+        self._svc = self.adj.gradient_service(**params)
+        return {"par_names": self._svc.par_names, "x0": self._svc.x0}
+
+    def _check_svc(self):
+        if self._svc is None:
+            raise Exception("need to call set_parameters first")
+        return self._svc
+
+    def _value(self, params):
+        return self._check_svc().value(np.array(params["x"], dtype=float))
+
+    def _grad(self, params):
+        return self._check_svc().grad(np.array(params["x"], dtype=float))
+
+    def _value_and_grad(self, params):
+        value, grad = self._check_svc().value_and_grad(
+            np.array(params["x"], dtype=float)
+        )
+        return {"value": value, "grad": grad}
+
+
+class AdjointClient(object):
+    """An asyncio client of `AdjointServer`
+
+    Parameters
+    ----------
+    host (str) : the server host.  Default is "127.0.0.1"
+    port (int) : the server port
+    path (str) : optional unix socket path of the server, instead of `host` and
+        `port`
+
+    """
+
+    def __init__(self, host="127.0.0.1", port=None, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._id = 0
+
+    async def connect(self):
+        """connect to the server"""
+        if self.path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                self.path, limit=_LINE_LIMIT
+            )
+        else:
+            if self.port is None:
+                raise Exception("'port' or 'path' is needed")
+            self._reader, self._writer = await asyncio.open_connection(
+                self.host, self.port, limit=_LINE_LIMIT
+            )
+
+    async def close(self):
+        """close the connection"""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+            self._reader = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def request(self, method, **params):
+        """send a request and wait for the response
+
+        Parameters
+        ----------
+        method (str) : the method name, see `AdjointServer`
+        **params : the method params
+
+        Returns
+        -------
+        result (varies) : the result of the method
+
+        """
+        if self._writer is None:
+            await self.connect()
+        self._id += 1
+        request = {"id": self._id, "method": method, "params": params}
+        self._writer.write((json.dumps(request, default=_to_json) + "\n").encode())
+        await self._writer.drain()
+        line = await self._reader.readline()
+        if not line:
+            raise Exception("connection closed by the server")
+        response = json.loads(line)
+        if "error" in response:
+            raise Exception(f"server error for '{method}': {response['error']}")
+        return response["result"]
@@ -0,0 +1,1473 @@
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+
+import h5py
+import numpy as np
+import pandas as pd
+
+
+class Hdf5Filter(object):
+    """The compression filter and chunk shapes of the datasets written to the
+    forward and adjoint solution HDF5 files.  Readers need no settings, HDF5
+    stores the filter with each dataset.
+
+    Datasets fall in four classes: "amat" (AMAT and its keyframe changes),
+    "node" (the other solution and adjoint result arrays), "package" (the
+    boundary package arrays) and "time", which only applies to the "stacked"
+    layout of `GroupWriter`, where it is the number of time steps (rows) per
+    chunk.  The chunk of a class is either a number of values, taken along the
+    first axis with the other axes whole, or a shape, cut to the dataset shape.
+    Classes without a chunk get HDF5's own chunk shape if there is a filter and
+    are stored contiguous (the default) if there is not.
+
+    Parameters
+    ----------
+    spec (str) : the filter: "none", "gzip", "lzf" or "shuffle+gzip" (or
+        "shuffle+lzf").  Default is "none"
+    level (int) : the gzip compression level, 0 to 9.  Default is 4
+    chunks (dict) : optional chunks, keyed by dataset class.  Default is None
+
+    """
+
+    _classes = ["amat", "node", "package", "time"]
+    _compressions = ["none", "gzip", "lzf"]
+
+    def __init__(self, spec: str = "none", level: int = 4, chunks: dict | None = None):
+        parts = [part.strip() for part in str(spec).lower().split("+")]
+        self.shuffle = parts[0] == "shuffle" and len(parts) == 2
+        compression = parts[-1]
+        if len(parts) > 2 or (len(parts) == 2 and not self.shuffle):
+            compression = None
+        if compression not in Hdf5Filter._compressions:
+            raise Exception(
+                f"unrecognized hdf5 filter '{spec}', should be 'none', 'gzip', "
+                + "'lzf', 'shuffle+gzip' or 'shuffle+lzf'"
+            )
+        self.compression = None if compression == "none" else compression
+        self.level = int(level)
+        if self.compression == "gzip" and not 0 <= self.level <= 9:
+            raise Exception(f"gzip level {self.level} not in 0 to 9")
+        self.chunks = {}
+        for dclass, chunk in ({} if chunks is None else chunks).items():
+            self.set_chunks(dclass, chunk)
+
+    @staticmethod
+    def create(hdf5_filter=None, hdf5_chunks: dict | None = None):
+        """get the `Hdf5Filter` of a keyword argument
+
+        Parameters
+        ----------
+        hdf5_filter (str or Hdf5Filter) : the filter spec (see `Hdf5Filter`), the
+            filter itself or None (no filter)
+        hdf5_chunks (dict) : optional chunks, keyed by dataset class, that replace
+            those of `hdf5_filter`.  Default is None
+
+        Returns
+        -------
+        filters (Hdf5Filter) : a new filter
+
+        """
+        if isinstance(hdf5_filter, Hdf5Filter):
+            filters = Hdf5Filter(
+                hdf5_filter.spec, hdf5_filter.level, hdf5_filter.chunks
+            )
+        else:
+            filters = Hdf5Filter("none" if hdf5_filter is None else hdf5_filter)
+        for dclass, chunk in ({} if hdf5_chunks is None else hdf5_chunks).items():
+            filters.set_chunks(dclass, chunk)
+        return filters
+
+    @property
+    def spec(self):
+        spec = "none" if self.compression is None else self.compression
+        return "shuffle+" + spec if self.shuffle else spec
+
+    def __str__(self):
+        spec = self.spec
+        if self.compression == "gzip":
+            spec += f" {self.level}"
+        for dclass, chunk in self.chunks.items():
+            spec += f", {dclass} chunks {chunk!s}"
+        return spec
+
+    def set_chunks(self, dclass: str, chunk):
+        """set the chunks of a dataset class
+
+        Parameters
+        ----------
+        dclass (str) : the dataset class, see `Hdf5Filter`
+        chunk (int or tuple) : the number of values or the shape of a chunk.  If
+            None, the chunks of the class are unset
+
+        """
+        dclass = dclass.lower()
+        if dclass not in Hdf5Filter._classes:
+            raise Exception(
+                f"unrecognized dataset class '{dclass}', should be one of "
+                + f"{Hdf5Filter._classes!s}"
+            )
+        if chunk is None:
+            self.chunks.pop(dclass, None)
+            return
+        chunk = tuple(int(c) for c in np.atleast_1d(chunk))
+        if len(chunk) == 0 or min(chunk) < 1 or (dclass == "time" and len(chunk) > 1):
+            raise Exception(f"invalid chunks {chunk!s} for dataset class '{dclass}'")
+        self.chunks[dclass] = chunk[0] if len(chunk) == 1 else chunk
+
+    def parse_option(self, line: str):
+        """apply a line of the `.adj` options block: "hdf5_filter <filter>
+        [<gzip level>]" or "hdf5_chunks <dataset class> <chunk> [<chunk> ...]"
+
+        Parameters
+        ----------
+        line (str) : the options line
+
+        """
+        raw = line.strip().split()
+        if raw[0].lower() == "hdf5_filter" and len(raw) in [2, 3]:
+            level = self.level if len(raw) == 2 else int(raw[2])
+            new = Hdf5Filter(raw[1], level=level, chunks=self.chunks)
+            self.shuffle, self.compression, self.level = (
+                new.shuffle,
+                new.compression,
+                new.level,
+            )
+        elif raw[0].lower() == "hdf5_chunks" and len(raw) > 2:
+            self.set_chunks(raw[1], [int(c) for c in raw[2:]])
+        else:
+            raise Exception(f"invalid hdf5 option line: {line.strip()}")
+
+    def chunk_shape(self, dclass: str, shape):
+        """get the chunk shape of a dataset
+
+        Parameters
+        ----------
+        dclass (str) : the dataset class, see `Hdf5Filter`
+        shape (tuple) : the dataset shape.  A None first axis is unlimited
+
+        Returns
+        -------
+        chunks (tuple) : the chunk shape, None if the class has no chunks
+
+        """
+        chunk = self.chunks.get(dclass, None)
+        if chunk is None or len(shape) == 0:
+            return None
+        full = [n if n is not None else np.inf for n in shape]
+        if isinstance(chunk, tuple):
+            if len(chunk) != len(shape):
+                raise Exception(
+                    f"chunks {chunk!s} of dataset class '{dclass}' don't fit a "
+                    + f"dataset of shape {shape!s}"
+                )
+            return tuple(int(max(1, min(c, n))) for c, n in zip(chunk, full))
+        rest = int(np.prod(shape[1:], dtype=np.int64))
+        first = max(1, min(full[0], chunk // max(1, rest)))
+        return (int(first), *(max(1, n) for n in shape[1:]))
+
+    def kwargs(self, dclass: str, shape):
+        """get the `create_dataset()` keyword arguments of a dataset
+
+        Parameters
+        ----------
+        dclass (str) : the dataset class, see `Hdf5Filter`
+        shape (tuple) : the dataset shape
+
+        Returns
+        -------
+        kwargs (dict) : the 'compression', 'compression_opts', 'shuffle' and
+            'chunks' arguments.  Empty for empty and scalar datasets, which can't
+            be chunked
+
+        """
+        if len(shape) == 0 or 0 in shape:
+            return {}
+        kwargs = self.filter_kwargs()
+        chunks = self.chunk_shape(dclass, shape)
+        if chunks is not None:
+            kwargs["chunks"] = chunks
+        return kwargs
+
+    def filter_kwargs(self):
+        """get the filter keyword arguments of `create_dataset()`
+
+        Returns
+        -------
+        kwargs (dict) : the 'compression', 'compression_opts' and 'shuffle'
+            arguments
+
+        """
+        kwargs = {}
+        if self.compression is not None:
+            kwargs["compression"] = self.compression
+            if self.compression == "gzip":
+                kwargs["compression_opts"] = self.level
+        if self.shuffle:
+            kwargs["shuffle"] = True
+        return kwargs
+
+    @staticmethod
+    def benchmark(
+        hdf5_forward_solution_fname: str,
+        filters: list | None = None,
+        sol_key: str | None = None,
+        nrepeat: int = 3,
+    ):
+        """write and read back one time step of a forward solution with
+        different filters, to pick the settings for a model
+
+        Parameters
+        ----------
+        hdf5_forward_solution_fname (str) : the forward solution HDF5 file
+        filters (list) : the filters to compare, as `Hdf5Filter` or filter specs.
+            If None, "none", "lzf", "gzip" and "shuffle+gzip" (level 4) are
+            compared
+        sol_key (str) : the solution group of the time step.  If None, the middle
+            time step is used
+        nrepeat (int) : the number of writes and reads of each filter, the
+            fastest is reported.  Default is 3
+
+        Returns
+        -------
+        df (DataFrame) : for each filter, the bytes of the arrays ('nbytes'), of
+            the file ('file_bytes') and their ratio, and the write and read-back
+            throughput of the arrays, in MB per second
+
+        """
+        if filters is None:
+            filters = ["none", "lzf", "gzip", "shuffle+gzip"]
+        filters = [Hdf5Filter.create(f) for f in filters]
+        with ForwardStore(hdf5_forward_solution_fname) as store:
+            sol_keys = store.solution_keys()
+            if len(sol_keys) == 0:
+                raise Exception(f"no solution groups in {hdf5_forward_solution_fname}")
+            if sol_key is None:
+                sol_key = sol_keys[len(sol_keys) // 2]
+            data_dict, attr_dict = store.read_group(sol_key)
+        nbytes = sum(
+            val.nbytes
+            for item in data_dict.values()
+            for val in (item.values() if isinstance(item, dict) else [item])
+            if isinstance(val, np.ndarray)
+        )
+
+        def read(obj):
+            for item in obj.values():
+                if isinstance(item, h5py.Dataset):
+                    _ = item[()]
+                else:
+                    read(item)
+
+        rows = []
+        tmp_dir = tempfile.mkdtemp(prefix="mf6adj_benchmark_")
+        fname = os.path.join(tmp_dir, "benchmark.hd5")
+        try:
+            for filt in filters:
+                write_time, read_time = np.inf, np.inf
+                for _ in range(max(1, int(nrepeat))):
+                    start = time.perf_counter()
+                    with h5py.File(fname, "w") as hdf:
+                        writer = GroupWriter(hdf, dedup=False, filters=filt)
+                        writer.write(sol_key, data_dict, attr_dict)
+                        writer.close()
+                    write_time = min(write_time, time.perf_counter() - start)
+                    file_bytes = os.path.getsize(fname)
+                    start = time.perf_counter()
+                    with h5py.File(fname, "r") as hdf:
+                        read(hdf)
+                    read_time = min(read_time, time.perf_counter() - start)
+                rows.append(
+                    {
+                        "filter": str(filt),
+                        "nbytes": nbytes,
+                        "file_bytes": file_bytes,
+                        "ratio": nbytes / file_bytes,
+                        "write_mb_per_sec": nbytes / 1.0e6 / write_time,
+                        "read_mb_per_sec": nbytes / 1.0e6 / read_time,
+                    }
+                )
+        finally:
+            if os.path.exists(fname):
+                os.remove(fname)
+            os.rmdir(tmp_dir)
+        return pd.DataFrame(rows).set_index("filter")
+
+
+class Quantizer(object):
+    """Error-bounded lossy encoding of floating point arrays, for the bulky
+    forward solution arrays of screening studies.  With an absolute bound, the
+    values are rounded to a grid of spacing 2 x `bound`; with a relative bound,
+    the mantissas are rounded to the fewest bits that keep the relative error
+    within `bound` (the sign goes to the lowest bit).  The integers are stored
+    relative to their minimum with the fewest bytes that hold them and split
+    into byte planes (all the first bytes, then all the second bytes, ...), so
+    the bytes that hardly change end up together for the HDF5 compression
+    filter.  Values that can't be encoded within the bound (infinite, NaN or
+    out of range) are kept exactly, as outliers.
+
+    Parameters
+    ----------
+    mode (str) : "abs" (absolute) or "rel" (relative) error bound
+    bound (float) : the error bound, greater than zero (at least 2**-42 for a
+        relative bound)
+
+    """
+
+    _modes = ["abs", "rel"]
+    # the names of the encoded parts, see `encode()`
+    _parts = ["q", "qmeta", "qindex", "qvalue"]
+
+    def __init__(self, mode: str, bound: float):
+        mode = str(mode).lower()
+        if mode not in Quantizer._modes:
+            raise Exception(
+                f"unrecognized error bound mode '{mode}', should be 'abs' or 'rel'"
+            )
+        bound = float(bound)
+        if not bound > 0.0 or not np.isfinite(bound):
+            raise Exception(f"error bound should be greater than zero, not {bound}")
+        if mode == "rel" and bound < 2.0**-42:
+            raise Exception(
+                f"relative error bound {bound:g} too small, should be at least "
+                + f"{2.0**-42:g}"
+            )
+        self.mode = mode
+        self.bound = bound
+
+    def __str__(self):
+        return f"{self.mode} {self.bound:g}"
+
+    def encode(self, arr):
+        """encode an array
+
+        Parameters
+        ----------
+        arr (ndarray) : the values, cast to float64
+
+        Returns
+        -------
+        parts (dict) : the byte planes ('q', uint8), the metadata ('qmeta': mode
+            code, bound, grid spacing or mantissa shift, integer offset, number of
+            bytes per value and number of values), and the flat index and exact
+            value of the outliers ('qindex' and 'qvalue')
+
+        """
+        x = np.asarray(arr, dtype=np.float64).reshape(-1)
+        with np.errstate(invalid="ignore", over="ignore"):
+            if self.mode == "abs":
+                scale = 2.0 * self.bound
+                q = np.rint(x / scale)
+                bad = ~(np.abs(q) <= 2.0**52)
+                q[bad] = 0.0
+                bad |= ~(np.abs(q * scale - x) <= self.bound)
+                q = q.astype(np.int64)
+            else:
+                # rounding to m mantissa bits has a relative error <= 2**-(m + 1),
+                # at most 41 bits keep the integers exact in the float64 metadata
+                nbit = int(np.clip(np.ceil(-np.log2(self.bound) - 1.0), 0, 41))
+                scale = 52 - nbit
+                bits = x.view(np.uint64)
+                sign = bits >> np.uint64(63)
+                mag = bits & np.uint64(2**63 - 1)
+                if scale > 0:
+                    mag = (mag + np.uint64(2 ** (scale - 1))) >> np.uint64(scale)
+                dec = (mag << np.uint64(scale)).view(np.float64)
+                bad = ~np.isfinite(x) | ~(
+                    np.abs(dec - np.abs(x)) <= self.bound * np.abs(x)
+                )
+                q = ((mag << np.uint64(1)) | sign).astype(np.int64)
+        index = np.flatnonzero(bad)
+        if index.shape[0] < q.shape[0]:
+            q[index] = q[~bad].min()
+        offset = int(q.min()) if q.shape[0] > 0 else 0
+        u = (q - offset).view(np.uint64)
+        umax = int(u.max()) if u.shape[0] > 0 else 0
+        nbyte = next(n for n in [1, 2, 4, 8] if umax < 2 ** (8 * n))
+        planes = u.astype(f"<u{nbyte}").view(np.uint8).reshape(-1, nbyte).T
+        meta = [Quantizer._modes.index(self.mode), self.bound, scale, offset]
+        return {
+            "q": np.ascontiguousarray(planes).reshape(-1),
+            "qmeta": np.array(meta + [nbyte, x.shape[0]], dtype=np.float64),
+            "qindex": index.astype(np.int64),
+            "qvalue": x[index],
+        }
+
+    @staticmethod
+    def decode(q, qmeta, qindex=None, qvalue=None):
+        """decode an array, see `encode()`
+
+        Parameters
+        ----------
+        q (ndarray) : the byte planes
+        qmeta (ndarray) : the metadata
+        qindex (ndarray) : optional flat index of the outliers
+        qvalue (ndarray) : optional exact values of the outliers
+
+        Returns
+        -------
+        arr (ndarray) : the float64 values
+
+        """
+        mode, _, scale, offset, nbyte, size = qmeta
+        nbyte, size = int(nbyte), int(size)
+        planes = np.asarray(q, dtype=np.uint8).reshape(nbyte, size)
+        u = np.ascontiguousarray(planes.T).view(f"<u{nbyte}").reshape(-1)
+        q = u.astype(np.int64) + np.int64(offset)
+        if int(mode) == 0:
+            arr = q * scale
+        else:
+            q = q.view(np.uint64)
+            mag = (q >> np.uint64(1)) << np.uint64(int(scale))
+            arr = (mag | ((q & np.uint64(1)) << np.uint64(63))).view(np.float64)
+        if qindex is not None:
+            arr[qindex] = qvalue
+        return arr
+
+
+class GroupWriter(object):
+    """Writes the solution groups of `Mf6Adj.solve_gwf()` to an open HDF5 file.
+    Arrays that are bit-for-bit the same as in the last group that held them
+    (the hydraulic properties, the storage term of constant time step lengths
+    and the boundary data within a stress period, for instance) are not written
+    again: the new group gets an HDF5 hard link to the dataset that was written
+    first, which readers cannot tell from a dataset of its own.
+
+    In lean mode the arrays that `ForwardStore` can derive on read are not
+    written: 'dresdss_h' and 'drhsdh' (recomputed from the heads, saturation,
+    time step length and the 'gwf_info' grid and storage arrays), and
+    'head_old' and 'sat_old' whenever they are the same as the last time step's
+    'head' and 'sat' (so always, except for the first time step).
+
+    With AMAT keyframes, the full 'amat' is written every `amat_keyframe` time
+    steps and the groups in between only hold the entries that differ (bit for
+    bit) from the last keyframe, as 'amat_index' and 'amat_value' datasets and
+    an 'amat_keyframe' attribute with the keyframe group name.  A new keyframe
+    is written early if the changes would take as much space as the full array.
+
+    The "groups" layout writes one HDF5 group per time step.  The "stacked"
+    layout writes no solution groups: each array is appended to one extendable
+    dataset under 'stacked/data', the solution arrays as rows (time x nodes,
+    one row per chunk) and the boundary package arrays end to end.  The
+    (start, stop) rows of each array and time step (-1 where there is none,
+    linked arrays share their rows) are in 'stacked/index' and the group
+    attributes are columns of the 'stacked/time' table, both written on
+    `close()`.
+
+    Parameters
+    ----------
+    hdf (h5py.File) : the open HDF5 file
+    dedup (bool) : flag to link unchanged arrays instead of writing them again.
+        Default is True
+    lean (bool) : flag to leave out the arrays that can be derived on read.
+        Default is False
+    amat_keyframe (int) : the number of time steps from one full AMAT to the
+        next.  Default is 0 (every AMAT in full)
+    layout (str) : "groups" or "stacked".  Default is "groups"
+    filters (Hdf5Filter) : the compression filter and chunks of the datasets.
+        Default is None (no filter, contiguous datasets and one row per chunk
+        in the "stacked" layout)
+    lossy (dict) : optional error bounds of the arrays stored lossy, keyed by
+        "amat", "head" or "sat" ('head' and 'sat' include 'head_old' and
+        'sat_old'), as `Quantizer` or (mode, bound) tuples, for instance
+        {"amat": ("rel", 1.0e-6), "head": ("abs", 1.0e-4)}.  The arrays are
+        stored as the '<name>_q', '<name>_qmeta' and, if there are outliers,
+        '<name>_qindex' and '<name>_qvalue' parts of `Quantizer.encode()`, and
+        the bounds as the 'lossy' attribute of the file.  Default is None (all
+        arrays stored exactly)
+
+    """
+
+    # solution arrays checked for changes, the others change every time step
+    _dedup_names = ["k11", "k33", "condsat", "iss", "drhsdh"]
+    # boundary package arrays that change every time step
+    _package_skip = ["simvals"]
+    # arrays left out in lean mode
+    _derived_names = ["dresdss_h", "drhsdh"]
+    # arrays left out in lean mode if they are the last time step's array
+    _old_names = {"head_old": "head", "sat_old": "sat"}
+    # the changed AMAT entries of the groups between keyframes
+    _amat_delta_names = ["amat_index", "amat_value"]
+    _layouts = ["groups", "stacked"]
+    # arrays that can be stored lossy, with the arrays that share their bound
+    _lossy_names = {"amat": [], "head": ["head_old"], "sat": ["sat_old"]}
+
+    def __init__(
+        self,
+        hdf,
+        dedup: bool = True,
+        lean: bool = False,
+        amat_keyframe: int = 0,
+        layout: str = "groups",
+        filters: Hdf5Filter | None = None,
+        lossy: dict | None = None,
+    ):
+        layout = layout.lower()
+        if layout not in GroupWriter._layouts:
+            raise Exception(
+                f"unrecognized layout '{layout}', should be one of "
+                + f"{GroupWriter._layouts!s}"
+            )
+        self._hdf = hdf
+        self.dedup = bool(dedup)
+        self.lean = bool(lean)
+        self.amat_keyframe = max(0, int(amat_keyframe))
+        self.layout = layout
+        self.filters = Hdf5Filter() if filters is None else filters
+        self._quantizers = {}
+        for name, quantizer in ({} if lossy is None else lossy).items():
+            if name not in GroupWriter._lossy_names:
+                raise Exception(
+                    f"'{name}' can't be stored lossy, only "
+                    + f"{list(GroupWriter._lossy_names.keys())!s}"
+                )
+            if not isinstance(quantizer, Quantizer):
+                quantizer = Quantizer(*quantizer)
+            for tag in [name, *GroupWriter._lossy_names[name]]:
+                self._quantizers[tag] = quantizer
+        # arrays appended end to end in the "stacked" layout
+        self._ragged = set(GroupWriter._amat_delta_names)
+        for tag in self._quantizers:
+            self._ragged.update(f"{tag}_{part}" for part in Quantizer._parts)
+        if lossy is not None and len(lossy) > 0:
+            hdf.attrs["lossy"] = ", ".join(
+                f"{name} {self._quantizers[name]!s}" for name in lossy.keys()
+            )
+        self._last = {}
+        self._previous = {}
+        self._keyframe = None
+        self._group = None
+        self.nwritten = 0
+        self.nlinked = 0
+        self.logger = logging.getLogger(logging.__name__ + ".GroupWriter")
+        if layout == "stacked":
+            hdf.attrs["layout"] = layout
+            self._data = hdf.create_group("stacked/data")
+            self._names = set()
+            self._index = {}
+            self._times = {}
+            self._ntime = 0
+
+    @staticmethod
+    def _same(arr1, arr2):
+        """private method to check if two arrays are bit-for-bit the same"""
+        if arr1.dtype != arr2.dtype or arr1.shape != arr2.shape:
+            return False
+        return np.array_equal(
+            np.ascontiguousarray(arr1).reshape(-1).view(np.uint8),
+            np.ascontiguousarray(arr2).reshape(-1).view(np.uint8),
+        )
+
+    def _begin(self, group_name, attr_dict):
+        """private method to start the solution group of a time step
+
+        Parameters
+        ----------
+        group_name (str) : the group name
+        attr_dict (dict) : the attributes of the group
+
+        Returns
+        -------
+        container (h5py.Group or str) : the group ("groups" layout) or the path
+            prefix ("stacked" layout) to write to
+
+        """
+        self._group = "/" + group_name
+        if self.layout == "groups":
+            if group_name in self._hdf:
+                raise Exception(f"group_name {group_name} already in hdf file")
+            grp = self._hdf.create_group(group_name)
+            for name, val in attr_dict.items():
+                grp.attrs[name] = val
+            return grp
+        if group_name in self._names:
+            raise Exception(f"group_name {group_name} already in hdf file")
+        self._names.add(group_name)
+        self._ntime += 1
+        for name, val in attr_dict.items():
+            self._set_attr("", name, val)
+        return ""
+
+    def _subgroup(self, container, tag):
+        """private method to start a boundary package subgroup, see `_begin()`"""
+        if self.layout == "groups":
+            return container.create_group(tag)
+        self._data.require_group(tag)
+        return f"{tag}/"
+
+    def _set_attr(self, container, name, val):
+        """private method to set an attribute of a (sub)group, see `_begin()`"""
+        if self.layout == "groups":
+            container.attrs[name] = val
+        elif container == "":
+            self._times.setdefault(name, {})[self._ntime - 1] = val
+        else:
+            self._data[container.rstrip("/")].attrs[name] = val
+
+    def _create(self, container, tag, arr):
+        """private method to write an array
+
+        Parameters
+        ----------
+        container (h5py.Group or str) : see `_begin()`
+        tag (str) : the dataset name
+        arr (ndarray) : the values
+
+        Returns
+        -------
+        location (str or tuple) : the dataset name ("groups" layout) or the
+            (start, stop) rows ("stacked" layout), to link to
+
+        """
+        self.nwritten += 1
+        if tag.startswith("amat"):
+            dclass = "amat"
+        elif self.layout == "groups":
+            # boundary package subgroups are one level down
+            dclass = "node" if container.name.count("/") < 2 else "package"
+        else:
+            dclass = "node" if container == "" else "package"
+        if self.layout == "groups":
+            dset = container.create_dataset(
+                tag,
+                arr.shape,
+                dtype=arr.dtype,
+                data=arr,
+                **self.filters.kwargs(dclass, arr.shape),
+            )
+            return dset.name
+        path = container + tag
+        rows = container == "" and tag not in self._ragged
+        block = arr.reshape((1, *arr.shape)) if rows else np.atleast_1d(arr)
+        dset = self._data.get(path, None)
+        if dset is None:
+            if rows:
+                chunks = self.filters.chunk_shape(dclass, arr.shape) or arr.shape
+                chunks = (self.filters.chunks.get("time", 1), *chunks)
+            else:
+                chunks = self.filters.chunk_shape(dclass, (None, *block.shape[1:]))
+            dset = self._data.create_dataset(
+                path,
+                (0, *block.shape[1:]),
+                maxshape=(None, *block.shape[1:]),
+                dtype=arr.dtype,
+                chunks=True if chunks is None else chunks,
+                **self.filters.filter_kwargs(),
+            )
+            dset.attrs["rows"] = rows
+        elif dset.shape[1:] != block.shape[1:] or dset.dtype != arr.dtype:
+            raise Exception(
+                f"'{path}' changed shape or type, from {dset.shape[1:]!s} "
+                + f"{dset.dtype} to {block.shape[1:]!s} {arr.dtype}, the "
+                + "stacked layout needs the same shape and type every time step"
+            )
+        start = dset.shape[0]
+        dset.resize(start + block.shape[0], axis=0)
+        dset[start:] = block
+        location = (start, start + block.shape[0])
+        self._index.setdefault(path, {})[self._ntime - 1] = location
+        return location
+
+    def _link(self, container, tag, location):
+        """private method to point an array to one written before, see
+        `_create()`"""
+        self.nlinked += 1
+        if self.layout == "groups":
+            container[tag] = self._hdf[location]
+        else:
+            self._index[container + tag][self._ntime - 1] = location
+
+    def _write_array(self, container, tag, arr, key=None):
+        """private method to write an array, or to link it to the last array
+        written for `key` if the values have not changed
+
+        Parameters
+        ----------
+        container (h5py.Group or str) : see `_begin()`
+        tag (str) : the dataset name
+        arr (ndarray) : the values
+        key (str) : the name to track changes by.  If None, the array is always
+            written
+
+        """
+        if key is not None and self.dedup:
+            last = self._last.get(key, None)
+            if last is not None and GroupWriter._same(last[1], arr):
+                self._link(container, tag, last[0])
+                return
+        location = self._create(container, tag, arr)
+        if key is not None and self.dedup:
+            self._last[key] = (location, arr.copy())
+
+    def _write_amat(self, container, amat):
+        """private method to write AMAT in full (a keyframe) or as the entries
+        that changed since the last keyframe
+
+        Parameters
+        ----------
+        container (h5py.Group or str) : see `_begin()`
+        amat (ndarray) : the AMAT values
+
+        """
+        key = self._keyframe
+        if (
+            key is not None
+            and key[2] < self.amat_keyframe
+            and key[1].shape == amat.shape
+            and key[1].dtype == amat.dtype
+        ):
+            utype = np.dtype(f"u{amat.dtype.itemsize}")
+            idx = np.flatnonzero(
+                np.ascontiguousarray(amat).reshape(-1).view(utype)
+                != key[1].reshape(-1).view(utype)
+            )
+            idx = idx.astype(np.int32 if amat.size < 2**31 else np.int64)
+            if idx.nbytes + idx.shape[0] * amat.dtype.itemsize < amat.nbytes:
+                val = amat.reshape(-1)[idx]
+                for tag, arr in zip(GroupWriter._amat_delta_names, [idx, val]):
+                    self._create(container, tag, arr)
+                self._set_attr(container, "amat_keyframe", key[0])
+                key[2] += 1
+                return
+        self._write_solution(container, "amat", amat)
+        self._keyframe = [self._group, amat.copy(), 1]
+
+    def _write_solution(self, container, tag, arr):
+        """private method to write a solution array, lossy if it has an error
+        bound
+
+        Parameters
+        ----------
+        container (h5py.Group or str) : see `_begin()`
+        tag (str) : the dataset name
+        arr (ndarray) : the values
+
+        """
+        quantizer = self._quantizers.get(tag, None)
+        if quantizer is None or not np.issubdtype(arr.dtype, np.floating):
+            key = tag if tag in GroupWriter._dedup_names else None
+            self._write_array(container, tag, arr, key=key)
+            return
+        for part, val in quantizer.encode(arr).items():
+            if part in ["q", "qmeta"] or val.shape[0] > 0:
+                self._create(container, f"{tag}_{part}", val)
+
+    def _leave_out(self, data_dict, attr_dict):
+        """private method to drop the arrays that can be derived on read
+
+        Parameters
+        ----------
+        data_dict (dict) : the datasets of the group
+        attr_dict (dict) : the attributes of the group
+
+        Returns
+        -------
+        data_dict (dict) : the datasets to write
+        attr_dict (dict) : the attributes to write, with the 'lean' flag
+
+        """
+        data = {}
+        for tag, item in data_dict.items():
+            if tag in GroupWriter._derived_names:
+                continue
+            if tag in GroupWriter._old_names:
+                previous = self._previous.get(GroupWriter._old_names[tag], None)
+                if previous is not None and GroupWriter._same(previous, item):
+                    continue
+            data[tag] = item
+        for name in GroupWriter._old_names.values():
+            item = data_dict[name]
+            previous = self._previous.get(name, None)
+            if previous is None or previous.shape != item.shape:
+                self._previous[name] = item.copy()
+            else:
+                np.copyto(previous, item)
+        attr_dict = dict(attr_dict)
+        attr_dict["lean"] = True
+        return data, attr_dict
+
+    def write(self, group_name, data_dict, attr_dict={}):
+        """write a solution group
+
+        Parameters
+        ----------
+        group_name (str) : the group name
+        data_dict (dict) : datasets to write.  Dict entries are written as
+            subgroups (the boundary packages)
+        attr_dict (dict) : optional dict of attributes to write for the group
+
+        """
+        if self.lean:
+            data_dict, attr_dict = self._leave_out(data_dict, attr_dict)
+        grp = self._begin(group_name, attr_dict)
+        for tag, item in data_dict.items():
+            if isinstance(item, list):
+                item = np.array(item)
+            if isinstance(item, np.ndarray):
+                if tag == "amat" and self.amat_keyframe > 0:
+                    self._write_amat(grp, item)
+                    continue
+                self._write_solution(grp, tag, item)
+            elif isinstance(item, dict):
+                subgrp = self._subgroup(grp, tag)
+                for name, val in item.items():
+                    if isinstance(val, np.ndarray):
+                        key = None
+                        if name not in GroupWriter._package_skip:
+                            key = f"{tag}/{name}"
+                        self._write_array(subgrp, name, val, key=key)
+                    else:
+                        self._set_attr(subgrp, name, val)
+            else:
+                raise Exception(
+                    f"unrecognized data_dict entry: {tag},type:{type(item)}"
+                )
+
+    def _write_tables(self):
+        """private method to write the index and time tables of the "stacked"
+        layout"""
+        stacked = self._hdf["stacked"]
+        ntime = self._ntime
+        for path, locations in self._index.items():
+            index = np.full((ntime, 2), -1, dtype=np.int64)
+            for itime, location in locations.items():
+                index[itime] = location
+            _ = stacked.create_dataset(f"index/{path}", data=index)
+        for name, vals in self._times.items():
+            first = next(iter(vals.values()))
+            # steps without the attribute get the default value of its type
+            col = [vals.get(itime, type(first)()) for itime in range(ntime)]
+            if isinstance(first, str):
+                _ = stacked.create_dataset(
+                    f"time/{name}",
+                    data=np.array(col, dtype=object),
+                    dtype=h5py.string_dtype(),
+                )
+            else:
+                _ = stacked.create_dataset(f"time/{name}", data=np.array(col))
+        self._index = {}
+        self._times = {}
+
+    def close(self, raise_error: bool = True):
+        """write the "stacked" layout tables and release the arrays kept for the
+        change checks
+
+        Parameters
+        ----------
+        raise_error (bool) : unused, for compatibility with `AsyncGroupWriter`
+
+        """
+        if (
+            self.layout == "stacked"
+            and self._ntime > 0
+            and "time" not in self._hdf["stacked"]
+        ):
+            self._write_tables()
+        if self.dedup:
+            self.logger.info(
+                f"...{self.nwritten} datasets written, {self.nlinked} unchanged "
+                + "datasets linked"
+            )
+        self._last = {}
+        self._previous = {}
+        self._keyframe = None
+
+
+class AsyncGroupWriter(GroupWriter):
+    """Writes solution groups to an open HDF5 file from a background thread, so
+    that MODFLOW6 can move on to the next time step while the last one is being
+    serialized.  `write()` takes a snapshot of the data (copied into recycled
+    buffers) and queues it; when the queue is full, `write()` blocks until the
+    writer catches up.  Errors raised by the writer thread are re-raised by the
+    next `write()` or by `close()`.
+
+    Parameters
+    ----------
+    hdf (h5py.File) : the open HDF5 file.  Must not be used by other threads until
+        `close()`
+    max_queue (int) : the number of snapshots that can wait to be written.
+        Default is 2
+    kwargs (dict) : optional keyword arguments passed to `GroupWriter`
+
+    """
+
+    def __init__(self, hdf, max_queue: int = 2, **kwargs):
+        super().__init__(hdf, **kwargs)
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._free = {}
+        self._lock = threading.Lock()
+        self._error = None
+        self._closed = False
+        self.logger = logging.getLogger(logging.__name__ + ".AsyncGroupWriter")
+        self._thread = threading.Thread(
+            target=self._run, name="mf6adj-hdf5-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _take(self, arr):
+        """private method to copy an array into a recycled buffer"""
+        key = (arr.shape, arr.dtype.str)
+        with self._lock:
+            bufs = self._free.get(key, None)
+            buf = bufs.pop() if bufs else None
+        if buf is None:
+            buf = np.empty_like(arr)
+        np.copyto(buf, arr)
+        return buf
+
+    def _release(self, item):
+        """private method to return the buffers of a snapshot for reuse"""
+        if isinstance(item, np.ndarray):
+            with self._lock:
+                self._free.setdefault((item.shape, item.dtype.str), []).append(item)
+        elif isinstance(item, dict):
+            for val in item.values():
+                self._release(val)
+
+    def _snapshot(self, item):
+        """private method to copy the arrays of a data dict"""
+        if isinstance(item, np.ndarray):
+            return self._take(item)
+        if isinstance(item, dict):
+            return {key: self._snapshot(val) for key, val in item.items()}
+        if isinstance(item, list):
+            return np.array(item)
+        return item
+
+    def _run(self):
+        """private method for the writer thread"""
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            group_name, data_dict, attr_dict = task
+            try:
+                if self._error is None:
+                    GroupWriter.write(self, group_name, data_dict, attr_dict)
+            except Exception as e:
+                self._error = e
+                self.logger.warning(f"WARNING: error writing '{group_name}': {e!s}")
+            finally:
+                self._release(data_dict)
+
+    def _check(self):
+        """private method to re-raise a writer thread error"""
+        if self._error is not None:
+            raise Exception(
+                f"error writing the HDF5 file: {self._error!s}"
+            ) from self._error
+
+    def write(self, group_name, data_dict, attr_dict={}):
+        """queue a group to write, see `GroupWriter.write()`.  Blocks
+        while the queue is full
+
+        Parameters
+        ----------
+        group_name (str) : the group name
+        data_dict (dict) : datasets to write.  Copied, so the arrays can be
+            reused as soon as this returns
+        attr_dict (dict) : optional dict of attributes to write for the group
+
+        """
+        if self._closed:
+            raise Exception("writer is closed")
+        self._check()
+        self._queue.put((group_name, self._snapshot(data_dict), dict(attr_dict)))
+
+    def close(self, raise_error: bool = True):
+        """wait for the queued groups to be written and stop the writer thread
+
+        Parameters
+        ----------
+        raise_error (bool) : flag to raise the writer thread error, if any.
+            Default is True
+
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+            self._free = {}
+            super().close()
+        if raise_error:
+            self._check()
+
+
+class ForwardStore(object):
+    """Read access to a forward solution HDF5 file, whatever options
+    `Mf6Adj.solve_gwf()` wrote it with.  Works like the `h5py.File`: indexing with
+    a solution group name gives a `SolutionGroup` (for the "stacked" layout too,
+    whose solution groups only exist as rows of the stacked datasets), which
+    also serves the arrays that a lean file derives on read and rebuilds the
+    AMAT of the groups between keyframes; any other name (e.g. 'gwf_info' or
+    'aux') gives the HDF5 object.  The last keyframe read is cached, so a sweep
+    through the time steps (in either direction) reads each keyframe once.
+
+    Parameters
+    ----------
+    hdf (str, h5py.File or ForwardStore) : the forward solution HDF5 file name
+        or an open filehandle.  A filehandle stays open on `close()`
+
+    """
+
+    def __init__(self, hdf):
+        if isinstance(hdf, ForwardStore):
+            hdf = hdf._hdf
+        self._own = isinstance(hdf, str)
+        if self._own:
+            hdf = h5py.File(hdf, "r")
+        self._hdf = hdf
+        self._previous = None
+        self._grid = None
+        self._keyframe = None
+        self.layout = str(hdf.attrs.get("layout", "groups"))
+        self._time = None
+        if self.layout == "stacked":
+            self._load_tables()
+
+    def _load_tables(self):
+        """private method to read the index and time tables of the "stacked"
+        layout"""
+        stacked = self._hdf["stacked"]
+        self._data = stacked["data"]
+        self._rows = {}
+        self._times = {}
+        for name, dset in stacked["time"].items():
+            if h5py.check_string_dtype(dset.dtype) is not None:
+                self._times[name] = dset.asstr()[:]
+            else:
+                self._times[name] = dset[:]
+        self._index = {}
+        stacked["index"].visititems(
+            lambda path, obj: (
+                self._index.update({path: obj[:]})
+                if isinstance(obj, h5py.Dataset)
+                else None
+            )
+        )
+        self._packages = sorted(
+            {path.split("/")[0] for path in self._index.keys() if "/" in path}
+        )
+        self._time = {
+            f"solution_kper:{kper:05d}_kstp:{kstp:05d}": itime
+            for itime, (kper, kstp) in enumerate(
+                zip(self._times["kper"], self._times["kstp"])
+            )
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """close the file, if it was opened by name"""
+        if self._own:
+            self._hdf.close()
+
+    @property
+    def attrs(self):
+        return self._hdf.attrs
+
+    @property
+    def filename(self):
+        return self._hdf.filename
+
+    def keys(self):
+        if self._time is None:
+            return self._hdf.keys()
+        return [name for name in self._hdf.keys() if name != "stacked"] + list(
+            self._time.keys()
+        )
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        if self._time is None:
+            return name in self._hdf
+        return name in self._time or (name != "stacked" and name in self._hdf)
+
+    def __getitem__(self, name):
+        if self._time is not None and name in self._time:
+            return SolutionGroup(self, name)
+        item = self._hdf[name]
+        if (
+            self._time is None
+            and isinstance(item, h5py.Group)
+            and name.startswith("solution")
+        ):
+            return SolutionGroup(self, name)
+        return item
+
+    def _attrs(self, sol_key):
+        """private method to get the attributes of a solution group"""
+        if self._time is None:
+            return self._hdf[sol_key].attrs
+        itime = self._time[sol_key]
+        attrs = {}
+        for name, col in self._times.items():
+            # attributes missing from a time step are stored as ""
+            if isinstance(col[itime], str) and col[itime] == "":
+                continue
+            attrs[name] = col[itime]
+        return attrs
+
+    def _keys(self, sol_key, pname=None):
+        """private method to get the names stored in a solution group (or in a
+        boundary package subgroup if `pname` is not None)"""
+        if self._time is None:
+            grp = self._hdf[sol_key]
+            return list(grp.keys() if pname is None else grp[pname].keys())
+        itime = self._time[sol_key]
+        paths = [path for path, index in self._index.items() if index[itime, 0] >= 0]
+        if pname is not None:
+            return [
+                path.split("/", 1)[1] for path in paths if path.startswith(pname + "/")
+            ]
+        names = [path for path in paths if "/" not in path]
+        names += [
+            name
+            for name in self._packages
+            if any(path.startswith(name + "/") for path in paths)
+        ]
+        return names
+
+    def _get(self, sol_key, name):
+        """private method to get an item stored in a solution group"""
+        if self._time is None:
+            return self._hdf[sol_key][name]
+        if name in self._packages and name in self._keys(sol_key):
+            return PackageGroup(self, sol_key, name)
+        return self._read(sol_key, name)
+
+    def _read(self, sol_key, path):
+        """private method to read the rows of an array in the "stacked"
+        layout"""
+        index = self._index.get(path, None)
+        start, stop = (-1, -1) if index is None else index[self._time[sol_key]]
+        if start < 0:
+            raise KeyError(f"'{path}' not in solution group '{sol_key}'")
+        dset = self._data[path]
+        if path not in self._rows:
+            self._rows[path] = bool(dset.attrs["rows"])
+        if self._rows[path]:
+            return dset[start]
+        return dset[start:stop]
+
+    def previous(self, sol_key):
+        """the solution group of the time step before a solution group
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+
+        Returns
+        -------
+        sol_key (str) : the name of the solution group before, None for the
+            first time step
+
+        """
+        if self._previous is None:
+            sol_keys = self.solution_keys()
+            self._previous = dict(zip(sol_keys[1:], sol_keys[:-1]))
+        return self._previous.get(sol_key, None)
+
+    def solution_keys(self):
+        """the solution group names, in time step order
+
+        Returns
+        -------
+        sol_keys (list) : the solution group names
+
+        """
+        aux = self._hdf["aux"]
+        return [
+            f"solution_kper:{kper:05d}_kstp:{kstp:05d}"
+            for kper, kstp in zip(aux["kper"][:], aux["kstp"][:])
+        ]
+
+    def read_group(self, sol_key):
+        """read a solution group into memory, in the form `GroupWriter.write()`
+        takes
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+
+        Returns
+        -------
+        data_dict (dict) : the arrays (derived and decoded where needed) and the
+            boundary package dicts, with their attributes
+        attr_dict (dict) : the attributes of the group, without those written by
+            `GroupWriter` options
+
+        """
+        grp = self[sol_key]
+        attr_dict = {
+            name: val
+            for name, val in grp.attrs.items()
+            if name not in ["lean", "amat_keyframe"]
+        }
+        data_dict = {}
+        for name in grp.keys():
+            item = grp[name]
+            if hasattr(item, "keys"):
+                pdata = dict(item.attrs.items())
+                pdata.update({k: np.asarray(item[k][:]) for k in item.keys()})
+                data_dict[name] = pdata
+            else:
+                data_dict[name] = np.asarray(item[:])
+        return data_dict, attr_dict
+
+    def rewrite(self, hdf5_name: str, **kwargs):
+        """write the forward solution to a new file with other `GroupWriter`
+        options, for instance another layout or lossy storage
+
+        Parameters
+        ----------
+        hdf5_name (str) : the new forward solution HDF5 file, replaced if it
+            exists
+        kwargs (dict) : keyword arguments passed to `GroupWriter`
+
+        """
+        if os.path.abspath(hdf5_name) == os.path.abspath(self.filename):
+            raise Exception(f"can't rewrite '{hdf5_name}' to itself")
+        with h5py.File(hdf5_name, "w") as hdf:
+            for name, val in self.attrs.items():
+                if name not in ["layout", "lossy"]:
+                    hdf.attrs[name] = val
+            writer = GroupWriter(hdf, **kwargs)
+            try:
+                for sol_key in self.solution_keys():
+                    writer.write(sol_key, *self.read_group(sol_key))
+            finally:
+                writer.close()
+            for name in ["aux", "gwf_info"]:
+                self._hdf.copy(self._hdf[name], hdf, name)
+
+    @property
+    def grid(self):
+        """the 'gwf_info' grid and storage arrays used to derive the storage
+        terms: 'top', 'bot', 'area', and 'iconvert' and 'storage' if there is a
+        storage package"""
+        if self._grid is None:
+            info = self._hdf["gwf_info"]
+            self._grid = {
+                name: info[name][:]
+                for name in ["top", "bot", "area", "iconvert", "storage"]
+                if name in info
+            }
+        return self._grid
+
+    def keyframe(self, group_name):
+        """the AMAT of a keyframe group, cached until another keyframe is read
+
+        Parameters
+        ----------
+        group_name (str) : the keyframe group name
+
+        Returns
+        -------
+        amat (ndarray) : the AMAT values.  Shared with the cache, do not modify
+
+        """
+        if self._keyframe is None or self._keyframe[0] != group_name:
+            amat = self[group_name.lstrip("/")]["amat"][:]
+            self._keyframe = (group_name, amat)
+        return self._keyframe[1]
+
+
+class SolutionGroup(object):
+    """A solution group of a `ForwardStore`.  Works like the `h5py.Group`,
+    derives the arrays a lean file leaves out ('head_old', 'sat_old', 'drhsdh'
+    and 'dresdss_h') the same way `Mf6Adj.solve_gwf()` computed them, applies
+    the AMAT changes of a group between keyframes to its keyframe and decodes
+    the arrays stored lossy (see `Quantizer`)
+
+    Parameters
+    ----------
+    store (ForwardStore) : the forward store
+    sol_key (str) : the solution group name
+
+    """
+
+    def __init__(self, store, sol_key):
+        self._store = store
+        self._sol_key = sol_key
+        self.attrs = store._attrs(sol_key)
+        # the names are listed once, the stacked layout scans its index for them
+        stored = store._keys(sol_key)
+        self._stored = set(stored)
+        self._names = self._list(stored)
+
+    @property
+    def name(self):
+        return "/" + self._sol_key
+
+    @staticmethod
+    def _lossy(stored):
+        """private method to get the names of the arrays stored lossy
+
+        Parameters
+        ----------
+        stored (list) : the names stored in the group
+
+        """
+        return [
+            name[:-2]
+            for name in stored
+            if name.endswith("_q") and name[:-2] + "_qmeta" in stored
+        ]
+
+    def _derived(self, stored):
+        """private method to get the names of the arrays derived on read
+
+        Parameters
+        ----------
+        stored (list) : the names stored in the group
+
+        """
+        lossy = SolutionGroup._lossy(stored)
+        names = list(lossy)
+        if "amat_keyframe" in self.attrs:
+            names.append("amat")
+        if self.attrs.get("lean", False):
+            names += [
+                name
+                for name in GroupWriter._old_names
+                if name not in stored and name not in lossy
+            ]
+            names.append("drhsdh")
+            if self.attrs["has_sto"]:
+                names.append("dresdss_h")
+        return names
+
+    def _list(self, stored):
+        """private method to get the names of the group, the stored arrays
+        without the AMAT changes and lossy parts plus the derived arrays
+
+        Parameters
+        ----------
+        stored (list) : the names stored in the group
+
+        """
+        hidden = list(GroupWriter._amat_delta_names)
+        for name in SolutionGroup._lossy(stored):
+            hidden += [f"{name}_{part}" for part in Quantizer._parts]
+        names = [name for name in stored if name not in hidden]
+        return names + self._derived(stored)
+
+    def keys(self):
+        return list(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __getitem__(self, name):
+        if name in self._stored:
+            return self._store._get(self._sol_key, name)
+        if name not in self._names:
+            raise KeyError(f"'{name}' not in solution group '{self.name}'")
+        return self._derive(name)
+
+    def _derive(self, name):
+        """private method to derive an array left out of the file
+
+        Parameters
+        ----------
+        name (str) : the array name
+
+        Returns
+        -------
+        arr (ndarray) : the values
+
+        """
+        # delayed import, adj imports this module
+        from .adj import Mf6Adj
+
+        store = self._store
+        if name == "amat" and "amat_keyframe" in self.attrs:
+            amat = store.keyframe(self.attrs["amat_keyframe"]).copy()
+            idx, val = (
+                store._get(self._sol_key, tag)[:]
+                for tag in GroupWriter._amat_delta_names
+            )
+            amat.reshape(-1)[idx] = val
+            return amat
+        stored = self._stored
+        if f"{name}_q" in stored:
+            parts = {
+                part: store._get(self._sol_key, f"{name}_{part}")[:]
+                for part in Quantizer._parts
+                if f"{name}_{part}" in stored
+            }
+            return Quantizer.decode(**parts)
+        if name in GroupWriter._old_names:
+            sol_key = store.previous(self._sol_key)
+            if sol_key is None:
+                raise Exception(f"no time step before '{self.name}' for '{name}'")
+            return store[sol_key][GroupWriter._old_names[name]][:]
+        grid = store.grid
+        dt = self.attrs["dt"]
+        sat = self["sat"][:]
+        if name == "drhsdh":
+            if not self.attrs["has_sto"]:
+                return np.zeros_like(sat)
+            return Mf6Adj._drhsdh(
+                grid["top"], grid["bot"], grid["area"], grid["storage"], dt
+            )
+        return Mf6Adj._dresdss_h(
+            grid["top"],
+            grid["bot"],
+            grid["area"],
+            grid["iconvert"],
+            self["head"][:],
+            self["head_old"][:],
+            dt,
+            sat,
+            # the current saturation, as in solve_gwf()
+            sat,
+        )
+
+
+class PackageGroup(object):
+    """A boundary package subgroup of a `SolutionGroup` in the "stacked" layout,
+    works like the `h5py.Group`
+
+    Parameters
+    ----------
+    store (ForwardStore) : the forward store
+    sol_key (str) : the solution group name
+    pname (str) : the package name
+
+    """
+
+    def __init__(self, store, sol_key, pname):
+        self._store = store
+        self._sol_key = sol_key
+        self._pname = pname
+        self.attrs = store._data[pname].attrs
+
+    @property
+    def name(self):
+        return f"/{self._sol_key}/{self._pname}"
+
+    def keys(self):
+        return self._store._keys(self._sol_key, pname=self._pname)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __getitem__(self, name):
+        return self._store._read(self._sol_key, f"{self._pname}/{name}")
@@ -0,0 +1,561 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.linalg import LinearOperator, splu
+
+from .pm import PerfMeas
+from .store import ForwardStore
+
+
+class TangentLinear(object):
+    """Forward-mode (tangent-linear) sensitivity engine that works from the forward
+    solution HDF5 file written by `Mf6Adj.solve_gwf()`.  For each parameter
+    direction, it solves
+
+        AMAT_n dh_n = -(dR_n/dp) dp + drhsdh_n-1 dh_n-1
+
+    forward in time, giving the directional derivatives of all heads and
+    boundary flows.  This is the exact dual of the adjoint sweep in
+    `PerfMeas.solve_adjoint()`: for any performance measure, the directional
+    derivative equals the composite sensitivities dotted with the direction.
+    The per time step AMAT factorizations and dR/dk operators are cached so that
+    more directions, or adjoint solves through `solve_transpose()`, can reuse them.
+
+    Parameters
+    ----------
+    hdf5_forward_solution_fname (str) : the HDF5 file written during the forward
+        GWF solution
+    cache_factors (bool) : flag to keep the AMAT factorizations and the dR/dk
+        operators in memory between solves.  Default is True
+
+    """
+
+    def __init__(self, hdf5_forward_solution_fname: str, cache_factors: bool = True):
+        self.hdf5_forward_solution_fname = hdf5_forward_solution_fname
+        self.cache_factors = bool(cache_factors)
+        self.logger = logging.getLogger(logging.__name__ + ".TangentLinear")
+        self._hdf = ForwardStore(hdf5_forward_solution_fname)
+        hdf = self._hdf
+        self.sol_keys, self.kperkstp, self.kk_sol_map = PerfMeas._get_solution_keys(hdf)
+        self.gwf_package_dict = dict(hdf["gwf_info"].attrs.items())
+        self.nnodes = int(hdf["gwf_info"]["nnodes"][0])
+        self.has_sto = hdf[self.sol_keys[0]].attrs["has_sto"]
+        self.composite_names = PerfMeas._composite_names(
+            self.gwf_package_dict, self.has_sto
+        )
+        self._gwf_info = {
+            name: hdf["gwf_info"][name][:]
+            for name in [
+                "ia",
+                "ja",
+                "ihc",
+                "jas",
+                "cl1",
+                "cl2",
+                "hwva",
+                "top",
+                "bot",
+                "icelltype",
+            ]
+        }
+        self._factors = {}
+        self._operators = {}
+
+    def close(self):
+        """close the forward solution file and clear the cached factorizations"""
+        self._factors = {}
+        self._operators = {}
+        if self._hdf is not None:
+            self._hdf.close()
+            self._hdf = None
+
+    def factor(self, sol_key):
+        """get the (cached) sparse LU factorization of AMAT for a solution group
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+
+        Returns
+        -------
+        lu (scipy.sparse.linalg.SuperLU) : the factorization
+
+        """
+        if sol_key in self._factors:
+            return self._factors[sol_key]
+        ia, ja = self._gwf_info["ia"], self._gwf_info["ja"]
+        amat = self._hdf[sol_key]["amat"][:]
+        amat = sparse.csr_matrix(
+            (amat[: ja.shape[0]].copy(), ja.copy(), ia.copy()),
+            shape=(len(ia) - 1, len(ia) - 1),
+        )
+        lu = splu(amat.tocsc())
+        if self.cache_factors:
+            self._factors[sol_key] = lu
+        return lu
+
+    def operators(self, sol_key):
+        """get the (cached) operators that map an adjoint state to the k11 and
+        k33 sensitivities of a solution group.  See `PerfMeas.lam_dresdk_h()`
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+
+        Returns
+        -------
+        op_k, op_k33 (scipy.sparse.csr_matrix) : the operators
+
+        """
+        if sol_key in self._operators:
+            return self._operators[sol_key]
+        grp = self._hdf[sol_key]
+        info = self._gwf_info
+        ops = PerfMeas._dresdk_h_operators(
+            grp.attrs["is_newton"],
+            grp["sat"][:],
+            grp["head"][:],
+            info["ihc"],
+            info["ia"],
+            info["ja"],
+            info["jas"],
+            info["cl1"],
+            info["cl2"],
+            info["hwva"],
+            info["top"],
+            info["bot"],
+            info["icelltype"],
+            grp["k11"][:],
+            grp["k33"][:],
+        )
+        if self.cache_factors:
+            self._operators[sol_key] = ops
+        return ops
+
+    def chd_nodes(self, sol_key):
+        """get the zero-based constant head nodes of a solution group
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+
+        Returns
+        -------
+        nodes (ndarray) : the constant head nodes
+
+        """
+        nodes = []
+        if "chd6" in self.gwf_package_dict:
+            for pname in self.gwf_package_dict["chd6"]:
+                nodes.extend(list(self._hdf[sol_key][pname]["nodelist"][:] - 1))
+        return np.array(nodes, dtype=int)
+
+    def solve_transpose(self, sol_key, rhs):
+        """solve the transposed AMAT system of a solution group (an adjoint
+        solve) with the cached factorization
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+        rhs (ndarray) : the right-hand side, one or more columns
+
+        Returns
+        -------
+        x (ndarray) : the solution
+
+        """
+        return self.factor(sol_key).solve(rhs, trans="T")
+
+    def _check_direction(self, direction):
+        """private method to broadcast a direction to node arrays
+
+        Parameters
+        ----------
+        direction (dict) : scalar or node array perturbations, keyed by
+            composite name
+
+        Returns
+        -------
+        direction (dict) : node array perturbations, keyed by composite name
+
+        """
+        checked = {}
+        for name, dp in direction.items():
+            if name not in self.composite_names:
+                raise Exception(
+                    f"direction composite '{name}' not found, should be one of "
+                    + f"{self.composite_names!s}"
+                )
+            dp = np.asarray(dp, dtype=float)
+            if dp.ndim == 0:
+                dp = np.full(self.nnodes, float(dp))
+            dp = dp.ravel()
+            if dp.shape[0] != self.nnodes:
+                raise Exception(
+                    f"direction for '{name}' has {dp.shape[0]} values, "
+                    + f"should be {self.nnodes} (nodes)"
+                )
+            checked[name] = dp
+        return checked
+
+    def forcing(self, sol_key, direction):
+        """the tangent-linear forcing -(dR/dp) dp of a solution group.  This is
+        the transpose of the per time step sensitivity calculations in
+        `PerfMeas.solve_adjoint()`
+
+        Parameters
+        ----------
+        sol_key (str) : the solution group name
+        direction (dict) : node array perturbations, keyed by composite name
+
+        Returns
+        -------
+        f (ndarray) : the forcing
+
+        """
+        grp = self._hdf[sol_key]
+        f = np.zeros(self.nnodes)
+        if "k11" in direction or "k33" in direction:
+            op_k, op_k33 = self.operators(sol_key)
+            if "k11" in direction:
+                f -= op_k.T @ direction["k11"]
+            if "k33" in direction:
+                f -= op_k33.T @ direction["k33"]
+        if "ss" in direction and grp["iss"][0] == 0:
+            f -= grp["dresdss_h"][:] * direction["ss"]
+        for name in ["wel6_q", "rch6_recharge"]:
+            if name in direction:
+                f -= direction[name]
+
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+        head = None
+        for ptype, pnames in self.gwf_package_dict.items():
+            if ptype == "chd6" or ptype not in bnd_dict:
+                continue
+            for pname in pnames:
+                level_name = pname + "_" + bnd_dict[ptype][0]
+                cond_name = pname + "_" + bnd_dict[ptype][1]
+                if pname not in grp or (
+                    level_name not in direction and cond_name not in direction
+                ):
+                    continue
+                bound = grp[pname]["bound"][:]
+                n = grp[pname]["nodelist"][:] - 1
+                # the same (last entry wins) semantics as lam_drhs_dbnd()
+                if level_name in direction:
+                    boundcond = np.full(n.shape[0], 1e10)
+                    if bound.shape[1] > 1:
+                        boundcond = bound[:, 1]
+                    coef = np.zeros(self.nnodes)
+                    coef[n] = boundcond
+                    f -= coef * direction[level_name]
+                if cond_name in direction:
+                    if head is None:
+                        head = grp["head"][:]
+                    coef = np.zeros(self.nnodes)
+                    coef[n] = bound[:, 0] - head[n]
+                    f -= coef * direction[cond_name]
+        return f
+
+    def solve(self, directions, flows=True):
+        """solve for the directional derivatives of heads and boundary flows
+
+        Parameters
+        ----------
+        directions (dict) : parameter directions, keyed by direction name.  Each
+            direction is a dict of perturbations keyed by composite name (e.g.
+            "k11", "ss", "ghb_0_cond", see `composite_names`), either a scalar or
+            one value per model node.  For example, a zone multiplier dm on k11
+            is {"k11": k11 * dm * (zones == 1)}
+        flows (bool) : flag to also form the boundary flow derivatives.  Default
+            is True
+
+        Returns
+        -------
+        results (dict) : keyed by direction name, each a dict with 'head' (ndarray,
+            time steps by nodes), the head derivatives, and one (ndarray, time
+            steps by boundary entries) derivative of the simulated flows of each
+            boundary package.  The time steps are in the order of `kperkstp`
+
+        """
+        tl_start = datetime.now()
+        names = list(directions.keys())
+        checked = [self._check_direction(directions[name]) for name in names]
+        ndir = len(names)
+        ntime = len(self.kperkstp)
+        dh = np.zeros((ntime, self.nnodes, ndir))
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+        dflows = {name: {} for name in names}
+
+        for itime, kk in enumerate(self.kperkstp):
+            sol_key = self.kk_sol_map[kk]
+            grp = self._hdf[sol_key]
+            rhs = np.zeros((self.nnodes, ndir))
+            for idir in range(ndir):
+                rhs[:, idir] = self.forcing(sol_key, checked[idir])
+            if itime != 0:
+                drhsdh = self._hdf[self.kk_sol_map[self.kperkstp[itime - 1]]]["drhsdh"][
+                    :
+                ]
+                rhs += drhsdh[:, None] * dh[itime - 1]
+            # the transpose of zeroing the adjoint state at constant heads
+            rhs[self.chd_nodes(sol_key), :] = 0.0
+            if np.any(rhs != 0.0):
+                dh[itime] = self.factor(sol_key).solve(rhs)
+
+            if not flows:
+                continue
+            # derivatives of the simulated flows: hcof dh plus the direct terms
+            head = grp["head"][:]
+            for ptype, pnames in self.gwf_package_dict.items():
+                if ptype == "chd6":
+                    continue
+                for pname in pnames:
+                    if pname not in grp:
+                        continue
+                    if "hcof" not in grp[pname]:
+                        continue
+                    n = grp[pname]["nodelist"][:] - 1
+                    hcof = grp[pname]["hcof"][:]
+                    bound = grp[pname]["bound"][:]
+                    for idir, name in enumerate(names):
+                        dq = hcof * dh[itime, n, idir]
+                        direction = checked[idir]
+                        if ptype in bnd_dict:
+                            level_name = pname + "_" + bnd_dict[ptype][0]
+                            cond_name = pname + "_" + bnd_dict[ptype][1]
+                            if level_name in direction:
+                                dq += bound[:, 1] * direction[level_name][n]
+                            if cond_name in direction:
+                                dq += (bound[:, 0] - head[n]) * direction[cond_name][n]
+                        dflows[name].setdefault(pname, []).append(dq)
+
+        results = {}
+        for idir, name in enumerate(names):
+            results[name] = {"head": dh[:, :, idir]}
+            for pname, dqs in dflows[name].items():
+                if len({dq.shape[0] for dq in dqs}) == 1:
+                    results[name][pname] = np.array(dqs)
+                else:
+                    results[name][pname] = dqs
+        self.logger.info(
+            f"tangent-linear solve for {ndir} directions took "
+            + f"{(datetime.now() - tl_start).total_seconds()} seconds"
+        )
+        return results
+
+    def adjoint(self, dfdh):
+        """solve the adjoint sweep for one or more head performance measures with
+        the cached factorizations and operators, backward in time
+
+            AMAT_n^T lam_n = drhsdh_n lam_n+1 - dF/dh_n
+
+        This is the same sweep as `PerfMeas.solve_adjoint()` for performance
+        measures made of head entries only.
+
+        Parameters
+        ----------
+        dfdh (dict) : the partial derivatives of the performance measures with
+            respect to head (ndarray, nodes or nodes by measures), keyed by
+            (kper,kstp).  Missing time steps are zero
+
+        Returns
+        -------
+        composites (dict) : the composite sensitivities (ndarray, nodes by
+            measures), keyed by composite name
+
+        """
+        ncol = 1
+        for values in dfdh.values():
+            values = np.asarray(values)
+            if values.ndim > 1:
+                ncol = values.shape[1]
+        composites = {
+            name: np.zeros((self.nnodes, ncol)) for name in self.composite_names
+        }
+        bnd_dict = PerfMeas.get_mf6_bound_dict()
+        lamb = np.zeros((self.nnodes, ncol))
+
+        for itime, kk in enumerate(self.kperkstp[::-1]):
+            sol_key = self.kk_sol_map[kk]
+            grp = self._hdf[sol_key]
+            if itime != 0:
+                rhs = grp["drhsdh"][:][:, None] * lamb
+            else:
+                rhs = np.zeros((self.nnodes, ncol))
+            if kk in dfdh:
+                rhs -= np.asarray(dfdh[kk], dtype=float).reshape(self.nnodes, -1)
+            lamb = np.zeros((self.nnodes, ncol))
+            if not np.any(rhs != 0.0):
+                continue
+            lamb = self.solve_transpose(sol_key, rhs).reshape(self.nnodes, ncol)
+            # zero out the adj state for chd nodes
+            lamb[self.chd_nodes(sol_key), :] = 0.0
+
+            op_k, op_k33 = self.operators(sol_key)
+            composites["k11"] += op_k @ lamb
+            composites["k33"] += op_k33 @ lamb
+            if self.has_sto and grp["iss"][0] == 0:
+                composites["ss"] += grp["dresdss_h"][:][:, None] * lamb
+            composites["wel6_q"] += lamb
+            composites["rch6_recharge"] += lamb
+
+            head = None
+            for ptype, pnames in self.gwf_package_dict.items():
+                if ptype == "chd6" or ptype not in bnd_dict:
+                    continue
+                for pname in pnames:
+                    if pname not in grp:
+                        continue
+                    # the same (last entry wins) semantics as lam_drhs_dbnd()
+                    bound = grp[pname]["bound"][:]
+                    n = grp[pname]["nodelist"][:] - 1
+                    boundcond = np.full(n.shape[0], 1e10)
+                    if bound.shape[1] > 1:
+                        boundcond = bound[:, 1]
+                    sens_level = np.zeros((self.nnodes, ncol))
+                    sens_level[n, :] = boundcond[:, None] * lamb[n, :]
+                    composites[pname + "_" + bnd_dict[ptype][0]] += sens_level
+                    if len(bnd_dict[ptype]) > 1:
+                        if head is None:
+                            head = grp["head"][:]
+                        sens_cond = np.zeros((self.nnodes, ncol))
+                        sens_cond[n, :] = (bound[:, 0] - head[n])[:, None] * lamb[n, :]
+                        composites[pname + "_" + bnd_dict[ptype][1]] += sens_cond
+        return composites
+
+
+class GaussNewtonOperator(LinearOperator):
+    """Matrix-free Gauss-Newton Hessian operator J^T W J, where J holds the
+    sensitivities of the simulated heads of a set of head performance measure
+    entries to the parameters and W is the diagonal matrix of the entry weights.
+    Each product is one tangent-linear sweep for J v followed by one adjoint sweep
+    for J^T (W J v), both through the cached AMAT factorizations of a
+    `TangentLinear` instance, so the cost does not depend on the number of
+    entries.  Usually created with `Mf6Adj.gauss_newton_operator()`.  For the
+    residual performance measure sum(w (h - obs)^2), the Gauss-Newton Hessian is
+    2 J^T W J
+
+    Parameters
+    ----------
+    tl (TangentLinear) : the tangent-linear engine of the forward solution
+    locations (list) : (kper,kstp,inode) zero-based location of each entry
+    weights (list) : the weight of each entry
+    composites (list) : the composite names, in parameter order
+    projs (dict) : optional projection matrix (parameters by nodes), keyed by
+        composite name.  Composites that are not in `projs` (or are None) use one
+        parameter per node
+    par_names (list) : optional parameter names
+
+    """
+
+    def __init__(self, tl, locations, weights, composites, projs=None, par_names=None):
+        if projs is None:
+            projs = {}
+        self.tl = tl
+        self.composites = list(composites)
+        for name in self.composites:
+            if name not in tl.composite_names:
+                raise Exception(
+                    f"composite '{name}' not found, should be one of "
+                    + f"{tl.composite_names!s}"
+                )
+        self.projs = {name: projs.get(name, None) for name in self.composites}
+        self._sizes = [
+            tl.nnodes if self.projs[name] is None else self.projs[name].shape[0]
+            for name in self.composites
+        ]
+        npar = int(np.sum(self._sizes))
+        if par_names is not None and len(par_names) != npar:
+            raise Exception(f"{len(par_names)} parameter names for {npar} parameters")
+        self.par_names = par_names
+
+        itime_map = {kk: itime for itime, kk in enumerate(tl.kperkstp)}
+        self._itime, self._inode, self._weights, self._kk = [], [], [], []
+        for loc, weight in zip(locations, weights):
+            kk = (int(loc[0]), int(loc[1]))
+            if kk not in itime_map:
+                continue
+            self._kk.append(kk)
+            self._itime.append(itime_map[kk])
+            self._inode.append(int(loc[2]))
+            self._weights.append(float(weight))
+        self._itime = np.array(self._itime, dtype=int)
+        self._inode = np.array(self._inode, dtype=int)
+        self._weights = np.array(self._weights, dtype=float)
+        super().__init__(np.dtype(float), (npar, npar))
+
+    def close(self):
+        """close the underlying tangent-linear engine"""
+        self.tl.close()
+
+    def jvp(self, v):
+        """the Jacobian-vector products J v
+
+        Parameters
+        ----------
+        v (ndarray) : parameter vectors, parameters or parameters by vectors
+
+        Returns
+        -------
+        jv (ndarray) : the simulated head derivatives, entries by vectors
+
+        """
+        v = np.asarray(v, dtype=float).reshape(self.shape[1], -1)
+        directions = {}
+        for icol in range(v.shape[1]):
+            direction, offset = {}, 0
+            for name, size in zip(self.composites, self._sizes):
+                seg = v[offset : offset + size, icol]
+                offset += size
+                if self.projs[name] is not None:
+                    seg = self.projs[name].T @ seg
+                direction[name] = seg
+            directions[icol] = direction
+        results = self.tl.solve(directions, flows=False)
+        jv = np.zeros((self._inode.shape[0], v.shape[1]))
+        for icol in range(v.shape[1]):
+            jv[:, icol] = results[icol]["head"][self._itime, self._inode]
+        return jv
+
+    def vjp(self, u):
+        """the vector-Jacobian products J^T u
+
+        Parameters
+        ----------
+        u (ndarray) : entry vectors, entries or entries by vectors
+
+        Returns
+        -------
+        jtu (ndarray) : the parameter sensitivities, parameters by vectors
+
+        """
+        u = np.asarray(u, dtype=float).reshape(self._inode.shape[0], -1)
+        dfdh = {}
+        for i, kk in enumerate(self._kk):
+            if kk not in dfdh:
+                dfdh[kk] = np.zeros((self.tl.nnodes, u.shape[1]))
+            dfdh[kk][self._inode[i], :] += u[i, :]
+        composites = self.tl.adjoint(dfdh)
+        return np.concatenate(
+            [
+                composites[name]
+                if self.projs[name] is None
+                else self.projs[name] @ composites[name]
+                for name in self.composites
+            ]
+        )
+
+    def _matmat(self, x):
+        return self.vjp(self._weights[:, None] * self.jvp(x))
+
+    def _matvec(self, x):
+        return self._matmat(np.asarray(x).reshape(-1, 1)).ravel()
+
+    def _rmatvec(self, x):
+        return self._matvec(x)
+
+    def _adjoint(self):
+        return self